@@ -0,0 +1,53 @@
+"""Startup-time benchmark for the fluke CLI and the module loaded by the R package.
+
+Usage:
+    python benchmarks/cli_startup.py [--runs N] [--max-ms MS]
+
+Exits non-zero if the median of any case exceeds `--max-ms`.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+CASES: Dict[str, List[str]] = {
+    'python (baseline)': [sys.executable, '-c', 'pass'],
+    'fluke --help': [sys.executable, '-c',
+        'from fluke.cli import main; import sys; sys.argv = ["fluke", "--help"]; main()'],
+    'fluke dataset --help': [sys.executable, '-c',
+        'from fluke.cli import main; import sys; sys.argv = ["fluke", "dataset", "--help"]; main()'],
+    'import fluke.config.datasets': [sys.executable, '-c', 'import fluke.config.datasets'],
+}
+
+
+def time_case(args: List[str], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"CASE":<32}{"MEDIAN ms":>12}{"MIN ms":>10}')
+    for name, cmd in CASES.items():
+        timings = time_case(cmd, args.runs)
+        median = statistics.median(timings)
+        print(f'{name:<32}{median:>12.1f}{min(timings):>10.1f}')
+        if args.max_ms is not None and median > args.max_ms:
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
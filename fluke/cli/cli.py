@@ -1,20 +1,33 @@
+from pathlib import Path
+from typing import Optional
 import click
-from fluke.cli.project_create import create
-from fluke.cli.pipeline import pipeline
-from fluke.cli.dataset import dataset
+from fluke.cli.lazy import LazyGroup
+from fluke.rpool import POOL_SIZE_ENVVAR, configure_pool
+from fluke.trace import start_trace
 
 
-@click.group()
-def cli():
-    pass
+@click.group(cls=LazyGroup, lazy_subcommands={
+    'create': ('fluke.cli.project_create:create', 'create a Fluke project.'),
+    'pipeline': ('fluke.cli.pipeline:pipeline', 'Command-line interface for pipelines.'),
+    'dataset': ('fluke.cli.dataset:dataset', 'Manipulate and migrate datasets.'),
+    'stats': ('fluke.cli.stats:stats', 'Show performance history of runs.'),
+    'gc': ('fluke.cli.gc:gc', 'Delete old dataset versions and pipelines stores.'),
+})
+@click.option('--r-workers', type=int, default=0, envvar=POOL_SIZE_ENVVAR,
+    show_default=True,
+    help=('Number of long-lived R sessions reused across R commands. '
+    '0 spawns a fresh Rscript process per command.'))
+@click.option('--trace', type=click.Path(dir_okay=False, writable=True), default=None,
+    help=('Write timing spans of R calls and dataset stages to this file as '
+    'Chrome trace-event JSON.'))
+def cli(r_workers: int, trace: Optional[str]):
+    configure_pool(r_workers)
+    if trace is not None:
+        start_trace(Path(trace))
 
 
 def main():
-    cli.add_command(create)
-    cli.add_command(pipeline)
-    cli.add_command(dataset)
     cli()
     # cli = click.CommandCollection(
     # sources=[create_cli, query_cli])
 
-
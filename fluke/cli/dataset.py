@@ -1,7 +1,18 @@
+import functools
+from typing import Callable, Dict, List, Optional, Tuple
 import click
 from fluke.config.datasets import Datasets
-from fluke.datasets.query_dataset import QueryDataset
-from fluke.utils import RemoveRequire
+from fluke.datasets.query_dataset import (
+    BigQueryDataset,
+    BigQueryMetadata,
+    QueryDataset
+)
+from fluke.datasets.query_dataset.metadata import DEFAULT_TTL
+from fluke.jobs import JobResult, format_summary, run_jobs
+from fluke.logger import init_logger
+from fluke.utils import RemoveRequire, format_bytes, format_table
+
+logger = init_logger()
 
 @click.group(invoke_without_command = True)
 @click.pass_context
@@ -9,62 +20,299 @@ def dataset(ctx: click.Context) -> None:
     """
     Manipulate and migrate datasets.
     """
-    ds_config = Datasets()
-    ctx.obj = ds_config
+    if ctx.invoked_subcommand is None:
+        # validate the datasets config
+        Datasets()
+
+
+def pass_datasets(func):
+    """
+    Like `click.pass_obj`, but builds the `Datasets` config only once the
+    command runs, so that `--help` and completion do not read it.
+    """
+    @click.pass_context
+    @functools.wraps(func)
+    def wrapper(ctx: click.Context, *args, **kwargs):
+        if not isinstance(ctx.obj, Datasets):
+            ctx.obj = Datasets()
+        return ctx.invoke(func, ctx.obj, *args, **kwargs)
+    return wrapper
+
+
+def _run_query_datasets(ds_config: Datasets,
+action: Callable[[QueryDataset], Optional[str]], jobs: int,
+keep_going: bool) -> None:
+    """Run `action` on every query dataset, `jobs` at a time."""
+    _jobs: Dict[str, Callable[[], Optional[str]]] = {}
+    for _dataset in ds_config:
+        if isinstance(_dataset, QueryDataset):
+            _jobs[_dataset.name] = lambda _ds=_dataset: action(_ds)
+
+    _report(run_jobs(_jobs, max_workers=jobs, keep_going=keep_going))
+
+
+def _report(results: List[JobResult]) -> None:
+    """Print the summary of `results`, failing if any dataset failed."""
+    click.echo('\n' + format_summary(results))
+    failed = [res.name for res in results if not res.ok]
+    if failed:
+        raise click.ClickException(
+            f'{len(failed)} of {len(results)} datasets did not complete.')
+
+
+jobs_option = click.option(
+    '--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True,
+    help='Number of datasets to process concurrently with `--all`.')
+keep_going_option = click.option(
+    '--keep-going/--fail-fast', default=False, show_default=True,
+    help='Continue with remaining datasets after a failure.')
+download_workers_option = click.option(
+    '--download-workers', type=click.IntRange(min=1), default=1, show_default=True,
+    help='Number of concurrent row-range downloads per migrated table.')
+
+
+def _query_dataset(_dataset: QueryDataset, migrate: bool,
+changed_only: bool, force: bool,
+metadata: Optional[BigQueryMetadata] = None,
+download_workers: int = 1) -> Optional[str]:
+    """Query (and migrate) a dataset, skipping unchanged queries if asked."""
+    if _skip_query(_dataset, changed_only, force, metadata):
+        logger.info('Query and params unchanged since last run, skipping.')
+        if migrate and not _dataset.params.file_path.exists():
+            if metadata is not None and isinstance(_dataset, BigQueryDataset):
+                # the table is unchanged, so its batched metadata is current
+                _dataset.migrate(download_workers=download_workers,
+                    table_meta=metadata.get(_dataset))
+            else:
+                _dataset.migrate(download_workers=download_workers)
+        return 'skipped'
+
+    _dataset.perform_query()
+    if migrate:
+        _dataset.migrate(download_workers=download_workers)
+    return None
+
+
+def _skip_query(_dataset: QueryDataset, changed_only: bool, force: bool,
+metadata: Optional[BigQueryMetadata] = None) -> bool:
+    if not changed_only or force or _dataset.query_changed():
+        return False
+    if (metadata is not None and isinstance(_dataset, BigQueryDataset)
+    and not metadata.exists(_dataset)):
+        logger.info('Query unchanged but its table is missing, querying again.')
+        return False
+    return True
+
+
+def _query_datasets_async(ds_config: Datasets, migrate: bool,
+changed_only: bool, force: bool, metadata: Optional[BigQueryMetadata],
+jobs: int, keep_going: bool, download_workers: int = 1) -> None:
+    """
+    Submit every query at once and migrate each dataset as soon as its job
+    is done, `jobs` migrations at a time.
+    """
+    # imported here, asyncio is only needed with `--async`
+    import asyncio
+    from fluke.datasets.query_dataset.jobs import run_query_jobs
+
+    to_query: List[BigQueryDataset] = []
+    unchanged: Dict[str, Callable[[], Optional[str]]] = {}
+    for _dataset in ds_config:
+        if not isinstance(_dataset, QueryDataset):
+            continue
+        if not isinstance(_dataset, BigQueryDataset):
+            raise click.UsageError(
+                f'`--async` only supports BigQuery datasets (`{_dataset.name}`).')
+        if _skip_query(_dataset, changed_only, force, metadata):
+            unchanged[_dataset.name] = (lambda _ds=_dataset:
+                _query_dataset(_ds, migrate, changed_only, force, metadata,
+                download_workers))
+        else:
+            to_query.append(_dataset)
+
+    results = run_jobs(unchanged, max_workers=jobs, keep_going=keep_going)
+    if to_query and (keep_going or all(res.ok for res in results)):
+        results += asyncio.run(run_query_jobs(
+            to_query, migrate=migrate, max_migrations=jobs, keep_going=keep_going,
+            download_workers=download_workers))
+    _report(results)
+
 
 @dataset.command('query')
 @click.option('--all', required=False, is_flag=True)
 @click.option('--migrate', '-m', required=False, is_flag=True)
+@click.option('--changed-only', is_flag=True,
+    help='Skip datasets whose query, script and table are unchanged since their last query.')
+@click.option('--force', is_flag=True,
+    help='Run every selected query, overriding `--changed-only`.')
+@click.option('--async', 'use_async', is_flag=True,
+    help=('With `--all`, submit every query job at once and migrate each '
+    'dataset as soon as its job is done.'))
+@jobs_option
+@keep_going_option
+@download_workers_option
 @click.argument('name', cls=RemoveRequire, remove_req_if='all', required=False)
-@click.pass_obj
-def query(ds_config: Datasets, name: str, all: bool, migrate: bool) -> None:
+@pass_datasets
+def query(ds_config: Datasets, name: str, all: bool, migrate: bool,
+changed_only: bool, force: bool, use_async: bool, jobs: int,
+keep_going: bool, download_workers: int) -> None:
     """
         Query datasets with type `QueryDataset`.
     """
     if not ds_config.query_dataset_exists():
         raise click.UsageError(
             ('No query datasets found in `datasets.yaml`.'))
+    metadata = None
+    if changed_only and not force:
+        metadata = BigQueryMetadata()
     if all:
-        for _dataset in ds_config:
-            if isinstance(_dataset, QueryDataset):
-                _dataset.perform_query()
-                if migrate:
-                    _dataset.migrate()
+        if metadata is not None:
+            metadata.fetch_for(ds_config)
+        if use_async:
+            _query_datasets_async(ds_config, migrate, changed_only, force,
+                metadata, jobs, keep_going, download_workers)
+            return
+        _run_query_datasets(
+            ds_config,
+            lambda _ds: _query_dataset(_ds, migrate, changed_only, force, metadata,
+                download_workers),
+            jobs, keep_going)
     else:
         _dataset = ds_config[name]
         assert isinstance(_dataset, QueryDataset)
-        _dataset.perform_query()
-        if migrate:
-            _dataset.migrate()
+        _query_dataset(_dataset, migrate, changed_only, force, metadata,
+            download_workers)
+
+
+def _migrate_dataset(_dataset: QueryDataset, metadata: BigQueryMetadata,
+force: bool, full_refresh: bool, download_workers: int) -> Optional[str]:
+    """Migrate a dataset unless its remote table is unchanged since the last migration."""
+    if not isinstance(_dataset, BigQueryDataset):
+        _dataset.migrate(full_refresh=full_refresh, download_workers=download_workers)
+        return None
+
+    p = _dataset.params
+    meta = metadata.get(_dataset)
+    if meta is None:
+        raise Exception(
+            (f'Table {p.ver_tbl} does not exist in {p.project_id}.{p.dataset}. '
+            'Consider running `fluke dataset query` first.')
+        )
+    if not (force or full_refresh) and _dataset.migration_current(meta):
+        logger.info('Remote table unchanged since last migration, skipping.')
+        return 'skipped'
+    _dataset.migrate(full_refresh=full_refresh,
+        download_workers=download_workers, table_meta=meta)
+    return None
 
 
 @dataset.command('migrate')
 @click.option('--all', required=False, is_flag=True)
+@click.option('--full-refresh', is_flag=True,
+    help='Download incremental datasets in full instead of appending new rows.')
+@click.option('--force', is_flag=True,
+    help='Migrate even if the remote table is unchanged since the last migration.')
+@jobs_option
+@keep_going_option
+@download_workers_option
 @click.argument('name', cls=RemoveRequire, remove_req_if='all', required=False)
-@click.pass_obj
-def migrate(ds_config: Datasets, name: str, all: bool) -> None:
+@pass_datasets
+def migrate(ds_config: Datasets, name: str, all: bool, full_refresh: bool,
+force: bool, jobs: int, keep_going: bool, download_workers: int) -> None:
     """Migrate tables from Databases defined with type `QueryDataset`."""
     if not ds_config.query_dataset_exists():
         raise click.UsageError(
             ('No query datasets found in `datasets.yaml`')
         )
+    # check remote tables exist and have changed with one batched call
+    metadata = BigQueryMetadata()
     if all:
-        for _dataset in ds_config:
-            if isinstance(_dataset, QueryDataset):
-                _dataset.migrate()
+        metadata.fetch_for(ds_config, refresh=True)
+        _run_query_datasets(
+            ds_config,
+            lambda _ds: _migrate_dataset(_ds, metadata, force, full_refresh,
+                download_workers),
+            jobs, keep_going)
     else:
         _dataset = ds_config[name]
         assert isinstance(_dataset, QueryDataset)
-        _dataset.migrate()
-
-
-
-
+        metadata.fetch_for([_dataset], refresh=True)
+        _migrate_dataset(_dataset, metadata, force, full_refresh, download_workers)
 
 
+@dataset.command('status')
+@click.option('--refresh', is_flag=True,
+    help='Ignore cached table metadata.')
+@click.option('--ttl', type=float, default=DEFAULT_TTL, show_default=True,
+    help='Seconds for which cached table metadata is reused.')
+@pass_datasets
+def status(ds_config: Datasets, refresh: bool, ttl: float) -> None:
+    """Show remote and local state of query datasets."""
+    if not ds_config.query_dataset_exists():
+        raise click.UsageError(
+            ('No query datasets found in `datasets.yaml`.'))
 
+    metadata = BigQueryMetadata(ttl=ttl)
+    metadata.fetch_for(ds_config, refresh=refresh)
 
+    rows = [('NAME', 'TABLE', 'REMOTE', 'ROWS', 'SIZE', 'MODIFIED', 'LOCAL', 'QUERY')]
+    for _dataset in ds_config:
+        if not isinstance(_dataset, BigQueryDataset):
+            continue
+        p = _dataset.params
+        meta = metadata.get(_dataset)
+        if not p.file_path.exists():
+            local = 'missing'
+        elif meta is not None and _dataset.migration_current(meta):
+            local = 'current'
+        else:
+            local = 'stale'
+        query_state = 'changed' if _dataset.query_changed() else 'unchanged'
+        if meta is None:
+            rows.append((_dataset.name, p.ver_tbl, 'missing', '-', '-', '-',
+                local, query_state))
+        else:
+            rows.append((
+                _dataset.name, p.ver_tbl, 'exists', str(meta.num_rows),
+                format_bytes(meta.num_bytes),
+                meta.last_modified_dt.strftime('%Y-%m-%d %H:%M'),
+                local, query_state
+            ))
+    click.echo(format_table(rows))
 
 
+@dataset.command('benchmark')
+@click.option('--format', '-f', 'formats', multiple=True,
+    help=('Format to benchmark as `name` or `name:level`, e.g. `qs:9`. '
+    'Can be repeated. Defaults to every supported format.'))
+@click.option('--rows', type=click.IntRange(min=1), default=100000, show_default=True,
+    help='Number of rows in the sample.')
+@click.option('--repeat', type=click.IntRange(min=1), default=3, show_default=True,
+    help='Runs per format, the best time is reported.')
+@click.option('--threads', type=click.IntRange(min=1), default=None,
+    help='Thread count for formats that support it.')
+@click.argument('name')
+@pass_datasets
+def benchmark(ds_config: Datasets, name: str, formats: Tuple[str, ...], rows: int,
+repeat: int, threads: Optional[int]) -> None:
+    """
+    Compare write/read speed and file size of storage formats on a sample
+    of a query dataset, read locally if migrated or downloaded otherwise.
+    """
+    # imported here, only needed by this command
+    from fluke.datasets.benchmark import benchmark_formats
 
+    _dataset = ds_config[name]
+    if not isinstance(_dataset, BigQueryDataset):
+        raise click.UsageError(f'`{name}` is not a BigQuery dataset.')
+    results = benchmark_formats(_dataset, formats, rows=rows, repeat=repeat,
+        threads=threads)
 
+    table = [('FORMAT', 'ROWS', 'WRITE (s)', 'READ (s)', 'SIZE')]
+    for res in results:
+        if not res.available:
+            table.append((res.label, '-', '-', '-', 'not installed'))
+            continue
+        table.append((res.label, str(res.rows), f'{res.write_seconds:.3f}',
+            f'{res.read_seconds:.3f}', format_bytes(res.num_bytes)))
+    click.echo(format_table(table))
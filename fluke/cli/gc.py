@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import List, Optional
+import click
+from fluke.gc import GcItem, RetentionPolicy, collect, dedup, delete_items
+from fluke.jobs import JobResult, format_summary
+from fluke.utils import Cadence, format_bytes, format_table
+
+
+def _report(items: List[GcItem]) -> None:
+    rows = [('KIND', 'OWNER', 'VERSION', 'MODIFIED', 'SIZE', 'ACTION')]
+    for item in sorted(items, key=lambda i: (i.kind, i.owner, -i.modified)):
+        rows.append((
+            item.kind, item.owner, item.version,
+            datetime.fromtimestamp(item.modified).strftime('%Y-%m-%d %H:%M'),
+            format_bytes(item.num_bytes),
+            f'keep ({item.keep_reason})' if item.keep else 'delete'
+        ))
+    click.echo(format_table(rows))
+
+    deleted = [item for item in items if not item.keep]
+    local = sum(item.num_bytes for item in deleted if item.kind != 'bigquery')
+    remote = sum(item.num_bytes for item in deleted if item.kind == 'bigquery')
+    click.echo(
+        (f'\n{len(deleted)} of {len(items)} versions to delete: '
+        f'{format_bytes(local)} on disk, {format_bytes(remote)} of BigQuery storage.'))
+
+
+@click.command('gc')
+@click.option('--keep-last', type=click.IntRange(min=0), default=3, show_default=True,
+    help='Number of most recent versions to keep besides the current ones.')
+@click.option('--cadence', type=click.Choice(Cadence.cadence_options), default=None,
+    help='Also keep the most recent version of each day, week or month.')
+@click.option('--keep-periods', type=click.IntRange(min=1), default=6, show_default=True,
+    help='Number of most recent periods kept with `--cadence`.')
+@click.option('--bigquery/--no-bigquery', default=True, show_default=True,
+    help='Collect versioned BigQuery tables of the datasets.')
+@click.option('--dedup/--no-dedup', 'dedup_files', default=True, show_default=True,
+    help='Hard link identical files of the kept local versions and stores.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=4, show_default=True,
+    help='Number of concurrent BigQuery table deletions.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+@click.option('--yes', '-y', is_flag=True, help='Do not ask for confirmation.')
+def gc(keep_last: int, cadence: Optional[str], keep_periods: int, bigquery: bool,
+dedup_files: bool, jobs: int, dry_run: bool, yes: bool) -> None:
+    """
+    Delete old versions of dataset tables, migrated datasets and pipelines
+    stores. The versions in `datasets.yaml` and `pipelines.yaml` are kept.
+    """
+    policy = RetentionPolicy(
+        keep_last=keep_last,
+        cadence=Cadence(cadence) if cadence is not None else None,
+        keep_periods=keep_periods
+    )
+    items = collect(policy, bigquery=bigquery, refresh=True)
+    if not items:
+        click.echo('Nothing to collect.')
+        return
+    _report(items)
+
+    if dedup_files:
+        result = dedup(items, dry_run=True)
+        if result.linked:
+            click.echo(
+                (f'{result.linked} identical files can be hard linked, '
+                f'saving {format_bytes(result.saved_bytes)}.'))
+
+    if dry_run:
+        return
+    results: List[JobResult] = []
+    if any(not item.keep for item in items):
+        if not yes and not click.confirm('Delete these versions?'):
+            return
+        results = delete_items(items, jobs=jobs)
+        click.echo('\n' + format_summary(results))
+    if dedup_files:
+        result = dedup([item for item in items if item.keep])
+        if result.linked:
+            click.echo(
+                (f'Hard linked {result.linked} identical files, '
+                f'saved {format_bytes(result.saved_bytes)}.'))
+
+    failed = [res.name for res in results if not res.ok]
+    if failed:
+        raise click.ClickException(f'{len(failed)} versions could not be deleted.')
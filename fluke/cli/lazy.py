@@ -0,0 +1,51 @@
+"""Click group that imports its subcommands only when they are used."""
+import importlib
+from typing import Dict, List, Optional, Tuple
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    A `click.Group` whose subcommands are given as
+    `{name: ('module.path:attribute', 'short help')}` and only imported when
+    invoked. The short help is used for `--help` so that listing commands
+    does not import them.
+    """
+    def __init__(self, *args,
+    lazy_subcommands: Optional[Dict[str, Tuple[str, str]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_subcommands:
+            return self._load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load(self, cmd_name: str) -> click.Command:
+        import_path, _ = self.lazy_subcommands[cmd_name]
+        module_name, attr = import_path.split(':')
+        cmd = getattr(importlib.import_module(module_name), attr)
+        if not isinstance(cmd, click.Command):
+            raise ValueError(f'`{import_path}` is not a click command.')
+        # cache the loaded command like a regular subcommand
+        self.add_command(cmd, cmd_name)
+        del self.lazy_subcommands[cmd_name]
+        return cmd
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.lazy_subcommands:
+                rows.append((name, self.lazy_subcommands[name][1]))
+                continue
+            cmd = self.get_command(ctx, name)
+            if cmd is None or cmd.hidden:
+                continue
+            rows.append((name, cmd.get_short_help_str(formatter.width)))
+
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
@@ -1,12 +1,28 @@
+import json
 import shutil
+import subprocess
+import sys
+import threading
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import click
 import fluke
+from fluke.config.pipelines import PipelinesConfig
+from fluke.jobs import JobResult, format_summary, run_jobs
+from fluke.ledger import RunLedger, ledger_run
+from fluke.pipelines import PipelineRun, run_pipelines
+from fluke.pipelines.meta import TargetMeta, read_meta, read_targets
+from fluke.pipelines.prefetch import Prefetcher, dataset_path_targets, names_make_cmd
+from fluke.pipelines.profile import TargetProfile, pipeline_graph, profile_pipeline
+from fluke.pipelines.shard import plan_shards, read_plan, run_shard, write_plan
+from fluke.pipelines.store import clone_store
 from fluke.utils import (
     RemoveRequire,
     find_root_proj,
     _create_dir_using_cookiecutter,
+    format_bytes,
+    format_table,
     get_project_config,
     run_r,
     sym_wrap
@@ -48,10 +64,9 @@ def pipeline(ctx: click.Context, list_pipelines: bool) -> None:
     Command-line interface for pipelines.
     """
     deps = PipelineDependencies()
-    ppl = get_pipelines()
     ctx.obj = deps
     if list_pipelines:
-        for pp in ppl:
+        for pp in get_pipelines():
             click.echo(pp.name)
 
 
@@ -96,22 +111,84 @@ def get_pipeline_names_click(ctx, args, incomplete):
 @pipeline.command('run')
 @click.option('--parallel', 'parallel', is_flag=True)
 @click.option('--target', required=False, default='')
-@click.option('--name', required=False)
+@click.option('--name', 'names', multiple=True,
+    help='Pipeline to run. Can be repeated.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True,
+    help=('Number of `targets` workers shared by pipelines running concurrently. '
+    'With several `--name` or `--jobs` above 1, each pipeline is made by its own '
+    'R process into its own store.'))
+@click.option('--keep-going/--fail-fast', default=False, show_default=True,
+    help='Continue with remaining pipelines after a failure.')
+@click.option('--seed-from', default=None, metavar='OLD_VERSION',
+    help=('Start the store of the current `pipelines.version` from a clone of '
+    'the store of OLD_VERSION, so that only changed targets are rebuilt.'))
+@click.option('--shards', type=click.IntRange(min=1), default=None, metavar='N',
+    help=('Split the targets into N dependency-respecting shards and make each '
+    'with its own process, see `--shard`.'))
+@click.option('--plan-only', is_flag=True,
+    help='With `--shards`, only write the plan, to start the shards on other hosts.')
+@click.option('--shard', 'shard', default=None, metavar='I/N',
+    help=('Make shard I of the N of the current plan against the shared store. '
+    'Shards wait on each other for the targets they depend on.'))
+@click.option('--shard-timeout', type=click.FloatRange(min=0), default=None,
+    metavar='SECONDS',
+    help=('Fail a shard that waits this long on other shards without any of '
+    'them making progress. Shards whose peers stop sending heartbeats fail anyway.'))
+@click.option('--prefetch', is_flag=True,
+    help=('Query and migrate the datasets used by the pipeline in the background, '
+    'making the targets that do not need them meanwhile.'))
+@click.option('--prefetch-jobs', type=click.IntRange(min=1), default=2, show_default=True,
+    help='Number of datasets prefetched concurrently.')
 @click.pass_obj
-def run(deps: PipelineDependencies, name: Optional[str],
-target: Optional[str], parallel: bool) -> None:
+def run(deps: PipelineDependencies, names: Tuple[str, ...],
+target: Optional[str], parallel: bool, jobs: int, keep_going: bool,
+seed_from: Optional[str], shards: Optional[int], plan_only: bool,
+shard: Optional[str], shard_timeout: Optional[float], prefetch: bool,
+prefetch_jobs: int) -> None:
     """Run the `targets` make for pipeline."""
+    if shard is not None:
+        _run_shard(shard, shard_timeout)
+        return
 
-    make_func = 'targets::tar_make'
-    if parallel:
-        make_func = 'targets::tar_make_future'
-
-    if name is not None and target == '':
+    for name in names:
         if not Path(deps.project_pipeline_dir, name).exists():
             raise click.UsageError(
                 (f'Pipeline `{name}` does not exist. '
                 'Consider creating one using `pipeline create.`')
             )
+
+    if seed_from is not None:
+        _seed_store(PipelinesConfig(), seed_from)
+
+    if shards is not None:
+        if len(names) > 1 or target != '':
+            raise click.UsageError(
+                '`--shards` takes at most one `--name` and no `--target`.')
+        _run_sharded(names[0] if names else None, shards, plan_only, shard_timeout)
+        return
+
+    if prefetch:
+        if len(names) > 1 or jobs > 1 or target != '' or parallel:
+            raise click.UsageError(
+                ('`--prefetch` takes at most one `--name` and no `--target`, '
+                '`--jobs` or `--parallel`.'))
+        _run_prefetching(names[0] if names else None, prefetch_jobs, keep_going)
+        return
+
+    if len(names) > 1 or jobs > 1:
+        if target != '':
+            raise click.UsageError(
+                '`--target` cannot be used when running several pipelines.')
+        _run_concurrently(list(names) or [pp.name for pp in get_pipelines()],
+            jobs, keep_going)
+        return
+
+    name = names[0] if names else None
+    make_func = 'targets::tar_make'
+    if parallel:
+        make_func = 'targets::tar_make_future'
+
+    if name is not None and target == '':
         target = f"get_targets(prepare_targets(pipelines, name = '{name}'), names = TRUE)"
 
     tar_make_cmd =f"""
@@ -120,4 +197,304 @@ target: Optional[str], parallel: bool) -> None:
     {make_func}({target})
     """
 
-    run_r(tar_make_cmd, ['-e'])
+    with ledger_run('pipeline', name or 'all'):
+        run_r(tar_make_cmd, ['-e'])
+
+
+def _seed_store(config: PipelinesConfig, old_version: str) -> None:
+    if config.version is None:
+        raise click.UsageError(
+            '`--seed-from` needs `pipelines.version` set in `config/pipelines.yaml`.')
+    if old_version == config.version:
+        raise click.UsageError(
+            f'`--seed-from` must name a version other than `{config.version}`.')
+    source = config.version_store(old_version)
+    if not source.is_dir():
+        raise click.UsageError(f'No store found for version `{old_version}` at `{source}`.')
+    if config.store.exists():
+        raise click.UsageError(
+            (f'The store of version `{config.version}` already exists, '
+            'remove it to seed it again.'))
+
+    methods = clone_store(source, config.store)
+    counts = ', '.join(f'{count} {method}' for method, count in sorted(methods.items()))
+    click.echo(
+        f'Seeded store `{config.version}` from `{old_version}` ({counts or "no files"}).')
+
+
+def _run_concurrently(names: List[str], jobs: int, keep_going: bool) -> None:
+    config = PipelinesConfig()
+    runs = [
+        PipelineRun(name, config.pipeline_store(name), config.resources(name))
+        for name in names
+    ]
+    results = run_pipelines(runs, max_workers=jobs, keep_going=keep_going)
+    click.echo('\n' + format_summary(results))
+    failed = [res.name for res in results if not res.ok]
+    if failed:
+        raise click.ClickException(
+            f'{len(failed)} of {len(results)} pipelines did not complete.')
+
+
+def _parse_shard(shard: str) -> Tuple[int, int]:
+    index, _, n = shard.partition('/')
+    if not (index.isdigit() and n.isdigit()) or not 1 <= int(index) <= int(n):
+        raise click.UsageError(
+            f'`--shard` must be I/N with 1 <= I <= N, e.g. `1/4`, not `{shard}`.')
+    return int(index), int(n)
+
+
+def _run_shard(shard: str, timeout: Optional[float] = None) -> None:
+    index, n = _parse_shard(shard)
+    config = PipelinesConfig()
+    try:
+        plan = read_plan(config.store)
+    except FileNotFoundError as error:
+        raise click.UsageError(
+            'No shards plan found. Plan with `fluke pipeline run --shards N --plan-only`.'
+        ) from error
+    try:
+        with ledger_run('pipeline', f'{plan.name or "all"}[{index}/{n}]'):
+            made = run_shard(config.store, index - 1, n, timeout=timeout)
+    except Exception as error:
+        raise click.ClickException(f'Shard {index}/{n}: {error}') from error
+    click.echo(f'Shard {index}/{n} made {len(made)} targets.')
+
+
+def _run_sharded(name: Optional[str], n: int, plan_only: bool,
+timeout: Optional[float] = None) -> None:
+    config = PipelinesConfig()
+    try:
+        meta = read_meta(config.store)
+    except FileNotFoundError:
+        meta = {}
+    plan = plan_shards(pipeline_graph(name), meta, n, name=name)
+    write_plan(config.store, plan)
+    sizes = ', '.join(str(len(targets)) for targets in plan.shards)
+    click.echo(f'Planned {len(plan.deps)} targets in {n} shards ({sizes}).')
+    if plan_only:
+        click.echo(
+            (f'Start each shard with `fluke pipeline run --shard I/{n}`, '
+            'preferably with `--shard-timeout`.'))
+        return
+
+    echo_lock = threading.Lock()
+
+    def make(index: int) -> None:
+        label = f'shard {index}/{n}'
+        args = [sys.executable, '-c', 'from fluke.cli import main; main()',
+            'pipeline', 'run', '--shard', f'{index}/{n}']
+        if timeout is not None:
+            args += ['--shard-timeout', str(timeout)]
+        proc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            with echo_lock:
+                click.echo(f'[{label}] {line.rstrip()}')
+        returncode = proc.wait()
+        if returncode != 0:
+            raise Exception(f'{label} failed with exit code {returncode}.')
+
+    # shards wait on each other, so they all run at once
+    results: List[JobResult] = run_jobs(
+        {f'shard {i}/{n}': partial(make, i) for i in range(1, n + 1)},
+        max_workers=n, keep_going=True)
+    click.echo('\n' + format_summary(results))
+    failed = [res.name for res in results if not res.ok]
+    if failed:
+        raise click.ClickException(f'{len(failed)} of {n} shards did not complete.')
+
+
+def _run_prefetching(name: Optional[str], jobs: int, keep_going: bool) -> None:
+    from fluke.cli.dataset import _query_dataset
+    from fluke.config.datasets import Datasets
+    from fluke.datasets.query_dataset import BigQueryMetadata, QueryDataset
+    graph = pipeline_graph(name)
+    datasets = Datasets()
+    path_targets = dataset_path_targets(graph, datasets.ds_config)
+    to_fetch = [
+        datasets[ds] for ds in path_targets if isinstance(datasets[ds], QueryDataset)
+    ]
+    # as `fluke dataset query --changed-only -m`: unchanged migrated datasets are ready
+    metadata = BigQueryMetadata()
+    metadata.fetch_for(to_fetch)
+    fetches = {
+        ds.name: partial(_query_dataset, ds, True, True, False, metadata)
+        for ds in to_fetch
+    }
+    click.echo(
+        f'Prefetching {len(fetches)} datasets used by {len(graph)} targets.')
+
+    prefetcher = Prefetcher(
+        graph, fetches, path_targets,
+        lambda targets: run_r(names_make_cmd(targets), ['-e']),
+        jobs=jobs, keep_going=keep_going)
+    with ledger_run('pipeline', name or 'all'):
+        results = prefetcher.run()
+        click.echo('\n' + format_summary(results))
+        if prefetcher.blocked:
+            raise click.ClickException(
+                (f'{len(prefetcher.blocked)} targets were not made as '
+                f'{sum(not res.ok for res in results)} datasets did not complete.'))
+
+
+def _target_stores(config: PipelinesConfig) -> Dict[str, Path]:
+    from fluke.config.datasets import TARGETS_STORE
+    stores = {
+        'datasets': Path(config.root, TARGETS_STORE),
+        'pipelines': config.store
+    }
+    for name, store in config.pipeline_stores().items():
+        stores[f'pipelines/{name}'] = store
+    return stores
+
+
+def _changed_datasets(targets: List[TargetMeta]) -> List[str]:
+    """Targets of the datasets store whose dataset file is newer than the target."""
+    from fluke.config.datasets import Datasets
+    from fluke.datasets.manifest import file_stat
+    datasets = Datasets()
+    changed = []
+    for target in targets:
+        if target.name not in datasets or target.time is None:
+            continue
+        path = datasets._dataset_path(datasets[target.name])
+        if not path.exists() or file_stat(path)['mtime_ns'] / 1e9 > target.time:
+            changed.append(target.name)
+    return changed
+
+
+def _target_status(target: TargetMeta, root: Path, changed: List[str]) -> str:
+    if target.errored:
+        return 'errored'
+    if target.name in changed or target.stale_files(root):
+        return 'stale'
+    return target.progress or 'built'
+
+
+@pipeline.command('status')
+@click.option('--errored', 'errored_only', is_flag=True,
+    help='Only show errored targets.')
+def status(errored_only: bool) -> None:
+    """
+    Show the targets recorded in the datasets and pipelines stores, read
+    from their meta files without starting R. Targets whose files or
+    datasets changed since they were built are shown as stale; use
+    `targets::tar_outdated` for a full check of commands and dependencies.
+    """
+    config = PipelinesConfig()
+    found = False
+    for label, store in _target_stores(config).items():
+        try:
+            targets = read_targets(store)
+        except FileNotFoundError:
+            continue
+        found = True
+        changed = _changed_datasets(targets) if label == 'datasets' else []
+        statuses = {t.name: _target_status(t, config.root, changed) for t in targets}
+        errored = [t for t in targets if statuses[t.name] == 'errored']
+        stale = [t for t in targets if statuses[t.name] == 'stale']
+        total = sum(t.seconds or 0 for t in targets)
+        click.echo(
+            (f'\n{label} ({store}): {len(targets)} targets, {len(errored)} errored, '
+            f'{len(stale)} stale, {total:.1f}s'))
+
+        rows = [('NAME', 'STATUS', 'SECONDS', 'SIZE', 'BUILT', 'DATA', 'COMMAND')]
+        for t in (errored if errored_only else targets):
+            rows.append((
+                t.name, statuses[t.name],
+                f'{t.seconds:.2f}' if t.seconds is not None else '-',
+                format_bytes(t.bytes) if t.bytes is not None else '-',
+                t.built_at.strftime('%Y-%m-%d %H:%M:%S') if t.built_at else '-',
+                t.data or '-', t.command or '-'
+            ))
+        if len(rows) > 1:
+            click.echo(format_table(rows))
+        for t in errored:
+            click.echo(f'{t.name}: {t.error or "errored"}')
+
+    if not found:
+        click.echo('No targets store found. Run `fluke pipeline run` first.')
+
+
+@pipeline.command('profile')
+@click.option('--name', default=None,
+    help='Profile the store of a pipeline made on its own process.')
+@click.option('--workers', '-w', type=click.IntRange(min=1), multiple=True,
+    help='Worker counts to estimate the makespan for. Defaults to 1, 2, 4 and 8.')
+@click.option('--top', type=click.IntRange(min=1), default=10, show_default=True,
+    help='Number of slowest and largest targets to show.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the profile as JSON.')
+def profile(name: Optional[str], workers: Tuple[int, ...], top: int,
+as_json: bool) -> None:
+    """
+    Show the critical path, the slowest and largest targets and the
+    speedup more workers could give, from the seconds and bytes recorded
+    in the targets store and the pipelines dependency graph.
+    """
+    config = PipelinesConfig()
+    store = config.pipeline_store(name) if name is not None else config.store
+    try:
+        meta = read_meta(store)
+    except FileNotFoundError as error:
+        raise click.ClickException(
+            f'No targets store found at `{store}`. Run `fluke pipeline run` first.'
+        ) from error
+
+    graph = {
+        target: deps for target, deps in pipeline_graph().items() if target in meta
+    }
+    runs = RunLedger().runs(kind='pipeline', name=name or 'all', status='ok')
+    result = profile_pipeline(
+        meta, graph, workers=workers or (1, 2, 4, 8),
+        achieved_seconds=runs[-1].seconds if runs else None)
+
+    if as_json:
+        click.echo(json.dumps(result.to_dict(top), indent=2))
+        return
+
+    click.echo(
+        (f'{len(result.targets)} targets, {result.total_seconds:.1f}s of work, '
+        f'critical path {result.critical_seconds:.1f}s, '
+        f'max parallelism {result.max_parallelism:.1f}x'))
+
+    click.echo('\nCritical path')
+    rows = [('NAME', 'SECONDS', 'SIZE')]
+    rows += [_profile_row(result.targets[target]) for target in result.critical_path]
+    click.echo(format_table(rows))
+
+    click.echo('\nSlowest targets')
+    rows = [('NAME', 'SECONDS', 'SIZE')]
+    rows += [_profile_row(t) for t in result.slowest(top)]
+    click.echo(format_table(rows))
+
+    click.echo('\nLargest targets')
+    rows = [('NAME', 'SECONDS', 'SIZE')]
+    rows += [_profile_row(t) for t in result.largest(top)]
+    click.echo(format_table(rows))
+
+    click.echo('\nParallelism headroom')
+    rows = [('WORKERS', 'IDEAL (s)', 'IDEAL SPEEDUP', 'SCHEDULED (s)', 'SCHEDULED SPEEDUP')]
+    for h in result.headroom:
+        rows.append((
+            str(h.workers), f'{h.ideal_seconds:.1f}', f'{h.ideal_speedup:.2f}x',
+            f'{h.scheduled_seconds:.1f}', f'{h.scheduled_speedup:.2f}x'
+        ))
+    click.echo(format_table(rows))
+    if result.achieved_seconds is not None and result.achieved_speedup is not None:
+        click.echo(
+            (f'Last make took {result.achieved_seconds:.1f}s, a '
+            f'{result.achieved_speedup:.2f}x speedup over the work done.'))
+
+
+def _profile_row(target: TargetProfile) -> Tuple[str, str, str]:
+    return (
+        target.name, f'{target.seconds:.2f}',
+        format_bytes(target.bytes) if target.bytes is not None else '-'
+    )
@@ -9,9 +9,7 @@ import fluke
 from functools import wraps
 from pathlib import Path
 import click
-from cookiecutter.main import cookiecutter
 from tempfile import TemporaryDirectory
-from distutils.dir_util import copy_tree
 from fluke.utils import (
   get_cookiecutter_cfg,
   cwd,
@@ -24,9 +22,11 @@ template_dir = Path(
     'project'
 )
 
-config_path = get_cookiecutter_cfg(template_dir)
-with config_path.open('r', encoding='utf-8') as file:
-    config = json.load(file)
+
+def _load_template_config() -> dict:
+    config_path = get_cookiecutter_cfg(template_dir)
+    with config_path.open('r', encoding='utf-8') as file:
+        return json.load(file)
 
 
 @click.group()
@@ -84,7 +84,12 @@ def create(path: str, pkg_name: Optional[str], project_name: Optional[str]) -> N
         pkg_name = click.prompt('Name of R package')
     _is_pkgname_valid(pkg_name)
 
+    # imported here since loading cookiecutter is slow
+    from distutils.dir_util import copy_tree
+    from cookiecutter.main import cookiecutter
+
     # add needed settings to config file
+    config = _load_template_config()
     config['project_name'] = project_name
     config['pkg_name'] = pkg_name
     config['python_path'] = sys.executable
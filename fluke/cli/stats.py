@@ -0,0 +1,82 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import click
+from fluke.ledger import RunLedger, RunRecord, percentile
+from fluke.utils import format_bytes, format_table
+
+
+def _seconds(value: Optional[float]) -> str:
+    return f'{value:.1f}' if value is not None else '-'
+
+
+def _regression(runs: List[RunRecord], window: int, threshold: float,
+attr: str) -> Optional[Tuple[float, float]]:
+    """
+    `(latest, baseline)` if the latest value of `attr` exceeds the median
+    of the `window` previous values by more than `threshold` times.
+    """
+    values = [getattr(run, attr) for run in runs if getattr(run, attr) is not None]
+    if len(values) < 2:
+        return None
+    latest, previous = values[-1], values[-window - 1:-1]
+    baseline = percentile(previous, 50)
+    if baseline > 0 and latest > baseline * threshold:
+        return latest, baseline
+    return None
+
+
+@click.command('stats')
+@click.option('--kind', type=click.Choice(['query', 'migrate', 'pipeline']),
+    default=None, help='Only show runs of this kind.')
+@click.option('--window', '-n', type=click.IntRange(min=1), default=10, show_default=True,
+    help='Number of previous runs the latest run is compared to.')
+@click.option('--threshold', type=click.FloatRange(min=1), default=1.5, show_default=True,
+    help='Ratio to the previous runs\' median flagged as a regression.')
+@click.option('--top', type=click.IntRange(min=1), default=5, show_default=True,
+    help='Number of slowest datasets to show.')
+def stats(kind: Optional[str], window: int, threshold: float, top: int) -> None:
+    """Show run-time percentiles, regressions and the slowest datasets."""
+    runs = RunLedger().runs(kind=kind, status='ok')
+    if not runs:
+        click.echo('No successful runs recorded yet.')
+        return
+
+    grouped: Dict[Tuple[str, str], List[RunRecord]] = defaultdict(list)
+    for run in runs:
+        grouped[(run.kind, run.name)].append(run)
+
+    rows = [('KIND', 'NAME', 'RUNS', 'P50 (s)', 'P90 (s)', 'MAX (s)', 'LAST (s)', 'LAST SIZE')]
+    regressions = [('KIND', 'NAME', 'METRIC', 'LAST', f'MEDIAN OF {window}', 'RATIO')]
+    medians = []
+    for (_kind, name), group in sorted(grouped.items()):
+        seconds = [run.seconds for run in group]
+        last = group[-1]
+        median = percentile(seconds, 50)
+        medians.append((median, _kind, name))
+        rows.append((
+            _kind, name, str(len(group)), _seconds(median),
+            _seconds(percentile(seconds, 90)), _seconds(max(seconds)),
+            _seconds(last.seconds),
+            format_bytes(last.bytes) if last.bytes is not None else '-'
+        ))
+        for attr, fmt in (('seconds', _seconds), ('bytes', format_bytes)):
+            found = _regression(group, window, threshold, attr)
+            if found is not None:
+                latest, baseline = found
+                regressions.append((_kind, name, attr, fmt(latest), fmt(baseline),
+                    f'{latest / baseline:.2f}x'))
+
+    click.echo(format_table(rows))
+    click.echo('\nRegressions')
+    if len(regressions) > 1:
+        click.echo(format_table(regressions))
+    else:
+        click.echo('None.')
+
+    slowest = [('KIND', 'NAME', 'P50 (s)')] + [
+        (_kind, name, _seconds(median))
+        for median, _kind, name in sorted(medians, reverse=True)
+        if _kind != 'pipeline'
+    ][:top]
+    click.echo('\nSlowest datasets')
+    click.echo(format_table(slowest))
@@ -0,0 +1,78 @@
+"""On-disk cache of parsed YAML config files."""
+import hashlib
+import pickle
+import time
+from pathlib import Path
+from typing import Any, Optional
+from fluke.datasets.manifest import atomic_write_bytes
+
+_CACHE_VERSION = 2
+# files modified this close to the cache write may change again without
+# changing their mtime (coarse filesystem timestamps), see `load_yaml_cached`
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+def yaml_safe_load(stream: Any) -> Any:
+    """`yaml.safe_load`, using the C loader when available."""
+    # imported here so that warm loads never import yaml
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(stream, Loader=loader)
+
+
+def _read_cache(cache_path: Path) -> Optional[dict]:
+    try:
+        with cache_path.open('rb') as file:
+            entry = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError,
+    ImportError, IndexError, TypeError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('version') != _CACHE_VERSION:
+        return None
+    return entry
+
+
+def _write_cache(cache_path: Path, entry: dict) -> None:
+    try:
+        atomic_write_bytes(
+            cache_path, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        # caching is best effort, e.g. on read-only project directories
+        pass
+
+
+def load_yaml_cached(path: Path, cache_path: Path) -> Any:
+    """
+    Load the YAML file at `path`, reusing the parsed content stored at
+    `cache_path` while the file is unchanged.
+
+    The cache is valid if the file's mtime and size match, unless the
+    mtime is within `_RACY_WINDOW_NS` of when the cache was written: the
+    file may have been written again in the same timestamp tick. In that
+    case, or if only the mtime and size differ (e.g. the file was touched),
+    the content hash is compared before parsing again.
+    """
+    stat = path.stat()
+    entry = _read_cache(cache_path)
+    if (entry is not None and entry['mtime_ns'] == stat.st_mtime_ns
+    and entry['size'] == stat.st_size
+    and stat.st_mtime_ns < entry['cached_at_ns'] - _RACY_WINDOW_NS):
+        return entry['content']
+
+    raw = path.read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    if entry is not None and entry['sha256'] == digest:
+        content = entry['content']
+    else:
+        content = yaml_safe_load(raw)
+
+    _write_cache(cache_path, {
+        'version': _CACHE_VERSION,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': digest,
+        # rewritten by later loads until the mtime is no longer racy
+        'cached_at_ns': time.time_ns(),
+        'content': content
+    })
+    return content
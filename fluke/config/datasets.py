@@ -1,6 +1,14 @@
+import threading
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Type, TypedDict, Union
-import yaml
+from typing import Any, Dict, Iterator, Optional, Type, TypedDict, Union
+from fluke.config.cache import load_yaml_cached
+from fluke.datasets.manifest import (
+    JsonManifest,
+    atomic_write_text,
+    file_stat,
+    fluke_state_dir,
+    hash_strings
+)
 from fluke.utils import find_root_proj, run_r
 from fluke.logger import init_logger
 from fluke.datasets.abstract import AbstractDataset
@@ -9,6 +17,15 @@ from fluke.datasets.csv_dataset import CSVDataset
 
 logger = init_logger()
 
+TARGETS_SCRIPT = 'datasets/tar_script_datasets.R'
+TARGETS_STORE = 'datasets/_tar_datasets_store'
+TARGETS_STATE = 'targets.json'
+
+DATASET_TYPES: Dict[str, Type[AbstractDataset]] = {
+    'csv' : CSVDataset,
+    'bigquery': BigQueryDataset
+}
+
 def dataset_class_factory(
     dataset_type: str,
     name: str,
@@ -17,13 +34,7 @@ def dataset_class_factory(
     """
     generates an instantiated Dataset Class from name and params.
     """
-
-    datasets: Dict[str, Type[AbstractDataset]] = {
-        'csv' : CSVDataset,
-        'bigquery': BigQueryDataset
-    }
-
-    dataset_object = datasets[dataset_type](name, params)
+    dataset_object = DATASET_TYPES[dataset_type](name, params)
 
     return dataset_object
 
@@ -37,107 +48,153 @@ class DatasetsYAMLConfig(TypedDict):
     datasets: Dict[str, DatasetConfig]
 
 class Datasets:
-    """Class to be instantiated to encapsulate datasets info."""
+    """Class to be instantiated to encapsulate datasets info.
+
+    Dataset objects are only built on first access and kept in a
+    name-keyed index. A location-keyed index is built once, on the first
+    `get_dataset_by_loc` call.
+    """
     def __init__(self):
-        datasets_yaml_config: DatasetsYAMLConfig
-        ds_config: Dict[str, DatasetConfig]
+        datasets_yaml_config: Optional[DatasetsYAMLConfig]
         self.ds_config_path = Path(find_root_proj(), 'config', 'datasets.yaml')
-        with self.ds_config_path.open('r', encoding='utf-8') as cfg:
-            try:
-                datasets_yaml_config = yaml.safe_load(cfg)
-                ds_config =  datasets_yaml_config['datasets']
-            except KeyError as error:
-                print('datasets.yaml does not contain `datasets` node.')
-        self.ds_config = ds_config
-
-        _list: List[AbstractDataset] = []
-        for name, values in self.ds_config.items():
-            _dataset_obj = dataset_class_factory(values['type'], name, values['params'])
-            _list.append(_dataset_obj)
-        self._list = _list
-
-    def __iter__(self):
-        self._index = 0
-        return self
-
-    def __next__(self) -> AbstractDataset:
-        if self._index < len(self._list):
-            out = self._list[self._index]
-            self._index += 1
-            return out
-        else:
-            raise StopIteration
+        datasets_yaml_config = load_yaml_cached(
+            self.ds_config_path,
+            Path(fluke_state_dir(), 'datasets.yaml.cache')
+        )
+        # an empty or fully commented-out config has no datasets
+        if datasets_yaml_config is None:
+            datasets_yaml_config = {'datasets': {}}
+        try:
+            ds_config = datasets_yaml_config['datasets'] or {}
+        except KeyError as error:
+            raise KeyError(
+                'datasets.yaml does not contain `datasets` node.'
+            ) from error
+        self.ds_config: Dict[str, DatasetConfig] = ds_config
+
+        self._objects: Dict[str, AbstractDataset] = {}
+        self._loc_index: Optional[Dict[Path, str]] = None
+        self._lock = threading.RLock()
 
+    def __iter__(self) -> Iterator[AbstractDataset]:
+        for name in self.ds_config:
+            yield self[name]
 
     def __getitem__(self, __k: str) -> AbstractDataset:
         try:
-            for dataset in self._list:
-                if dataset.name == __k:
-                    _ds = dataset
-            return _ds
-        except Exception as error:
+            return self._objects[__k]
+        except KeyError:
+            pass
+        if __k not in self.ds_config:
             raise KeyError(
                 f'Dataset `{__k}` does not exist!'
-            ) from error
+            )
+        with self._lock:
+            if __k not in self._objects:
+                values = self.ds_config[__k]
+                self._objects[__k] = dataset_class_factory(
+                    values['type'], __k, values['params'])
+        return self._objects[__k]
+
+    def __contains__(self, __k: object) -> bool:
+        return __k in self.ds_config
 
     def __len__(self) -> int:
-        return len(self._list)
+        return len(self.ds_config)
 
     def query_dataset_exists(self) -> bool:
-        query_ds_cnt = 0
-        for _dataset in self._list:
-            if isinstance(_dataset, QueryDataset):
-                query_ds_cnt += 1
-        return query_ds_cnt > 0
+        """Determined from the dataset types, without building the datasets."""
+        for values in self.ds_config.values():
+            _type = DATASET_TYPES.get(values['type'])
+            if _type is not None and issubclass(_type, QueryDataset):
+                return True
+        return False
+
+    @staticmethod
+    def _dataset_path(ds: AbstractDataset) -> Path:
+        if isinstance(ds, QueryDataset):
+            return ds.params.file_path
+        return ds.params.location
 
     def get_dataset_by_loc(self, loc: Union[Path, str]) -> AbstractDataset:
         """using the dataset's location, get the corresponding dataset."""
-        if isinstance(loc, str):
-            loc = Path(loc)
-        for ds in self._list:
-            if isinstance(ds, QueryDataset):
-                _path = ds.params.file_path
-            else:
-                _path = ds.params.location
-            if _path == loc:
-                return ds
-        raise Exception(
-            (f'No dataset found with location: {str(loc)}')
+        if self._loc_index is None:
+            with self._lock:
+                if self._loc_index is None:
+                    self._loc_index = {
+                        self._dataset_path(ds): ds.name for ds in self
+                    }
+        loc = Path(loc)
+        name = self._loc_index.get(loc)
+        if name is None:
+            name = self._loc_index.get(loc.resolve())
+        if name is None:
+            raise Exception(
+                (f'No dataset found with location: {str(loc)}')
+            )
+        return self[name]
+
+    @property
+    def _targets_manifest(self) -> JsonManifest:
+        return JsonManifest(Path(fluke_state_dir(), TARGETS_STATE))
+
+    def _targets_script(self) -> str:
+        _tar_list = ',\n    '.join(
+            [dataset.tar_cmd() for dataset in self]
+        )
+        return (
+            'library(targets)\n'
+            '# Encapsulates `targets` commands for datasets.\n'
+            '# Do not edit by hand!\n'
+            f'list(\n    {_tar_list}\n)\n'
         )
 
+    def _file_fingerprints(self) -> Dict[str, Optional[Dict[str, int]]]:
+        """Size and mtime of each dataset's local file, None if missing."""
+        fingerprints: Dict[str, Optional[Dict[str, int]]] = {}
+        for ds in self:
+            path = self._dataset_path(ds)
+            fingerprints[ds.name] = file_stat(path) if path.exists() else None
+        return fingerprints
 
-    def run_targets_cmd(self) -> None:
+    def run_targets_cmd(self, force: bool = False) -> bool:
         """
         generates a `targets` package list of targets
-        from dataset list.
+        from dataset list and makes them.
+
+        The script is only rewritten when its content changes, and
+        `tar_make` is skipped when neither the script nor any dataset
+        file changed since the last successful make, unless `force`.
+        Returns whether `tar_make` was run.
         """
-        _tar_list = ',\n'.join(
-            [dataset.tar_cmd() for dataset in self._list]
-        )
+        root = find_root_proj()
+        script = self._targets_script()
+        script_hash = hash_strings([script])
+        script_path = Path(root, TARGETS_SCRIPT)
+        if (not script_path.exists()
+            or hash_strings([script_path.read_text(encoding='utf-8')]) != script_hash):
+            atomic_write_text(script_path, script)
+
+        state = {'script': script_hash, 'files': self._file_fingerprints()}
+        manifest = self._targets_manifest
+        if (not force and manifest.get('datasets') == state
+            and Path(root, TARGETS_STORE).exists()):
+            logger.info('Datasets unchanged since the last make, skipping `tar_make`.')
+            return False
+
         _tar_cmd = f"""
         library(targets)
         Sys.setenv(TAR_CONFIG = here::here('config/_targets.yaml'))
         Sys.setenv(TAR_PROJECT = 'datasets')
 
         tar_config_set(
-            store = 'datasets/_tar_datasets_store',
-            script = 'datasets/tar_script_datasets.R'
+            store = '{TARGETS_STORE}',
+            script = '{TARGETS_SCRIPT}'
         )
 
-        tar_script({{
-            # Encapsulates `targets` commands for datasets.
-            # Do not edit by hand!
-            list(
-                {_tar_list}
-            )
-        }})
-
         tar_make()
         """
         run_r(_tar_cmd, ['-e'])
+        manifest.set('datasets', state)
 
-        return
-
-
-
-
+        return True
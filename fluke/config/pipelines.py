@@ -0,0 +1,100 @@
+"""Pipelines configuration, as read by `setup_pipelines` in R."""
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+from fluke.config.cache import load_yaml_cached
+from fluke.datasets.manifest import fluke_state_dir
+from fluke.utils import find_root_proj
+
+# store used by `targets` when no pipelines version is configured
+DEFAULT_STORE = '_targets'
+
+_MEMORY_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+_MEMORY_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+
+
+def parse_memory(value: Any) -> int:
+    """Bytes in `value`, an integer number of megabytes or e.g. `'512M'`, `'4G'`."""
+    if isinstance(value, bool):
+        raise Exception(f'invalid memory amount `{value}`.')
+    if isinstance(value, (int, float)):
+        return int(value * _MEMORY_UNITS['M'])
+    match = _MEMORY_PATTERN.match(str(value))
+    if match is None:
+        raise Exception(
+            f'invalid memory amount `{value}`, use e.g. `512M` or `4G`.')
+    number, unit = match.groups()
+    return int(float(number) * _MEMORY_UNITS[unit.upper()])
+
+
+@dataclass
+class PipelineResources:
+    """What a pipeline needs to be started: `targets` workers and memory in bytes."""
+    workers: int = 1
+    memory: Optional[int] = None
+
+
+class PipelinesConfig:
+    """
+    Content of `config/pipelines.yaml`: the `pipelines` node holds the
+    `targets` settings, every other node holds a pipeline's params.
+    """
+    def __init__(self) -> None:
+        self.root = find_root_proj()
+        self.config_path = Path(self.root, 'config', 'pipelines.yaml')
+        content = None
+        if self.config_path.exists():
+            content = load_yaml_cached(
+                self.config_path,
+                Path(fluke_state_dir(), 'pipelines.yaml.cache')
+            )
+        content = content or {}
+        self.settings: Dict[str, Any] = content.get('pipelines') or {}
+        self.params: Dict[str, Any] = {
+            key: value for key, value in content.items() if key != 'pipelines'
+        }
+
+    @property
+    def version(self) -> Optional[str]:
+        version = self.settings.get('version')
+        return str(version) if version is not None else None
+
+    @property
+    def store(self) -> Path:
+        """The store shared by pipelines made together."""
+        if self.version is None:
+            return Path(self.root, DEFAULT_STORE)
+        return self.version_store(self.version)
+
+    def version_store(self, version: str) -> Path:
+        return Path(self.root, 'pipelines', 'store', version)
+
+    def pipeline_store(self, name: str) -> Path:
+        """The store of pipeline `name` when it is made on its own process."""
+        return Path(self.store, 'pipelines', name)
+
+    def pipeline_stores(self) -> Dict[str, Path]:
+        """Existing stores of pipelines made on their own process, by name."""
+        stores_dir = Path(self.store, 'pipelines')
+        if not stores_dir.is_dir():
+            return {}
+        return {path.name: path for path in sorted(stores_dir.iterdir()) if path.is_dir()}
+
+    def resources(self, name: str) -> PipelineResources:
+        """
+        Resources of pipeline `name`, from its `resources` node, e.g.
+        `{workers: 4, memory: 8G}`. Workers default to the `workers`
+        setting of the `pipelines` node.
+        """
+        params = self.params.get(name) or {}
+        resources = params.get('resources') or {}
+        workers = resources.get('workers', self.settings.get('workers')) or 1
+        if not isinstance(workers, int) or workers < 1:
+            raise Exception(
+                f'`workers` of pipeline `{name}` must be a positive integer.')
+        memory = resources.get('memory')
+        return PipelineResources(
+            workers=workers,
+            memory=parse_memory(memory) if memory is not None else None
+        )
@@ -0,0 +1,124 @@
+"""Write/read speed and on-disk size of storage formats on a sample of a dataset."""
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+from fluke.datasets.formats import STORAGE_FORMATS, StorageFormat, get_storage_format
+from fluke.datasets.query_dataset.bigquery import BigQueryDataset
+from fluke.utils import dict_to_r_args, run_r
+
+_OUTPUT_MARKER = '<<fluke-bench>>'
+
+
+@dataclass
+class FormatBenchmark:
+    label: str
+    rows: Optional[int] = None
+    write_seconds: Optional[float] = None
+    read_seconds: Optional[float] = None
+    num_bytes: Optional[int] = None
+
+    @property
+    def available(self) -> bool:
+        return self.num_bytes is not None
+
+
+def parse_format_spec(spec: str) -> Tuple[StorageFormat, Optional[int]]:
+    """Parse `name` or `name:level`, e.g. `qs:9`."""
+    name, _, level = spec.partition(':')
+    fmt = get_storage_format(name)
+    if not level:
+        return fmt, None
+    if not level.isdigit():
+        raise Exception(f'compression level in `{spec}` must be an integer.')
+    fmt.check_options(int(level))
+    return fmt, int(level)
+
+
+def _sample_expr(ds: BigQueryDataset, rows: int) -> str:
+    """Read the local dataset if migrated, otherwise download `rows` rows."""
+    p = ds.params
+    if p.file_path.exists():
+        args = ''.join(
+            f', {key} = {value}'
+            for key, value in dict_to_r_args(p.read_fun_args or {}).items()
+        )
+        return f'utils::head({p.read_fun}("{p.file_path}"{args}), {rows})'
+    return f'bigrquery::bq_table_download({ds.bq_table}, n_max = {rows})'
+
+
+def _benchmark_cmd(ds: BigQueryDataset,
+specs: Sequence[Tuple[str, StorageFormat, Optional[int]]], rows: int, repeat: int,
+threads: Optional[int]) -> str:
+    blocks = []
+    for label, fmt, level in specs:
+        fmt_threads = threads if fmt.supports_threads else None
+        check = 'TRUE'
+        if fmt.package is not None:
+            check = f'requireNamespace("{fmt.package}", quietly = TRUE)'
+        blocks.append(f"""
+        local({{
+            if (!{check}) {{
+                cat(paste("{_OUTPUT_MARKER}", "{label}", sep = "\\t"), "\\n", sep = "")
+                return(invisible())
+            }}
+            path <- file.path(bench_dir, "sample{fmt.extension}")
+            write_s <- min(sapply(seq_len({repeat}), function(i) {{
+                unlink(path)
+                system.time({{ {fmt.write_cmd('sample', 'path', level, fmt_threads)} }})[["elapsed"]]
+            }}))
+            read_s <- min(sapply(seq_len({repeat}), function(i) {{
+                system.time(x <- {fmt.read_cmd('path', fmt_threads)})[["elapsed"]]
+            }}))
+            bytes <- format(sum(file.size(path)), scientific = FALSE)
+            cat(paste("{_OUTPUT_MARKER}", "{label}", nrow(sample), write_s, read_s, bytes,
+                sep = "\\t"), "\\n", sep = "")
+            unlink(path)
+        }})
+        """)
+    return f"""
+    sample <- {_sample_expr(ds, rows)}
+    bench_dir <- tempfile("fluke-bench-")
+    dir.create(bench_dir)
+    {''.join(blocks)}
+    unlink(bench_dir, recursive = TRUE)
+    """
+
+
+def _parse_output(output: str, labels: Sequence[str]) -> List[FormatBenchmark]:
+    rows = {}
+    for line in output.splitlines():
+        fields = line.rstrip().split('\t')
+        if fields[0] == _OUTPUT_MARKER and len(fields) > 1:
+            rows[fields[1]] = fields[2:]
+
+    results = []
+    for label in labels:
+        fields = rows.get(label, [])
+        if len(fields) < 4:
+            results.append(FormatBenchmark(label))
+            continue
+        results.append(FormatBenchmark(
+            label, rows=int(fields[0]), write_seconds=float(fields[1]),
+            read_seconds=float(fields[2]), num_bytes=int(float(fields[3]))
+        ))
+    return results
+
+
+def benchmark_formats(ds: BigQueryDataset, formats: Sequence[str] = (),
+rows: int = 100000, repeat: int = 3,
+threads: Optional[int] = None) -> List[FormatBenchmark]:
+    """
+    Time writing and reading a sample of `ds` with each format, given as
+    `name` or `name:level` (all registered formats by default), and measure
+    the file size. Timings are the best of `repeat` runs. Formats whose R
+    package is not installed are reported as unavailable.
+    """
+    if threads is not None and threads < 1:
+        raise ValueError('`threads` must be at least 1.')
+    specs = []
+    for spec in (formats or list(STORAGE_FORMATS)):
+        fmt, level = parse_format_spec(spec)
+        specs.append((spec, fmt, level))
+
+    output = run_r(_benchmark_cmd(ds, specs, rows, repeat, threads),
+        ['-e'], quiet=True, pooled=True)
+    return _parse_output(output, [label for label, _, _ in specs])
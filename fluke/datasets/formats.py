@@ -0,0 +1,138 @@
+"""Storage formats (serializers) for datasets migrated from databases."""
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class StorageFormat:
+    """How a migrated dataset is written to and read from disk.
+
+    `write_fun` and `read_fun` are R functions taking the object and the
+    path, and the path, as their first arguments. `write_args` are fixed
+    extra arguments of `write_fun`. A format supports a compression level
+    if it has a `level_arg`, valid within `levels`, and a thread count if
+    it has a `threads_arg` (passed to both functions) or a `threads_setup`
+    R statement with a `{threads}` placeholder run before writing.
+    """
+    name: str
+    extension: str
+    write_fun: str
+    read_fun: str
+    package: Optional[str] = None
+    write_args: Tuple[Tuple[str, str], ...] = ()
+    level_arg: Optional[str] = None
+    level: Optional[int] = None
+    levels: Optional[Tuple[int, int]] = None
+    threads_arg: Optional[str] = None
+    threads_setup: Optional[str] = None
+
+    @property
+    def supports_threads(self) -> bool:
+        return self.threads_arg is not None or self.threads_setup is not None
+
+    def check_options(self, level: Optional[int] = None,
+    threads: Optional[int] = None) -> None:
+        if level is not None:
+            if self.level_arg is None or self.levels is None:
+                raise Exception(
+                    f'format `{self.name}` does not support a compression level.')
+            low, high = self.levels
+            if not isinstance(level, int) or not low <= level <= high:
+                raise Exception(
+                    (f'compression level of format `{self.name}` must be an '
+                    f'integer between {low} and {high}.'))
+        if threads is not None:
+            if not self.supports_threads:
+                raise Exception(
+                    f'format `{self.name}` does not support a thread count.')
+            if not isinstance(threads, int) or threads < 1:
+                raise Exception('`threads` must be a positive integer.')
+
+    def write_cmd(self, obj: str, path: str, level: Optional[int] = None,
+    threads: Optional[int] = None) -> str:
+        """R statement writing the R object `obj` to the R string `path`."""
+        args = [obj, path] + [f'{key} = {value}' for key, value in self.write_args]
+        level = level if level is not None else self.level
+        if self.level_arg is not None and level is not None:
+            args.append(f'{self.level_arg} = {level}')
+        if self.threads_arg is not None and threads is not None:
+            args.append(f'{self.threads_arg} = {threads}')
+        cmd = f'{self.write_fun}({", ".join(args)})'
+        if self.threads_setup is not None and threads is not None:
+            cmd = f'{self.threads_setup.format(threads=threads)}; {cmd}'
+        return cmd
+
+    def read_args(self, threads: Optional[int] = None) -> Dict[str, int]:
+        """Extra arguments of `read_fun`."""
+        if self.threads_arg is not None and threads is not None:
+            return {self.threads_arg: threads}
+        return {}
+
+    def read_cmd(self, path: str, threads: Optional[int] = None) -> str:
+        """R expression reading the R string `path`."""
+        args = [path] + [f'{key} = {value}' for key, value in self.read_args(threads).items()]
+        cmd = f'{self.read_fun}({", ".join(args)})'
+        if self.threads_setup is not None and threads is not None:
+            cmd = f'{{{self.threads_setup.format(threads=threads)}; {cmd}}}'
+        return cmd
+
+
+STORAGE_FORMATS: Dict[str, StorageFormat] = {
+    'rds': StorageFormat(
+        name='rds',
+        extension='.rds',
+        write_fun='saveRDS',
+        read_fun='readRDS'
+    ),
+    'parquet': StorageFormat(
+        name='parquet',
+        extension='.parquet',
+        write_fun='arrow::write_parquet',
+        read_fun='arrow::read_parquet',
+        package='arrow'
+    ),
+    # uncompressed Arrow IPC files can be memory-mapped by `read_feather`
+    'feather': StorageFormat(
+        name='feather',
+        extension='.feather',
+        write_fun='arrow::write_feather',
+        read_fun='arrow::read_feather',
+        package='arrow',
+        write_args=(('compression', '"uncompressed"'),)
+    ),
+    # zstd at level 4 is what the default "high" preset uses
+    'qs': StorageFormat(
+        name='qs',
+        extension='.qs',
+        write_fun='qs::qsave',
+        read_fun='qs::qread',
+        package='qs',
+        write_args=(('preset', '"custom"'), ('algorithm', '"zstd"')),
+        level_arg='compress_level',
+        level=4,
+        levels=(1, 22),
+        threads_arg='nthreads'
+    ),
+    # fst compresses with zstd above level 50
+    'fst': StorageFormat(
+        name='fst',
+        extension='.fst',
+        write_fun='fst::write_fst',
+        read_fun='fst::read_fst',
+        package='fst',
+        level_arg='compress',
+        level=50,
+        levels=(0, 100),
+        threads_setup='invisible(fst::threads_fst({threads}))'
+    ),
+}
+
+
+def get_storage_format(name: str) -> StorageFormat:
+    try:
+        return STORAGE_FORMATS[name]
+    except KeyError as error:
+        raise Exception(
+            ('format `%s` is not supported. Please choose among %s.')
+            % (name, ', '.join(STORAGE_FORMATS))
+        ) from error
@@ -0,0 +1,130 @@
+"""JSON manifests for recording dataset state between runs."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from fluke.utils import find_root_proj
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def fluke_state_dir() -> Path:
+    """Directory holding fluke's local state for a project's datasets."""
+    return Path(find_root_proj(), 'datasets', '.fluke')
+
+
+def hash_strings(parts: Iterable[str]) -> str:
+    """sha256 of `parts`, each part length-prefixed so boundaries matter."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part.encode('utf-8')
+        digest.update(f'{len(data)}:'.encode('utf-8'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _content_files(path: Path) -> List[Path]:
+    """`path` itself, or the files under it if it is a directory of chunks."""
+    if path.is_dir():
+        return sorted(f for f in path.rglob('*') if f.is_file())
+    return [path]
+
+
+def file_stat(path: Path) -> Dict[str, int]:
+    """Total size and latest mtime of a file or directory of files."""
+    stats = [f.stat() for f in _content_files(path)]
+    return {
+        'size': sum(st.st_size for st in stats),
+        'mtime_ns': max((st.st_mtime_ns for st in stats), default=0)
+    }
+
+
+def file_checksum(path: Path) -> str:
+    """blake2b of a file, or of the names and contents of a directory's files."""
+    digest = hashlib.blake2b(digest_size=16)
+    for file in _content_files(path):
+        if file != path:
+            digest.update(str(file.relative_to(path)).encode('utf-8') + b'\0')
+        with file.open('rb') as handle:
+            for block in iter(lambda: handle.read(_HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def local_state(path: Path) -> Dict[str, Any]:
+    """Stat and checksum of `path`, see `verify_local_state`."""
+    return {**file_stat(path), 'checksum': file_checksum(path)}
+
+
+def verify_local_state(path: Path, state: Dict[str, Any]) -> bool:
+    """
+    Does `path` still hold the content recorded by `local_state`?
+    The checksum is only recomputed if the size or mtime changed.
+    """
+    if not path.exists():
+        return False
+    stat = file_stat(path)
+    if stat['size'] != state.get('size'):
+        return False
+    if stat['mtime_ns'] == state.get('mtime_ns'):
+        return True
+    return file_checksum(path) == state.get('checksum')
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write `data` to `path` through a temporary file and an atomic rename."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    atomic_write_bytes(path, text.encode('utf-8'))
+
+
+class JsonManifest:
+    """A small key-value store persisted as a JSON file.
+
+    Writes are serialized within the process and replace the file atomically,
+    so concurrent dataset jobs can record entries safely.
+    """
+    _locks: Dict[Path, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with self._locks_guard:
+            self._lock = self._locks.setdefault(path, threading.Lock())
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with self.path.open('r', encoding='utf-8') as file:
+                content = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return content if isinstance(content, dict) else {}
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._read().get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            content = self._read()
+            content[key] = value
+            atomic_write_text(self.path, json.dumps(content, indent=2, sort_keys=True))
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            content = self._read()
+            if content.pop(key, None) is not None:
+                atomic_write_text(
+                    self.path, json.dumps(content, indent=2, sort_keys=True))
@@ -1,2 +1,3 @@
 from .abstract import QueryDataset, QueryParams
-from .bigquery import BigQueryDataset,  BigQueryParams
\ No newline at end of file
+from .bigquery import BigQueryDataset,  BigQueryParams
+from .metadata import BigQueryMetadata, TableMetadata
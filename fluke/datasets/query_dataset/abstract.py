@@ -1,9 +1,12 @@
 """Abstract classes for QueryDatasets."""
+from datetime import datetime
 from pathlib import Path
 from dataclasses import dataclass
 from fluke.datasets.abstract import AbstractDataset, AbstractParam
-from typing import Any, Dict, Optional, Type
-from fluke.utils import find_root_proj
+from fluke.datasets.formats import StorageFormat, get_storage_format
+from fluke.datasets.manifest import JsonManifest, fluke_state_dir, hash_strings
+from typing import Any, Dict, List, Optional, Type
+from fluke.utils import dict_insert, find_root_proj
 from abc import abstractmethod
 
 
@@ -14,14 +17,33 @@ class QueryParams(AbstractParam):
     version: str  = ''
     table: Optional[str] = None
     migrate_fun: Optional[str] = 'bigrquery::bq_table_download'
-    read_fun: Optional[str] = 'readRDS'
+    read_fun: Optional[str] = None
     migrate_fun_args: Optional[Dict[str, Optional[Any]]] = None
     read_fun_args: Optional[Dict[str, Optional[Any]]] = None
+    migrate_page_size: Optional[int] = None
+    format: str = 'rds'
+    compression_level: Optional[int] = None
+    threads: Optional[int] = None
+    incremental: Optional[Dict[str, Any]] = None
 
     def __post_init__(self):
         self._check_params()
         self.ver_tbl = '_'.join([self.table, self.version])
 
+        # derive the reader from the storage format unless given
+        if self.read_fun is None:
+            fmt_args = self.storage_format.read_args(self.threads)
+            if fmt_args:
+                self.read_fun_args = {**fmt_args, **(self.read_fun_args or {})}
+            if self.chunked:
+                # chunked migrations are stored as a directory of chunk files
+                self.read_fun = 'fluke::read_chunks'
+                self.read_fun_args = dict_insert(
+                    self.read_fun_args or {}, 0,
+                    ('fun', self.storage_format.read_fun))
+            else:
+                self.read_fun = self.storage_format.read_fun
+
         # derive the real path for the script
         src_path: Optional[Path]
         if self.script is not None:
@@ -40,6 +62,31 @@ class QueryParams(AbstractParam):
             _query = f'query <- "{self.query}"'
         self.query_str = _query
 
+    def fingerprint_parts(self) -> List[str]:
+        """Inputs that determine the contents of the queried table."""
+        script = ''
+        if self.src_path is not None and self.src_path.exists():
+            script = self.src_path.read_text(encoding='utf-8')
+        return [self.query_str, script, self.ver_tbl]
+
+    @property
+    def fingerprint(self) -> str:
+        return hash_strings(self.fingerprint_parts())
+
+    @property
+    def storage_format(self) -> StorageFormat:
+        return get_storage_format(self.format)
+
+    def write_cmd(self, obj: str, path: str) -> str:
+        """R statement writing `obj` to `path` with the dataset's format options."""
+        return self.storage_format.write_cmd(
+            obj, path, level=self.compression_level, threads=self.threads)
+
+    @property
+    def chunked(self) -> bool:
+        """Is the dataset stored as a directory of chunk files?"""
+        return self.migrate_page_size is not None or self.incremental is not None
+
     @property
     @abstractmethod
     def location(self) -> Path:
@@ -66,6 +113,32 @@ class QueryParams(AbstractParam):
         if self.table is None:
             raise Exception('`table` must be provided!')
 
+        get_storage_format(self.format).check_options(
+            self.compression_level, self.threads)
+
+        if self.migrate_page_size is not None:
+            if not isinstance(self.migrate_page_size, int) or self.migrate_page_size < 1:
+                raise Exception('`migrate_page_size` must be a positive integer.')
+            if self.migrate_fun != 'bigrquery::bq_table_download':
+                raise Exception(
+                    ('`migrate_page_size` is only supported with '
+                    '`bigrquery::bq_table_download` as `migrate_fun`.')
+                )
+
+        if self.incremental is not None:
+            if (not isinstance(self.incremental, dict)
+            or not isinstance(self.incremental.get('column'), str)):
+                raise Exception('`incremental` must define a watermark `column`.')
+            unknown = set(self.incremental) - {'column'}
+            if unknown:
+                raise Exception(
+                    f'Unknown keys in `incremental`: {", ".join(sorted(unknown))}.')
+            if self.migrate_fun != 'bigrquery::bq_table_download':
+                raise Exception(
+                    ('`incremental` is only supported with '
+                    '`bigrquery::bq_table_download` as `migrate_fun`.')
+                )
+
 
 class QueryDataset(AbstractDataset):
     @property
@@ -80,6 +153,10 @@ class QueryDataset(AbstractDataset):
 
     @abstractmethod
     def perform_query(self) -> None:
+        self._prepare_query()
+
+    def _prepare_query(self) -> None:
+        """Check the query script and create the dataset location."""
         p = self.params
         # check if the script exists
         if p.script is not None:
@@ -91,7 +168,11 @@ class QueryDataset(AbstractDataset):
                 loc.mkdir()
 
     @abstractmethod
-    def migrate(self):
+    def migrate(self, full_refresh: bool = False, download_workers: int = 1):
+        """
+        Download the table to `file_path`. Incremental datasets only append
+        new rows unless `full_refresh` is set.
+        """
         ...
 
     @abstractmethod
@@ -103,6 +184,23 @@ class QueryDataset(AbstractDataset):
         """deletes a table version."""
         ...
 
+    @property
+    def _query_manifest(self) -> JsonManifest:
+        return JsonManifest(Path(fluke_state_dir(), 'queries.json'))
+
+    def query_changed(self) -> bool:
+        """Have the query inputs changed since the last successful query?"""
+        entry = self._query_manifest.get(self.name)
+        return entry is None or entry.get('fingerprint') != self.params.fingerprint
+
+    def _record_query(self) -> None:
+        """Record the fingerprint of a successful query."""
+        self._query_manifest.set(self.name, {
+            'fingerprint': self.params.fingerprint,
+            'table': self.params.ver_tbl,
+            'queried_at': datetime.now().isoformat(timespec='seconds')
+        })
+
     def _check_script_exists(self):
         if not self.params.src_path.exists():
             raise Exception(
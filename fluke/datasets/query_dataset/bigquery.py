@@ -1,6 +1,11 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Type, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type, Union
 from fluke.utils import (
     dict_to_r_args,
     find_root_proj,
@@ -9,11 +14,54 @@ from fluke.utils import (
     dict_insert,
     sym_wrap
 )
+from fluke.datasets.manifest import (
+    JsonManifest,
+    atomic_write_text,
+    file_stat,
+    fluke_state_dir,
+    local_state,
+    verify_local_state
+)
 from fluke.datasets.query_dataset import QueryParams, QueryDataset
+from fluke.ledger import ledger_run
 from fluke.logger import init_logger
+from fluke.trace import span
+
+if TYPE_CHECKING:
+    from fluke.datasets.query_dataset.metadata import TableMetadata
 
 logger = init_logger()
 
+# cache of table metadata, see `fluke.datasets.query_dataset.metadata`
+BQ_METADATA_CACHE = 'bq_metadata.json'
+# watermarks of incremental migrations
+INCREMENTAL_STATE = 'incremental.json'
+_INCREMENTAL_MARKER = '<<fluke-incremental>>'
+# printed by downloads with the number of rows written
+_ROWS_MARKER = '<<fluke-rows>>'
+
+
+def _written_rows(output: str) -> Optional[int]:
+    """Rows printed after `_ROWS_MARKER` by a download command, if any."""
+    _, marker, result = output.rpartition(f'{_ROWS_MARKER}\t')
+    rows = result.split('\n', 1)[0].strip()
+    return int(rows) if marker and rows.isdigit() else None
+
+
+def row_ranges(n_rows: int, n_parts: int) -> List[Tuple[int, int]]:
+    """Split `n_rows` rows into at most `n_parts` contiguous `(start, n)` ranges."""
+    n_parts = max(1, min(n_parts, n_rows))
+    size, rest = divmod(n_rows, n_parts)
+    ranges = []
+    start = 0
+    for i in range(n_parts):
+        n = size + (1 if i < rest else 0)
+        if n > 0:
+            ranges.append((start, n))
+        start += n
+    return ranges
+
+
 @dataclass
 class BigQueryParams(QueryParams):
     project_id: Optional[str] = None
@@ -31,9 +79,16 @@ class BigQueryParams(QueryParams):
     def location(self) -> Path:
         return self._location
 
+    def fingerprint_parts(self) -> List[str]:
+        return super().fingerprint_parts() + [str(self.project_id), str(self.dataset)]
+
     @property
     def file_path(self) -> Path:
-        return Path(self._location, self.version)
+        # rds files and chunk directories are stored without an extension
+        ext = self.storage_format.extension
+        if self.format == 'rds' or self.chunked:
+            ext = ''
+        return Path(self._location, f'{self.version}{ext}')
 
     def _check_params(self) -> None:
         super()._check_params()
@@ -79,9 +134,9 @@ class BigQueryDataset(QueryDataset):
         if self.params.read_fun_args is not None:
             _fnl_args = dict_insert(
                 self.params.read_fun_args, 0,
-                str(self.params.location))
+                ('', str(self.params.file_path)))
         else:
-            _fnl_args = {'': str(self.params.location)}
+            _fnl_args = {'': str(self.params.file_path)}
 
         _read_fun_args = dict_to_r_args(_fnl_args)
 
@@ -107,14 +162,134 @@ class BigQueryDataset(QueryDataset):
             write_disposition = "WRITE_TRUNCATE"
         )
         """
-        run_r(cmd, ['-e'], quiet = True)
+        with ledger_run('query', self.name, p.version), \
+        span('perform_query', dataset=self.name, table=p.ver_tbl):
+            run_r(cmd, ['-e'], quiet=True, pooled=True)
+        self._query_done()
+
+    def submit_query_cmd(self, marker: str) -> str:
+        """
+        R expression submitting the query without waiting for it. It prints
+        `marker`, the dataset name and the job's project, id and location
+        separated by tabs, or `ERROR` and the message if submission failed.
+        """
+        p = self.params
+        return f"""
+        tryCatch(local({{
+            tbl <- {self.bq_table}
+
+            {p.query_str}
+            job <- bigrquery::bq_perform_query(
+                query,
+                billing = "{p.project_id}",
+                destination_table = tbl,
+                write_disposition = "WRITE_TRUNCATE"
+            )
+            location <- if (is.null(job$location)) "" else job$location
+            cat(paste("{marker}", "{self.name}", job$project, job$job, location,
+                sep = "\\t"), "\\n", sep = "")
+        }}), error = function(e) {{
+            cat(paste("{marker}", "{self.name}", "ERROR",
+                gsub("[\\t\\n]", " ", conditionMessage(e)), sep = "\\t"), "\\n", sep = "")
+        }})
+        """
+
+    def _query_done(self) -> None:
+        """Bookkeeping once the query job has created the table."""
+        self._record_query()
+        self._invalidate_metadata()
         logger.info(
             (f'Created table {self.params.ver_tbl} in '
             f'{self.params.project_id}.{self.params.dataset}.'
             )
         )
 
-    def migrate(self) -> None:
+    def migrate(self, full_refresh: bool = False, download_workers: int = 1,
+    table_meta: Optional['TableMetadata'] = None) -> None:
+        """
+        Download the table to `file_path` and record its local checksum,
+        along with the remote metadata `table_meta` when given (callers
+        skipping current migrations already have it), see
+        `migration_current`. With `download_workers` > 1 the table is split
+        into row ranges downloaded by concurrent R processes.
+        """
+        p = self.params
+        with ledger_run('migrate', self.name, p.version) as measures, \
+        span('migrate', dataset=self.name, table=p.ver_tbl,
+        format=p.format, download_workers=download_workers):
+            parallel = (download_workers > 1 and p.incremental is None
+                and p.migrate_fun == 'bigrquery::bq_table_download')
+            if parallel and table_meta is None:
+                # row ranges are split by the number of rows of the table
+                with span('table metadata', dataset=self.name):
+                    table_meta = self._fetch_table_meta()
+
+            with span('download', dataset=self.name) as download:
+                rows: Optional[int]
+                if p.incremental is not None:
+                    rows = self._incremental_migrate(full_refresh)
+                elif parallel:
+                    assert table_meta is not None
+                    rows = self._parallel_migrate(download_workers, table_meta.num_rows)
+                else:
+                    rows = self._download()
+                download['rows'] = rows
+            with span('record migration', dataset=self.name):
+                self._record_migration(table_meta)
+            measures['rows'] = rows
+            measures['bytes'] = download['bytes'] = file_stat(p.file_path)['size']
+
+    def _fetch_table_meta(self) -> 'TableMetadata':
+        # imported here, `metadata` depends on this module
+        from fluke.datasets.query_dataset.metadata import BigQueryMetadata
+        p = self.params
+        metadata = BigQueryMetadata()
+        metadata.fetch_for([self], refresh=True)
+        table_meta = metadata.get(self)
+        if table_meta is None:
+            raise Exception(
+                (f'Table {p.ver_tbl} does not exist in {p.project_id}.{p.dataset}. '
+                'Consider running `fluke dataset query` first.')
+            )
+        return table_meta
+
+    @property
+    def _migration_manifest_path(self) -> Path:
+        """Manifest of the last migration, stored next to `file_path`."""
+        file_path = self.params.file_path
+        return file_path.with_name(f'{file_path.name}.fluke.json')
+
+    def migration_current(self, table_meta: 'TableMetadata') -> bool:
+        """
+        Was the local file migrated from the remote table as described by
+        `table_meta`, and is it unchanged since?
+        """
+        try:
+            entry = json.loads(self._migration_manifest_path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        remote = entry.get('remote', {})
+        if (remote.get('table') != table_meta.table
+        or remote.get('last_modified') != table_meta.last_modified
+        or remote.get('num_rows') != table_meta.num_rows):
+            return False
+        return verify_local_state(self.params.file_path, entry.get('local', {}))
+
+    def _record_migration(self, table_meta: Optional['TableMetadata']) -> None:
+        # without remote metadata the next migration cannot be skipped
+        remote = {} if table_meta is None else {
+            'table': table_meta.table,
+            'last_modified': table_meta.last_modified,
+            'num_rows': table_meta.num_rows
+        }
+        atomic_write_text(self._migration_manifest_path, json.dumps({
+            'remote': remote,
+            'local': local_state(self.params.file_path),
+            'migrated_at': datetime.now().isoformat(timespec='seconds')
+        }, indent=2, sort_keys=True))
+
+    def _download(self) -> Optional[int]:
+        """Download the whole table with `migrate_fun`, returns the rows written."""
         p = self.params
         # prepare migration args
         migrate_args_r: List[Union[str, None]]
@@ -136,31 +311,365 @@ class BigQueryDataset(QueryDataset):
             if p.table is not None:
                 migrate_args_r.insert(0, sym_wrap(p.table))
 
+        if p.migrate_page_size is not None:
+            cmd = self._chunked_migrate_cmd(all_args_expr)
+        else:
+            cmd = f"""
+                downloaded <- {p.migrate_fun}({all_args_expr})
+                {p.write_cmd('downloaded', sym_wrap(str(self._partial_file), '"'))}
+                cat("{_ROWS_MARKER}", format(nrow(downloaded), scientific = FALSE),
+                    sep = "\t")
+                cat("\n")
+            """
+
+        if p.migrate_page_size is not None:
+            output = run_r(cmd, ['-e'], quiet=True, pooled=True)
+        else:
+            output = self._replace_file(cmd)
+        logger.info(
+            (f'Migrated {p.project_id}.{p.dataset}.{p.ver_tbl} to datasets/.')
+        )
+        return _written_rows(output)
+
+    @property
+    def _partial_file(self) -> Path:
+        """Where a download is written before it replaces `file_path`."""
+        file_path = self.params.file_path
+        # keeps the extension, which some writers infer the compression from
+        return file_path.with_name(f'.partial-{file_path.name}')
+
+    def _replace_file(self, cmd: str) -> str:
+        """
+        Run `cmd`, which writes `_partial_file`, then move that over
+        `file_path`. Replacing the file instead of writing into it leaves
+        other links to it (see `fluke gc --dedup`) unchanged.
+        """
+        tmp_file = self._partial_file
+        tmp_file.unlink(missing_ok=True)
+        try:
+            output = run_r(cmd, ['-e'], quiet=True, pooled=True)
+            os.replace(tmp_file, self.params.file_path)
+        finally:
+            tmp_file.unlink(missing_ok=True)
+        return output
+
+    def _chunked_migrate_cmd(self, all_args_expr: str) -> str:
+        """
+        Command to download the table `migrate_page_size` rows at a time,
+        saving each page as a chunk file under `file_path` so that at most
+        one page is held in memory.
+        """
+        p = self.params
+        cmd = f"""
+            tbl <- {self.bq_table}
+            n_rows <- as.numeric(bigrquery::bq_table_nrow(tbl))
+            page_size <- {p.migrate_page_size}
+            out_dir <- "{p.file_path}"
+            tmp_dir <- paste0(out_dir, ".partial")
+            unlink(tmp_dir, recursive = TRUE)
+            dir.create(tmp_dir, recursive = TRUE)
+
+            starts <- if (n_rows > 0) seq(0, n_rows - 1, by = page_size) else 0
+            written <- 0
+            for (i in seq_along(starts)) {{
+                page <- {p.migrate_fun}(
+                    {all_args_expr},
+                    start_index = starts[i],
+                    n_max = page_size
+                )
+                chunk_path <- file.path(tmp_dir, sprintf("chunk-%06d{p.storage_format.extension}", i))
+                {p.write_cmd('page', 'chunk_path')}
+                written <- written + nrow(page)
+                rm(page)
+                invisible(gc())
+            }}
+
+            unlink(out_dir, recursive = TRUE)
+            invisible(file.rename(tmp_dir, out_dir))
+            cat("{_ROWS_MARKER}", format(written, scientific = FALSE), sep = "\t")
+            cat("\n")
+        """
+        return cmd
+
+    def _download_args_expr(self) -> str:
+        """`migrate_fun_args` as R arguments following the table argument."""
+        p = self.params
+        if p.migrate_fun_args is None:
+            return ''
+        return ''.join(
+            f', {__kt} = {__vt}'
+            for __kt, __vt in dict_to_r_args(p.migrate_fun_args).items()
+        )
+
+    def _parallel_migrate(self, download_workers: int, n_rows: int) -> Optional[int]:
+        """
+        Download row ranges of the table concurrently, one Rscript process
+        per worker, as numbered chunk files. Unless the dataset is stored in
+        chunks, the chunks are then bound in row order into `file_path`.
+        Returns the rows written.
+        """
+        p = self.params
+        # pages are numbered in row order and spread over the workers
+        if p.migrate_page_size is not None:
+            pages = [(start, min(p.migrate_page_size, n_rows - start))
+                for start in range(0, n_rows, p.migrate_page_size)]
+        else:
+            pages = row_ranges(n_rows, download_workers)
+        if len(pages) < 2:
+            return self._download()
+        numbered = list(enumerate(pages, start=1))
+        groups = [
+            numbered[start:start + n]
+            for start, n in row_ranges(len(numbered), download_workers)
+        ]
+
+        tmp_dir = Path(f'{p.file_path}.partial')
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+
+        # one-shot Rscript processes, so downloads do not queue on the R pool
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            list(executor.map(
+                lambda group: run_r(self._range_migrate_cmd(tmp_dir, group),
+                    ['-e'], quiet=True),
+                groups
+            ))
+
+        if p.migrate_page_size is not None:
+            if p.file_path.exists():
+                shutil.rmtree(p.file_path)
+            tmp_dir.rename(p.file_path)
+        else:
+            read_args = ''.join(
+                f', {key} = {value}'
+                for key, value in p.storage_format.read_args(p.threads).items()
+            )
+            cmd = f"""
+                chunks <- fluke::read_chunks("{tmp_dir}", fun = {p.storage_format.read_fun}{read_args})
+                {p.write_cmd('chunks', sym_wrap(str(self._partial_file), '"'))}
+            """
+            self._replace_file(cmd)
+            shutil.rmtree(tmp_dir)
+        logger.info(
+            (f'Migrated {p.project_id}.{p.dataset}.{p.ver_tbl} to datasets/ '
+            f'with {len(groups)} download workers.')
+        )
+        return n_rows
+
+    def _range_migrate_cmd(self, tmp_dir: Path,
+    pages: List[Tuple[int, Tuple[int, int]]]) -> str:
+        """Command to download numbered `(index, (start, n))` pages as chunk files."""
+        p = self.params
+        pages_expr = ', '.join(f'c({i}, {start}, {n})' for i, (start, n) in pages)
         cmd = f"""
-            downloaded <- {p.migrate_fun}({all_args_expr})
-            saveRDS(downloaded, "{p.file_path}")
+            tbl <- {self.bq_table}
+            for (page_def in list({pages_expr})) {{
+                page <- {p.migrate_fun}(
+                    tbl{self._download_args_expr()},
+                    start_index = page_def[2],
+                    n_max = page_def[3]
+                )
+                chunk_path <- file.path(
+                    "{tmp_dir}", sprintf("chunk-%06d{p.storage_format.extension}", page_def[1])
+                )
+                {p.write_cmd('page', 'chunk_path')}
+                rm(page)
+                invisible(gc())
+            }}
         """
+        return cmd
+
+    @property
+    def _incremental_state(self) -> JsonManifest:
+        return JsonManifest(Path(fluke_state_dir(), INCREMENTAL_STATE))
 
-        run_r(cmd, ['-e'], quiet= True)
+    def _incremental_migrate(self, full_refresh: bool = False) -> int:
+        """
+        Download only the rows whose watermark column is past the last
+        migrated watermark and append them as new chunk files. Returns the
+        rows migrated so far.
+
+        Chunks are staged (a full download in `<file_path>.partial`, new
+        rows as hidden chunk files) and only published once the new
+        watermark is saved along with what was staged. A migration that
+        stopped after saving the watermark is published by the next one,
+        and staged chunks without a saved watermark are discarded, so a
+        delta is never appended twice and existing data is only replaced
+        by a complete download.
+        """
+        p = self.params
+        assert p.incremental is not None
+        state = self._incremental_state
+        entry = state.get(self.name)
+        if entry is not None and entry.get('staged') is not None:
+            self._publish_incremental(entry.pop('staged'))
+            state.set(self.name, entry)
+        self._discard_incremental_staging()
+        # start over if the query, table or watermark column changed
+        if (full_refresh or entry is None or entry.get('fingerprint') != p.fingerprint
+        or entry.get('column') != p.incremental['column']
+        or not p.file_path.exists()):
+            entry = None
+
+        output = run_r(
+            self._incremental_migrate_cmd(
+                None if entry is None else entry['watermark']),
+            ['-e'], quiet=True, pooled=True
+        )
+        _, _, result = output.rpartition(f'{_INCREMENTAL_MARKER}\t')
+        n_rows, _, watermark = result.strip('\n').partition('\t')
+        if not n_rows.isdigit():
+            self._discard_incremental_staging()
+            raise Exception(f'Incremental migration of {p.ver_tbl} did not complete.')
+
+        staged = 'full' if entry is None else 'delta'
+        if int(n_rows) > 0:
+            new_entry = {
+                'fingerprint': p.fingerprint,
+                'table': p.ver_tbl,
+                'column': p.incremental['column'],
+                'watermark': watermark,
+                'rows': int(n_rows) + (0 if entry is None else entry['rows']),
+                'migrated_at': datetime.now().isoformat(timespec='seconds')
+            }
+            state.set(self.name, dict(new_entry, staged=staged))
+            self._publish_incremental(staged)
+            state.set(self.name, new_entry)
+        elif entry is None:
+            # a full migration of an empty table starts from scratch next time
+            state.remove(self.name)
+            self._publish_incremental(staged)
         logger.info(
-            (f'Migrated {p.project_id}.{p.dataset}.{p.ver_tbl} to datasets/.')
+            (f'Appended {n_rows} new rows of {p.project_id}.{p.dataset}.{p.ver_tbl} '
+            'to datasets/.')
         )
+        return int(n_rows) + (0 if entry is None else entry['rows'])
+
+    def _publish_incremental(self, staged: str) -> None:
+        """Put the chunks staged by a `'full'` or `'delta'` migration in place."""
+        file_path = self.params.file_path
+        if staged == 'full':
+            tmp_dir = Path(f'{file_path}.partial')
+            if tmp_dir.is_dir():
+                if file_path.exists():
+                    shutil.rmtree(file_path)
+                tmp_dir.rename(file_path)
+        elif file_path.is_dir():
+            for chunk in sorted(file_path.glob('.chunk-*')):
+                chunk.rename(chunk.with_name(chunk.name[1:]))
+
+    def _discard_incremental_staging(self) -> None:
+        file_path = self.params.file_path
+        shutil.rmtree(Path(f'{file_path}.partial'), ignore_errors=True)
+        if file_path.is_dir():
+            for chunk in file_path.glob('.chunk-*'):
+                chunk.unlink()
+
+    def _incremental_migrate_cmd(self, watermark: Optional[str]) -> str:
+        """
+        Command to query the rows past `watermark` (all rows if None) and
+        stage them, `migrate_page_size` rows at a time, as hidden chunks
+        numbered after the existing ones (all rows in `<file_path>.partial`).
+        Prints the number of new rows and the new watermark.
+        """
+        p = self.params
+        assert p.incremental is not None
+        column = p.incremental['column']
+        extra_args = self._download_args_expr()
+        ext = p.storage_format.extension
+        page_size = p.migrate_page_size if p.migrate_page_size is not None else 'n_rows'
+        cmd = f"""
+            tbl <- {self.bq_table}
+            column <- "{column}"
+            watermark <- {'NULL' if watermark is None else json.dumps(watermark)}
+            out_dir <- "{p.file_path}"
+
+            col_type <- NULL
+            for (field in bigrquery::bq_table_fields(tbl)) {{
+                if (field$name == column) col_type <- field$type
+            }}
+            if (is.null(col_type)) {{
+                stop(sprintf("Watermark column `%s` is not in `{p.ver_tbl}`.", column))
+            }}
+            col_type <- switch(col_type,
+                INTEGER = "INT64", FLOAT = "FLOAT64", BOOLEAN = "BOOL", col_type)
+
+            sql <- "SELECT * FROM `{p.project_id}.{p.dataset}.{p.ver_tbl}`"
+            if (is.null(watermark)) {{
+                delta <- bigrquery::bq_project_query("{p.project_id}", sql)
+                # a full download replaces `out_dir` only once it completed
+                stage_dir <- paste0(out_dir, ".partial")
+                chunk_prefix <- "chunk-"
+            }} else {{
+                sql <- sprintf("%s WHERE `%s` > CAST(@watermark AS %s)", sql, column, col_type)
+                delta <- bigrquery::bq_project_query(
+                    "{p.project_id}", sql, parameters = list(watermark = watermark)
+                )
+                stage_dir <- out_dir
+                chunk_prefix <- ".chunk-"
+            }}
+            dir.create(stage_dir, recursive = TRUE, showWarnings = FALSE)
+
+            n_rows <- as.numeric(bigrquery::bq_table_nrow(delta))
+            new_watermark <- ""
+            if (n_rows > 0) {{
+                # the new watermark is taken from the downloaded rows only
+                max_sql <- sprintf(
+                    "SELECT CAST(MAX(`%s`) AS STRING) AS watermark FROM `%s.%s.%s`",
+                    column, delta$project, delta$dataset, delta$table
+                )
+                new_watermark <- bigrquery::bq_table_download(
+                    bigrquery::bq_project_query("{p.project_id}", max_sql)
+                )$watermark[1]
+
+                existing <- list.files(stage_dir, pattern = "^chunk-[0-9]+\\\\.")
+                offset <- 0
+                if (length(existing) > 0) offset <- max(as.integer(substr(existing, 7, 12)))
+                page_size <- {page_size}
+                starts <- seq(0, n_rows - 1, by = page_size)
+                for (i in seq_along(starts)) {{
+                    page <- {p.migrate_fun}(
+                        delta{extra_args},
+                        start_index = starts[i],
+                        n_max = page_size
+                    )
+                    chunk_path <- file.path(
+                        stage_dir, sprintf("%s%06d{ext}", chunk_prefix, offset + i))
+                    {p.write_cmd('page', 'chunk_path')}
+                    rm(page)
+                    invisible(gc())
+                }}
+            }}
+            cat("{_INCREMENTAL_MARKER}", format(n_rows, scientific = FALSE), new_watermark,
+                sep = "\\t")
+            cat("\\n")
+        """
+        return cmd
+
+    def _invalidate_metadata(self) -> None:
+        """Drop cached metadata of the BigQuery dataset after its tables changed."""
+        p = self.params
+        JsonManifest(Path(fluke_state_dir(), BQ_METADATA_CACHE)).remove(
+            f'{p.project_id}.{p.dataset}')
 
     def exists_in_db(self) -> bool:
         cmd = f"""
         tbl <- {self.bq_table}
-        bigrquery::bq_table_exists(tbl)
+        cat(bigrquery::bq_table_exists(tbl))
         """
-        result = run_r(cmd, ['-e'], quiet=True)
+        result = run_r(cmd, ['-e'], quiet=True, pooled=True)
 
-        return 'TRUE' in result
+        return result.strip().endswith('TRUE')
 
     def delete_in_db(self) -> None:
         cmd=f"""
         tbl <- {self.bq_table}
         bigrquery::bq_table_delete(tbl)
         """
-        run_r(cmd, ['-e'], quiet=True)
+        run_r(cmd, ['-e'], quiet=True, pooled=True)
+        self._query_manifest.remove(self.name)
+        self._invalidate_metadata()
         logger.info(
             (f'Deleted table {self.params.ver_tbl} in '
             f'{self.params.project_id}.{self.params.dataset}.'
@@ -0,0 +1,257 @@
+"""
+Asynchronous orchestration of BigQuery query jobs.
+
+All queries are submitted at once with `bq_perform_query`, which returns
+without waiting, and their statuses are then polled together with a single
+R call per round. Each dataset is migrated as soon as its own job is done,
+so remote compute overlaps with local downloads.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from fluke.datasets.query_dataset.bigquery import BigQueryDataset
+from fluke.jobs import JobResult
+from fluke.ledger import RunRecord, record_run
+from fluke.logger import init_logger, job_prefix
+from fluke.trace import span
+from fluke.utils import run_r
+
+logger = init_logger()
+
+_OUTPUT_MARKER = '<<fluke-job>>'
+POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+POLL_BACKOFF = 1.5
+# consecutive polls a job status may fail to be read before the job fails
+MAX_UNKNOWN_POLLS = 5
+
+
+@dataclass
+class QueryJob:
+    dataset: BigQueryDataset
+    project: str = ''
+    job_id: str = ''
+    location: str = ''
+    state: str = 'PENDING'
+    error: Optional[str] = None
+    # consecutive polls that could not read the status, and the last reason
+    unknown_polls: int = 0
+    poll_error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state == 'DONE'
+
+
+def _parse_output(output: str) -> Dict[str, List[str]]:
+    """Fields of every `marker`-prefixed line, keyed by dataset name."""
+    rows = {}
+    for line in output.splitlines():
+        fields = line.rstrip().split('\t')
+        if fields[0] == _OUTPUT_MARKER and len(fields) > 2:
+            rows[fields[1]] = fields[2:]
+    return rows
+
+
+def submit_query_jobs(datasets: Iterable[BigQueryDataset]) -> Dict[str, QueryJob]:
+    """
+    Submit the query of every dataset with one R call, without waiting for
+    the jobs. Datasets whose submission failed are returned already done,
+    with their error.
+    """
+    datasets = list(datasets)
+    cmd = '\n'.join(ds.submit_query_cmd(_OUTPUT_MARKER) for ds in datasets)
+    with span('submit query jobs', jobs=len(datasets)):
+        rows = _parse_output(run_r(cmd, ['-e'], quiet=True, pooled=True))
+
+    jobs = {}
+    for ds in datasets:
+        fields = rows.get(ds.name)
+        job = QueryJob(ds)
+        if fields is None:
+            job.state, job.error = 'DONE', 'query job was not submitted.'
+        elif fields[0] == 'ERROR':
+            job.state, job.error = 'DONE', fields[1] if len(fields) > 1 else 'unknown error.'
+        else:
+            job.project, job.job_id = fields[0], fields[1]
+            job.location = fields[2] if len(fields) > 2 else ''
+        jobs[ds.name] = job
+    return jobs
+
+
+def _poll_cmd(jobs: List[QueryJob]) -> str:
+    jobs_expr = ',\n'.join(
+        (f'list(name = "{job.dataset.name}", project = "{job.project}", '
+        f'job = "{job.job_id}", location = "{job.location}")')
+        for job in jobs
+    )
+    return f"""
+    jobs <- list({jobs_expr})
+    for (j in jobs) {{
+        location <- if (nzchar(j$location)) j$location else "US"
+        meta <- tryCatch(
+            bigrquery::bq_job_meta(
+                bigrquery::bq_job(j$project, j$job, location), fields = "status"
+            ),
+            error = function(e) e
+        )
+        if (inherits(meta, "error")) {{
+            state <- "UNKNOWN"
+            error <- conditionMessage(meta)
+        }} else {{
+            state <- meta$status$state
+            error <- meta$status$errorResult$message
+        }}
+        error <- if (is.null(error)) "" else gsub("[\\t\\n]", " ", error)
+        cat(paste("{_OUTPUT_MARKER}", j$name, state, error, sep = "\\t"),
+            "\\n", sep = "")
+    }}
+    """
+
+
+def poll_query_jobs(jobs: Iterable[QueryJob],
+max_unknown_polls: int = MAX_UNKNOWN_POLLS) -> None:
+    """
+    Update the state of every job that is not done with one R call. A job
+    whose status cannot be read (wrong location, revoked permission, expired
+    job) in `max_unknown_polls` consecutive polls is done with an error.
+    """
+    pending = [job for job in jobs if not job.done]
+    if not pending:
+        return
+    with span('poll query jobs', jobs=len(pending)):
+        rows = _parse_output(run_r(_poll_cmd(pending), ['-e'], quiet=True, pooled=True))
+    for job in pending:
+        fields = rows.get(job.dataset.name)
+        if fields is None:
+            continue
+        if fields[0] == 'UNKNOWN':
+            job.unknown_polls += 1
+            job.poll_error = fields[1] if len(fields) > 1 and fields[1] else None
+            if job.unknown_polls >= max_unknown_polls:
+                job.state = 'DONE'
+                job.error = (
+                    f'status of job {job.job_id} could not be read in '
+                    f'{job.unknown_polls} polls: {job.poll_error or "unknown error."}')
+            continue
+        job.unknown_polls = 0
+        job.state = fields[0]
+        if len(fields) > 1 and fields[1]:
+            job.error = fields[1]
+
+
+async def _in_thread(func: Callable[[], Any]) -> Any:
+    """Run a blocking call in the default executor, keeping the log context."""
+    ctx = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(ctx.run, func))
+
+
+async def _finish(job: QueryJob, result: JobResult, migrate: bool,
+semaphore: asyncio.Semaphore, stop: asyncio.Event, keep_going: bool,
+started: float, download_workers: int = 1) -> None:
+    token = job_prefix.set(job.dataset.name)
+    try:
+        job.dataset._query_done()
+        if migrate:
+            async with semaphore:
+                if stop.is_set():
+                    result.status = 'cancelled'
+                    return
+                result.status = 'migrating'
+                await _in_thread(functools.partial(
+                    job.dataset.migrate, download_workers=download_workers))
+        result.status = 'ok'
+    except Exception as error:
+        result.status = 'failed'
+        result.error = error
+        if not keep_going:
+            stop.set()
+        logger.info(f'Failed: {error}')
+    finally:
+        result.seconds = time.perf_counter() - started
+        job_prefix.reset(token)
+
+
+async def run_query_jobs(datasets: Iterable[BigQueryDataset], migrate: bool = False,
+max_migrations: int = 1, keep_going: bool = False,
+poll_interval: float = POLL_INTERVAL,
+max_poll_interval: float = MAX_POLL_INTERVAL,
+backoff: float = POLL_BACKOFF, download_workers: int = 1,
+max_unknown_polls: int = MAX_UNKNOWN_POLLS) -> List[JobResult]:
+    """
+    Submit the queries of `datasets` at once and poll them until done,
+    starting at most `max_migrations` concurrent migrations as jobs finish.
+
+    The poll interval starts at `poll_interval` and grows by `backoff` up
+    to `max_poll_interval` while no job finishes. If `keep_going` is False,
+    polling stops at the first failure and remaining datasets are marked
+    `'cancelled'`; their remote jobs are left running. Returns one
+    `JobResult` per dataset, in the order of `datasets`. Each migration
+    downloads with `download_workers` concurrent row ranges. A job whose
+    status cannot be read in `max_unknown_polls` consecutive polls fails.
+    """
+    if max_migrations < 1:
+        raise ValueError('`max_migrations` must be at least 1.')
+
+    datasets = list(datasets)
+    results = {ds.name: JobResult(ds.name) for ds in datasets}
+    for ds in datasets:
+        ds._prepare_query()
+
+    started = time.perf_counter()
+    jobs = await _in_thread(lambda: submit_query_jobs(datasets))
+    logger.info(f'Submitted {len(jobs)} query jobs.')
+    for res in results.values():
+        res.status = 'running'
+
+    semaphore = asyncio.Semaphore(max_migrations)
+    # set on failure with fail-fast, keeps queued migrations from starting
+    stop = asyncio.Event()
+    finishing: List[asyncio.Task] = []
+    pending = dict(jobs)
+    interval = poll_interval
+    first_round = True
+    while pending:
+        if not first_round:
+            await asyncio.sleep(interval)
+            await _in_thread(
+                lambda: poll_query_jobs(pending.values(), max_unknown_polls))
+        first_round = False
+
+        done = [name for name, job in pending.items() if job.done]
+        for name in done:
+            job = pending.pop(name)
+            seconds = time.perf_counter() - started
+            record_run(RunRecord(
+                'query', name, 'failed' if job.error is not None else 'ok', seconds,
+                version=job.dataset.params.version, error=job.error))
+            if job.error is not None:
+                results[name].status = 'failed'
+                results[name].error = Exception(job.error)
+                results[name].seconds = seconds
+                if not keep_going:
+                    stop.set()
+                token = job_prefix.set(name)
+                logger.info(f'Failed: {job.error}')
+                job_prefix.reset(token)
+            else:
+                finishing.append(asyncio.ensure_future(
+                    _finish(job, results[name], migrate, semaphore, stop, keep_going,
+                    started, download_workers)))
+
+        if stop.is_set():
+            break
+        interval = poll_interval if done else min(interval * backoff, max_poll_interval)
+
+    for name in pending:
+        results[name].status = 'cancelled'
+    if pending:
+        logger.info(f'Stopped polling {len(pending)} query jobs after a failure.')
+
+    if finishing:
+        await asyncio.gather(*finishing)
+    return list(results.values())
@@ -0,0 +1,166 @@
+"""Batched, locally cached metadata of BigQuery tables."""
+import csv
+import io
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from fluke.datasets.abstract import AbstractDataset
+from fluke.datasets.manifest import JsonManifest, fluke_state_dir
+from fluke.datasets.query_dataset.bigquery import BQ_METADATA_CACHE, BigQueryDataset
+from fluke.utils import run_r
+
+DEFAULT_TTL = 300.0
+_OUTPUT_MARKER = '<<fluke-metadata>>'
+
+
+@dataclass
+class TableMetadata:
+    project_id: str
+    dataset: str
+    table: str
+    last_modified: float
+    num_rows: int
+    num_bytes: int
+
+    @property
+    def last_modified_dt(self) -> datetime:
+        return datetime.fromtimestamp(self.last_modified)
+
+
+def _metadata_cmd(pairs: List[Tuple[str, str]]) -> str:
+    """
+    R command listing the tables of every `project_id.dataset` in `pairs`
+    with their metadata, printed as csv. Only reads the tables API, so no
+    query job is run or billed.
+    """
+    pairs_expr = ', '.join(f'c("{project}", "{dataset}")' for project, dataset in pairs)
+    return f"""
+    pairs <- list({pairs_expr})
+    fields <- "lastModifiedTime,numRows,numBytes"
+    tables <- lapply(pairs, function(x) {{
+        ds <- bigrquery::bq_dataset(x[1], x[2])
+        if (!bigrquery::bq_dataset_exists(ds)) {{
+            return(NULL)
+        }}
+        rows <- lapply(bigrquery::bq_dataset_tables(ds), function(tbl) {{
+            meta <- tryCatch(
+                bigrquery::bq_table_meta(tbl, fields = fields),
+                error = function(e) {{
+                    # dropped since it was listed
+                    if (!bigrquery::bq_table_exists(tbl)) return(NULL)
+                    stop(e)
+                }}
+            )
+            if (is.null(meta)) return(NULL)
+            # views have no rows or bytes of their own
+            or_zero <- function(value) if (is.null(value)) "0" else as.character(value)
+            data.frame(
+                project_id = x[1], dataset = x[2], table = tbl$table,
+                last_modified = as.character(meta$lastModifiedTime),
+                num_rows = or_zero(meta$numRows), num_bytes = or_zero(meta$numBytes)
+            )
+        }})
+        do.call(rbind, rows)
+    }})
+    out <- do.call(rbind, tables)
+    if (is.null(out)) {{
+        out <- data.frame(
+            project_id = character(), dataset = character(), table = character(),
+            last_modified = character(), num_rows = character(), num_bytes = character()
+        )
+    }}
+    cat("{_OUTPUT_MARKER}\\n")
+    write.csv(out, stdout(), row.names = FALSE)
+    """
+
+
+def _parse_output(output: str) -> List[TableMetadata]:
+    _, _, content = output.partition(f'{_OUTPUT_MARKER}\n')
+    rows = []
+    for row in csv.DictReader(io.StringIO(content)):
+        rows.append(TableMetadata(
+            project_id=row['project_id'],
+            dataset=row['dataset'],
+            table=row['table'],
+            # `lastModifiedTime` is in milliseconds since the epoch
+            last_modified=int(row['last_modified']) / 1000,
+            num_rows=int(row['num_rows']),
+            num_bytes=int(row['num_bytes'])
+        ))
+    return rows
+
+
+class BigQueryMetadata:
+    """
+    Metadata of the tables in the BigQuery datasets used by a project.
+
+    Every `project_id.dataset` is listed once per `fetch` through a single R
+    call, and the answers are cached in `datasets/.fluke/bq_metadata.json`
+    for `ttl` seconds.
+    """
+    def __init__(self, ttl: float = DEFAULT_TTL,
+    cache_path: Optional[Path] = None) -> None:
+        self.ttl = ttl
+        if cache_path is None:
+            cache_path = Path(fluke_state_dir(), BQ_METADATA_CACHE)
+        self._cache = JsonManifest(cache_path)
+        self._tables: Dict[Tuple[str, str], Dict[str, TableMetadata]] = {}
+
+    def fetch(self, pairs: Iterable[Tuple[str, str]], refresh: bool = False) -> None:
+        """Load metadata for `(project_id, dataset)` pairs, from cache if fresh."""
+        to_fetch: List[Tuple[str, str]] = []
+        for pair in dict.fromkeys(pairs):
+            entry = None if refresh else self._cache.get('.'.join(pair))
+            if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+                self._tables[pair] = {
+                    name: TableMetadata(**values)
+                    for name, values in entry['tables'].items()
+                }
+            else:
+                to_fetch.append(pair)
+
+        if not to_fetch:
+            return
+
+        output = run_r(_metadata_cmd(to_fetch), ['-e'], quiet=True, pooled=True)
+        fetched: Dict[Tuple[str, str], Dict[str, TableMetadata]] = {
+            pair: {} for pair in to_fetch
+        }
+        for meta in _parse_output(output):
+            fetched[(meta.project_id, meta.dataset)][meta.table] = meta
+
+        now = time.time()
+        for pair, tables in fetched.items():
+            self._tables[pair] = tables
+            self._cache.set('.'.join(pair), {
+                'fetched_at': now,
+                'tables': {name: asdict(meta) for name, meta in tables.items()}
+            })
+
+    def fetch_for(self, datasets: Iterable[AbstractDataset], refresh: bool = False) -> None:
+        """Load metadata for every `BigQueryDataset` in `datasets`."""
+        self.fetch(
+            [(ds.params.project_id, ds.params.dataset) for ds in datasets
+            if isinstance(ds, BigQueryDataset)],
+            refresh=refresh
+        )
+
+    def tables(self, project_id: str, dataset: str) -> Dict[str, TableMetadata]:
+        """Every table of `project_id.dataset` by name, empty if it does not exist."""
+        pair = (project_id, dataset)
+        if pair not in self._tables:
+            self.fetch([pair])
+        return dict(self._tables[pair])
+
+    def get(self, ds: BigQueryDataset) -> Optional[TableMetadata]:
+        """Metadata of the dataset's versioned table, None if it does not exist."""
+        p = ds.params
+        pair = (p.project_id, p.dataset)
+        if pair not in self._tables:
+            self.fetch([pair])
+        return self._tables[pair].get(p.ver_tbl)
+
+    def exists(self, ds: BigQueryDataset) -> bool:
+        return self.get(ds) is not None
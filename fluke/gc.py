@@ -0,0 +1,293 @@
+"""Garbage collection of old dataset versions and pipelines stores."""
+import os
+import shutil
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from fluke.config.datasets import Datasets
+from fluke.config.pipelines import PipelinesConfig
+from fluke.datasets.formats import STORAGE_FORMATS
+from fluke.datasets.manifest import JsonManifest, file_checksum, file_stat, fluke_state_dir
+from fluke.datasets.query_dataset import BigQueryDataset, BigQueryMetadata, QueryDataset
+from fluke.datasets.query_dataset.bigquery import BQ_METADATA_CACHE
+from fluke.jobs import JobResult, run_jobs
+from fluke.ledger import RunLedger
+from fluke.pipelines.store import is_store_object
+from fluke.utils import Cadence, run_r
+
+# files next to a migrated version that are not versions themselves
+_SIDECAR_SUFFIXES = ('.fluke.json', '.partial')
+
+
+@dataclass
+class GcItem:
+    """A version of a dataset table, a migrated dataset or a pipelines store."""
+    kind: str
+    owner: str
+    version: str
+    modified: float
+    num_bytes: int
+    path: Optional[Path] = None
+    project_id: Optional[str] = None
+    dataset: Optional[str] = None
+    table: Optional[str] = None
+    keep_reason: Optional[str] = None
+
+    @property
+    def keep(self) -> bool:
+        return self.keep_reason is not None
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Which versions to keep besides the current ones: the `keep_last` most
+    recently modified, and with a `cadence` the most recent version of each
+    of the `keep_periods` latest days, weeks or months.
+    """
+    keep_last: int = 3
+    cadence: Optional[Cadence] = None
+    keep_periods: int = 6
+
+    def apply(self, items: List[GcItem], current: Set[str]) -> None:
+        """Set `keep_reason` of the `items` of one table, dataset or store."""
+        ordered = sorted(items, key=lambda item: item.modified, reverse=True)
+        periods: List[str] = []
+        # current versions are kept anyway, they do not count towards `keep_last`
+        rank = 0
+        for item in ordered:
+            if item.version in current:
+                item.keep_reason = 'current'
+            else:
+                if rank < self.keep_last:
+                    item.keep_reason = f'last {self.keep_last}'
+                rank += 1
+            if self.cadence is not None:
+                period = self.cadence.period(datetime.fromtimestamp(item.modified))
+                if period not in periods:
+                    periods.append(period)
+                    if len(periods) <= self.keep_periods and item.keep_reason is None:
+                        item.keep_reason = f'{self.cadence.kw} {period}'
+
+
+def _local_version(name: str) -> Optional[str]:
+    if name.startswith('.') or name.endswith(_SIDECAR_SUFFIXES):
+        return None
+    for fmt in STORAGE_FORMATS.values():
+        if name.endswith(fmt.extension):
+            return name[:-len(fmt.extension)]
+    return name
+
+
+def _modified(path: Path, marker: Path) -> Tuple[float, int]:
+    """
+    Modification time and size of `path`. The time is the one of `marker`
+    if it exists, as files hard linked by `dedup` share their times.
+    """
+    stat = file_stat(path)
+    modified = stat['mtime_ns'] / 1e9
+    if marker.exists():
+        modified = marker.stat().st_mtime
+    return modified, stat['size']
+
+
+def _local_items(location: Path, owner: str) -> List[GcItem]:
+    items = []
+    if not location.is_dir():
+        return items
+    for path in sorted(location.iterdir()):
+        version = _local_version(path.name)
+        if version is None:
+            continue
+        # the migration manifest is written after each download
+        modified, size = _modified(path, path.with_name(f'{path.name}.fluke.json'))
+        items.append(GcItem(
+            kind='local', owner=owner, version=version,
+            modified=modified, num_bytes=size, path=path))
+    return items
+
+
+def _bigquery_items(tables: Iterable[str], metadata: BigQueryMetadata,
+project_id: str, dataset: str, table: str, owner: str) -> List[GcItem]:
+    items = []
+    for name, meta in metadata.tables(project_id, dataset).items():
+        if name not in tables:
+            continue
+        items.append(GcItem(
+            kind='bigquery', owner=owner, version=name[len(table) + 1:],
+            modified=meta.last_modified, num_bytes=meta.num_bytes,
+            project_id=project_id, dataset=dataset, table=name))
+    return items
+
+
+def _created_tables(owners: Iterable[QueryDataset], ledger: RunLedger) -> Set[str]:
+    """
+    Versions of the owners' table that fluke created: the tables of their
+    queries recorded in the run ledger and in the queries manifest. Other
+    tables of the BigQuery dataset sharing the name prefix are never collected.
+    """
+    tables = set()
+    for ds in owners:
+        p = ds.params
+        tables.add(p.ver_tbl)
+        for run in ledger.runs(kind='query', name=ds.name, status='ok'):
+            if run.version is not None:
+                tables.add(f'{p.table}_{run.version}')
+        entry = ds._query_manifest.get(ds.name)
+        if entry is not None and entry.get('table'):
+            tables.add(entry['table'])
+    return tables
+
+
+def collect(policy: RetentionPolicy, bigquery: bool = True,
+refresh: bool = False) -> List[GcItem]:
+    """
+    Versions of every BigQuery dataset's remote table (if `bigquery`) and
+    local directory, and the pipelines stores, with the policy applied.
+    The versions configured in `datasets.yaml` and `pipelines.yaml` are kept.
+    """
+    datasets = [ds for ds in Datasets() if isinstance(ds, BigQueryDataset)]
+    by_table: Dict[Tuple[str, str, str], List[BigQueryDataset]] = defaultdict(list)
+    for ds in datasets:
+        p = ds.params
+        by_table[(str(p.project_id), str(p.dataset), str(p.table))].append(ds)
+
+    metadata = BigQueryMetadata()
+    ledger = RunLedger()
+    if bigquery:
+        metadata.fetch_for(datasets, refresh=refresh)
+
+    items = []
+    for (project_id, dataset, table), owners in by_table.items():
+        owner = ', '.join(ds.name for ds in owners)
+        current = {ds.params.version for ds in owners}
+        groups = [_local_items(owners[0].params.location, owner)]
+        if bigquery:
+            groups.append(_bigquery_items(
+                _created_tables(owners, ledger), metadata,
+                project_id, dataset, table, owner))
+        for group in groups:
+            policy.apply(group, current)
+            items.extend(group)
+
+    config = PipelinesConfig()
+    stores_dir = Path(config.root, 'pipelines', 'store')
+    if stores_dir.is_dir():
+        stores = []
+        for path in sorted(stores_dir.iterdir()):
+            if not path.is_dir() or path.name.startswith('.'):
+                continue
+            # `meta/meta` is appended to by each make
+            modified, size = _modified(path, Path(path, 'meta', 'meta'))
+            stores.append(GcItem(
+                kind='store', owner='pipelines', version=path.name,
+                modified=modified, num_bytes=size, path=path))
+        policy.apply(stores, {config.version} if config.version else set())
+        items.extend(stores)
+    return items
+
+
+def _delete_table(item: GcItem) -> None:
+    cmd = f"""
+    bigrquery::bq_table_delete(
+        bigrquery::bq_table("{item.project_id}", "{item.dataset}", "{item.table}")
+    )
+    """
+    run_r(cmd, ['-e'], quiet=True, pooled=True)
+
+
+def _remove_local(path: Path) -> None:
+    for target in [path] + [path.with_name(f'{path.name}{s}') for s in _SIDECAR_SUFFIXES]:
+        if target.is_dir():
+            shutil.rmtree(target)
+        elif target.exists():
+            target.unlink()
+
+
+def delete_items(items: List[GcItem], jobs: int = 4,
+keep_going: bool = True) -> List[JobResult]:
+    """
+    Delete the `items` not kept: remote tables concurrently with `jobs`
+    workers, then local versions and stores. Returns one result per item.
+    """
+    remote: Dict[str, Callable[[], None]] = {}
+    local: Dict[str, Callable[[], None]] = {}
+    for item in items:
+        if item.keep:
+            continue
+        label = f'{item.kind}:{item.owner}:{item.version}'
+        if item.kind == 'bigquery':
+            remote[label] = partial(_delete_table, item)
+        elif item.path is not None:
+            local[label] = partial(_remove_local, item.path)
+
+    results = run_jobs(remote, max_workers=jobs, keep_going=keep_going) if remote else []
+    if local:
+        results += run_jobs(local, max_workers=1, keep_going=keep_going)
+
+    # cached metadata of the BigQuery datasets that changed is stale
+    cache = JsonManifest(Path(fluke_state_dir(), BQ_METADATA_CACHE))
+    for project_id, dataset in {
+        (item.project_id, item.dataset) for item in items
+        if item.kind == 'bigquery' and not item.keep
+    }:
+        cache.remove(f'{project_id}.{dataset}')
+    return results
+
+
+@dataclass
+class DedupResult:
+    files: int = 0
+    linked: int = 0
+    saved_bytes: int = 0
+
+
+def _dedup_candidates(items: List[GcItem]) -> List[Path]:
+    files = []
+    for item in items:
+        if not item.keep or item.path is None or item.kind == 'bigquery':
+            continue
+        paths = [item.path] if item.path.is_file() else sorted(
+            f for f in item.path.rglob('*') if f.is_file())
+        for path in paths:
+            # store files other than objects are appended to in place
+            if item.kind == 'store' and not is_store_object(path):
+                continue
+            files.append(path)
+    return files
+
+
+def dedup(items: List[GcItem], dry_run: bool = False) -> DedupResult:
+    """
+    Replace identical local files of the kept versions and stores by hard
+    links to one copy. Files are compared by size, then by checksum.
+    """
+    result = DedupResult()
+    by_size: Dict[Tuple[int, int], List[Path]] = defaultdict(list)
+    for path in _dedup_candidates(items):
+        stat = path.stat()
+        if stat.st_size > 0:
+            by_size[(stat.st_dev, stat.st_size)].append(path)
+        result.files += 1
+
+    for (_, size), paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        by_checksum: Dict[str, List[Path]] = defaultdict(list)
+        for path in paths:
+            by_checksum[file_checksum(path)].append(path)
+        for same in by_checksum.values():
+            first = same[0]
+            for path in same[1:]:
+                if path.stat().st_ino == first.stat().st_ino:
+                    continue
+                result.linked += 1
+                result.saved_bytes += size
+                if not dry_run:
+                    tmp = path.with_name(f'.{path.name}.gc-link')
+                    os.link(first, tmp)
+                    os.replace(tmp, path)
+    return result
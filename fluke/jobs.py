@@ -0,0 +1,89 @@
+"""Bounded concurrent execution of independent named jobs."""
+import time
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_EXCEPTION,
+    Future,
+    ThreadPoolExecutor,
+    wait
+)
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from fluke.logger import init_logger, job_prefix
+from fluke.utils import format_table
+
+logger = init_logger()
+
+
+@dataclass
+class JobResult:
+    name: str
+    status: str = 'pending'
+    seconds: Optional[float] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ('ok', 'skipped')
+
+
+def _run_job(name: str, func: Callable[[], Optional[str]],
+result: JobResult) -> None:
+    token = job_prefix.set(name)
+    start = time.perf_counter()
+    result.status = 'running'
+    try:
+        status = func()
+        result.status = status if isinstance(status, str) else 'ok'
+    except Exception as error:
+        result.status = 'failed'
+        result.error = error
+        logger.info(f'Failed: {error}')
+        raise
+    finally:
+        result.seconds = time.perf_counter() - start
+        job_prefix.reset(token)
+
+
+def run_jobs(jobs: Dict[str, Callable[[], Optional[str]]], max_workers: int = 1,
+keep_going: bool = False) -> List[JobResult]:
+    """
+    Run `jobs` (name -> callable) using at most `max_workers` threads.
+    A job may return a status such as `'skipped'`, otherwise it is `'ok'`.
+
+    Log records emitted while a job runs are prefixed with its name. If
+    `keep_going` is False, jobs that have not started yet are cancelled
+    after the first failure. Returns one `JobResult` per job, in the order
+    of `jobs`.
+    """
+    if max_workers < 1:
+        raise ValueError('`max_workers` must be at least 1.')
+
+    results = {name: JobResult(name) for name in jobs}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures: Dict[Future, str] = {
+            executor.submit(_run_job, name, func, results[name]): name
+            for name, func in jobs.items()
+        }
+        return_when = ALL_COMPLETED if keep_going else FIRST_EXCEPTION
+        done, pending = wait(futures, return_when=return_when)
+        if pending:
+            for future in pending:
+                if future.cancel():
+                    results[futures[future]].status = 'cancelled'
+            wait(pending)
+
+    return list(results.values())
+
+
+def format_summary(results: List[JobResult]) -> str:
+    """Render job results as a plain-text table."""
+    rows = [('NAME', 'STATUS', 'SECONDS', 'ERROR')]
+    for res in results:
+        seconds = f'{res.seconds:.1f}' if res.seconds is not None else '-'
+        error = ''
+        if res.error is not None:
+            error = (str(res.error).splitlines() or [type(res.error).__name__])[0]
+        rows.append((res.name, res.status, seconds, error))
+
+    return format_table(rows)
@@ -0,0 +1,143 @@
+"""Persistent history of query, migrate and pipeline runs in SQLite."""
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import click
+from fluke.datasets.manifest import fluke_state_dir
+from fluke.logger import init_logger
+
+logger = init_logger()
+
+LEDGER_FILE = 'runs.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT,
+    status TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    bytes INTEGER,
+    rows INTEGER,
+    host TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_kind_name ON runs (kind, name, id);
+"""
+
+
+@dataclass
+class RunRecord:
+    kind: str
+    name: str
+    status: str
+    seconds: float
+    version: Optional[str] = None
+    bytes: Optional[int] = None
+    rows: Optional[int] = None
+    host: Optional[str] = None
+    error: Optional[str] = None
+    started_at: Optional[str] = None
+
+
+class RunLedger:
+    """
+    Append-only table of runs. Every call opens its own connection, so the
+    ledger can be used from several threads and processes at once.
+    """
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path if path is not None else Path(fluke_state_dir(), LEDGER_FILE)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def record(self, run: RunRecord) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    ('INSERT INTO runs (started_at, kind, name, version, status, '
+                    'seconds, bytes, rows, host, error) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'),
+                    (run.started_at or datetime.now().isoformat(timespec='seconds'),
+                    run.kind, run.name, run.version, run.status, run.seconds,
+                    run.bytes, run.rows, run.host or socket.gethostname(), run.error)
+                )
+        finally:
+            conn.close()
+
+    def runs(self, kind: Optional[str] = None, name: Optional[str] = None,
+    status: Optional[str] = None) -> List[RunRecord]:
+        """Runs matching the filters, oldest first."""
+        clauses, params = [], []
+        for column, value in (('kind', kind), ('name', name), ('status', status)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                (f'SELECT started_at, kind, name, version, status, seconds, bytes, '
+                f'rows, host, error FROM runs {where} ORDER BY id'),
+                params
+            ).fetchall()
+        finally:
+            conn.close()
+        return [RunRecord(**dict(row)) for row in rows]
+
+
+def record_run(run: RunRecord, ledger: Optional[RunLedger] = None) -> None:
+    """Append `run` to the ledger. Failing to do so never fails the run."""
+    try:
+        (ledger or RunLedger()).record(run)
+    except (sqlite3.Error, OSError, click.UsageError) as error:
+        logger.info(f'Could not record run in the ledger: {error}')
+
+
+@contextmanager
+def ledger_run(kind: str, name: str,
+version: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Record the block as a run of `kind` (e.g. `'migrate'`) for `name`.
+    Yields a dict where the block may set `bytes` and `rows`. The run is
+    recorded as `'failed'` if the block raises.
+    """
+    started_at = datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    measures: Dict[str, Any] = {}
+    status, error = 'ok', None
+    try:
+        yield measures
+    except BaseException as err:
+        status, error = 'failed', (str(err).splitlines() or [type(err).__name__])[0]
+        raise
+    finally:
+        record_run(RunRecord(
+            kind=kind, name=name, version=version, status=status,
+            seconds=time.perf_counter() - start, bytes=measures.get('bytes'),
+            rows=measures.get('rows'), error=error, started_at=started_at
+        ))
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """`q`-th percentile (0-100) of `values`, linearly interpolated."""
+    if not values:
+        raise ValueError('percentile of an empty sequence')
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
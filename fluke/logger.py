@@ -1,13 +1,25 @@
 import logging
 from logging import Logger
 import sys
+from contextvars import ContextVar
 from typing import Optional
 
+# name of the job (e.g. a dataset) the current thread is working on.
+job_prefix: ContextVar[str] = ContextVar('job_prefix', default='')
+
+
+class JobPrefixFilter(logging.Filter):
+    """Adds the current `job_prefix` to log records."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        prefix = job_prefix.get()
+        record.job_prefix = f'[{prefix}] ' if prefix else ''
+        return True
+
 
 def init_logger(log_file_path: Optional[str] = None,
 log_file_level: int =logging.NOTSET, name: Optional[str]= None) -> Logger:
     """Basic logger for fluke framework."""
-    log_format = logging.Formatter("[%(asctime)s] %(message)s")
+    log_format = logging.Formatter("[%(asctime)s] %(job_prefix)s%(message)s")
     if name is None:
         logger = logging.getLogger()
     else:
@@ -16,12 +28,14 @@ log_file_level: int =logging.NOTSET, name: Optional[str]= None) -> Logger:
 
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(log_format)
+    console_handler.addFilter(JobPrefixFilter())
     logger.handlers = [console_handler]
 
     if log_file_path is not None:
         file_handler = logging.FileHandler(log_file_path, mode = 'w')
         file_handler.setLevel(log_file_level)
         file_handler.setFormatter(log_format)
+        file_handler.addFilter(JobPrefixFilter())
         logger.addHandler(file_handler)
 
-    return logger
\ No newline at end of file
+    return logger
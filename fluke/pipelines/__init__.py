@@ -0,0 +1 @@
+from .runner import PipelineRun, PipelineScheduler, available_memory, run_pipelines
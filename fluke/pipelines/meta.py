@@ -0,0 +1,226 @@
+"""Read the `targets` meta store (`<store>/meta/meta`) without starting R."""
+import csv
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+META_PATH = Path('meta', 'meta')
+PROGRESS_PATH = Path('meta', 'progress')
+
+# `targets` records file times as days since the epoch, e.g. `t19208.70523s`,
+# and sizes as e.g. `s55b`
+_TIME_PATTERN = re.compile(r'^t(-?\d+(?:\.\d+)?)s$')
+_SIZE_PATTERN = re.compile(r'^s(\d+(?:\.\d+)?)b$')
+
+
+def _optional(value: Optional[str]) -> Optional[str]:
+    return value if value not in (None, '', 'NA') else None
+
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    value = _optional(value)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _to_list(value: Optional[str]) -> List[str]:
+    value = _optional(value)
+    return value.split('*') if value is not None else []
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Unix timestamp of a `targets` time field."""
+    match = _TIME_PATTERN.match(value or '')
+    return float(match.group(1)) * 86400 if match else None
+
+
+def parse_size(value: Optional[str]) -> Optional[int]:
+    """Bytes of a `targets` size field."""
+    match = _SIZE_PATTERN.match(value or '')
+    return int(float(match.group(1))) if match else None
+
+
+@dataclass
+class TargetMeta:
+    """The last recorded entry of a target (or function/object) in a store."""
+    name: str
+    type: str
+    data: Optional[str] = None
+    command: Optional[str] = None
+    depend: Optional[str] = None
+    path: List[str] = field(default_factory=list)
+    time: Optional[float] = None
+    size: Optional[int] = None
+    bytes: Optional[int] = None
+    format: Optional[str] = None
+    parent: Optional[str] = None
+    children: List[str] = field(default_factory=list)
+    seconds: Optional[float] = None
+    warnings: Optional[str] = None
+    error: Optional[str] = None
+    progress: Optional[str] = None
+
+    @property
+    def is_target(self) -> bool:
+        """Globals (functions and objects) are recorded alongside targets."""
+        return self.type not in ('function', 'object')
+
+    @property
+    def errored(self) -> bool:
+        return self.error is not None or self.progress == 'errored'
+
+    @property
+    def built_at(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self.time) if self.time is not None else None
+
+    def stale_files(self, root: Path = Path('.')) -> List[str]:
+        """
+        Files of a `format = "file"` target that are missing or whose size
+        or modification time differ from those recorded in the store. Paths
+        are relative to `root`, the directory `tar_make` was run from.
+        """
+        if self.format != 'file':
+            return []
+        stale = []
+        total = 0
+        latest = None
+        for path in self.path:
+            try:
+                stat = os.stat(Path(root, path))
+            except OSError:
+                stale.append(path)
+                continue
+            total += stat.st_size
+            latest = stat.st_mtime if latest is None else max(latest, stat.st_mtime)
+        if stale:
+            return stale
+        size_changed = self.size is not None and total != self.size
+        # `targets` keeps file times to about a millisecond
+        time_changed = (self.time is not None and latest is not None
+            and abs(latest - self.time) > 1e-3)
+        return list(self.path) if size_changed or time_changed else []
+
+
+def _records(path: Path) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Raw text (without the line ending) and fields of each record of a file
+    written by `data.table::fwrite(sep = "|")`, which quotes the fields
+    holding the delimiter, quotes or line breaks.
+    """
+    with path.open('r', encoding='utf-8', errors='replace', newline='') as file:
+        consumed: List[str] = []
+
+        def lines() -> Iterator[str]:
+            for line in file:
+                consumed.append(line)
+                yield line
+
+        # the reader takes lines only until it completed a record
+        for values in csv.reader(lines(), delimiter='|'):
+            raw = ''.join(consumed)
+            consumed.clear()
+            if values:
+                yield raw.rstrip('\r\n'), values
+
+
+def _read_delimited(path: Path) -> List[Dict[str, str]]:
+    records = _records(path)
+    _, header = next(records, ('', []))
+    rows = []
+    for _, values in records:
+        # unquoted, an error message may contain the delimiter, it is the last field
+        if len(values) > len(header):
+            values = values[:len(header) - 1] + ['|'.join(values[len(header) - 1:])]
+        rows.append(dict(zip(header, values)))
+    return rows
+
+
+def read_progress(store: Path) -> Dict[str, str]:
+    """Latest progress (`built`, `errored`, ...) of each target in `store`."""
+    path = Path(store, PROGRESS_PATH)
+    if not path.exists():
+        return {}
+    return {
+        row['name']: row.get('progress', '')
+        for row in _read_delimited(path) if 'name' in row
+    }
+
+
+def read_meta(store: Path) -> Dict[str, TargetMeta]:
+    """
+    Entries of `store`'s meta file by name. The file is appended to by
+    each make, so the last entry of a name wins, as in `targets::tar_meta`.
+    Raises FileNotFoundError if the store has no meta file.
+    """
+    progress = read_progress(store)
+    entries: Dict[str, TargetMeta] = {}
+    for row in _read_delimited(Path(store, META_PATH)):
+        name = row.get('name')
+        if not name:
+            continue
+        entries[name] = TargetMeta(
+            name=name,
+            type=row.get('type', ''),
+            data=_optional(row.get('data')),
+            command=_optional(row.get('command')),
+            depend=_optional(row.get('depend')),
+            path=_to_list(row.get('path')),
+            time=parse_time(row.get('time')),
+            size=parse_size(row.get('size')),
+            bytes=_to_int(row.get('bytes')),
+            format=_optional(row.get('format')),
+            parent=_optional(row.get('parent')),
+            children=_to_list(row.get('children')),
+            seconds=_to_float(row.get('seconds')),
+            warnings=_optional(row.get('warnings')),
+            error=_optional(row.get('error')),
+            progress=progress.get(name)
+        )
+    return entries
+
+
+def read_targets(store: Path) -> List[TargetMeta]:
+    """Targets of `store` (without globals), in the order they were first recorded."""
+    return [entry for entry in read_meta(store).values() if entry.is_target]
+
+
+def meta_lines(store: Path) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    Header and last raw line of each name in `store`'s meta file, to move
+    entries between stores without parsing them. (None, {}) if it is missing.
+    """
+    path = Path(store, META_PATH)
+    if not path.exists():
+        return None, {}
+    records = _records(path)
+    header, fields = next(records, (None, []))
+    if header is None:
+        return None, {}
+    index = fields.index('name')
+    entries = {}
+    for line, values in records:
+        if len(values) > index and values[index]:
+            entries[values[index]] = line
+    return header, entries
+
+
+def append_meta_lines(store: Path, header: str, lines: Iterable[str]) -> None:
+    """Append raw `lines` to `store`'s meta file, starting it with `header`."""
+    path = Path(store, META_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    new = not path.exists() or path.stat().st_size == 0
+    with path.open('a', encoding='utf-8') as file:
+        if new:
+            file.write(f'{header}\n')
+        for line in lines:
+            file.write(f'{line}\n')
@@ -0,0 +1,103 @@
+"""Making a pipeline while the datasets it uses are migrated in the background."""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from fluke.jobs import JobResult, _run_job
+from fluke.logger import init_logger
+from fluke.pipelines.profile import downstream_closure
+
+logger = init_logger()
+
+# suffix of the `format = "file"` target created by `use_dataset`
+PATH_SUFFIX = '_path'
+
+
+def dataset_path_targets(graph: Dict[str, List[str]],
+datasets: Iterable[str]) -> Dict[str, str]:
+    """`<dataset>_path` targets of `graph`, as created by `use_dataset`, by dataset."""
+    return {
+        dataset: f'{dataset}{PATH_SUFFIX}' for dataset in datasets
+        if f'{dataset}{PATH_SUFFIX}' in graph
+    }
+
+
+def names_make_cmd(names: List[str]) -> str:
+    """R source making `names` (and what they depend on) into the project store."""
+    quoted = ', '.join(f'"{name}"' for name in names)
+    return f"""
+    library(fluke)
+    pipelines <- get_pipelines()
+    targets::tar_make(names = c({quoted}))
+    """
+
+
+class Prefetcher:
+    """
+    Make the targets of `graph` while `fetches` (dataset -> callable making
+    its file ready) run in a pool of `jobs` threads.
+
+    The targets are made in rounds with `make`. Each round makes the targets
+    not made yet that do not depend on the path target of a dataset still
+    being fetched, so that targets without datasets start at once. When a
+    round ends and nothing new is unblocked, the next fetch to finish is
+    awaited. Targets downstream of a failed fetch are never made; with
+    `keep_going` False, fetches not started yet are cancelled after it.
+    """
+    def __init__(self, graph: Dict[str, List[str]],
+    fetches: Dict[str, Callable[[], Optional[str]]], path_targets: Dict[str, str],
+    make: Callable[[List[str]], None], jobs: int = 2, keep_going: bool = False) -> None:
+        if jobs < 1:
+            raise ValueError('`jobs` must be at least 1.')
+        self.graph = graph
+        self.fetches = fetches
+        self.path_targets = path_targets
+        self.make = make
+        self.jobs = jobs
+        self.keep_going = keep_going
+        self.results = {name: JobResult(name) for name in fetches}
+        # targets left unmade because a fetch failed
+        self.blocked: Set[str] = set()
+
+    def _blocked_by(self, datasets: Iterable[str]) -> Set[str]:
+        return downstream_closure(
+            self.graph, [self.path_targets[ds] for ds in datasets if ds in self.path_targets])
+
+    def run(self) -> List[JobResult]:
+        """Fetch the datasets and make the targets, returns one result per fetch."""
+        made: Set[str] = set()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures: Dict[str, Future] = {
+                name: executor.submit(_run_job, name, func, self.results[name])
+                for name, func in self.fetches.items()
+            }
+            try:
+                while True:
+                    if not self.keep_going and any(
+                        res.status == 'failed' for res in self.results.values()):
+                        self._cancel(futures)
+                    pending = [name for name, f in futures.items() if not f.done()]
+                    unready = pending + [
+                        name for name, res in self.results.items()
+                        if res.status in ('failed', 'cancelled')
+                    ]
+                    blocked = self._blocked_by(unready)
+                    new = [name for name in self.graph if name not in blocked | made]
+                    if new:
+                        logger.info(
+                            f'Making {len(new)} targets, {len(blocked)} wait on datasets.')
+                        self.make(new)
+                        made.update(new)
+                        continue
+                    if not pending:
+                        self.blocked = blocked
+                        break
+                    wait([futures[name] for name in pending], return_when=FIRST_COMPLETED)
+            except BaseException:
+                self._cancel(futures)
+                raise
+        return [self.results[name] for name in self.fetches]
+
+    def _cancel(self, futures: Dict[str, Future]) -> None:
+        """Cancel the fetches not started yet."""
+        for name, future in futures.items():
+            if future.cancel():
+                self.results[name].status = 'cancelled'
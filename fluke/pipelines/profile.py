@@ -0,0 +1,293 @@
+"""Where pipeline time goes: critical path, slowest targets and parallelism headroom."""
+import heapq
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from fluke.pipelines.meta import TargetMeta
+from fluke.utils import run_r
+
+_OUTPUT_MARKER = '<<fluke-graph>>'
+
+
+@dataclass
+class TargetProfile:
+    name: str
+    seconds: float = 0.0
+    bytes: Optional[int] = None
+    deps: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Headroom:
+    workers: int
+    # total seconds of work
+    total: float
+    # lower bound, max of the critical path and the work spread evenly
+    ideal_seconds: float
+    # greedy schedule, longest remaining path first
+    scheduled_seconds: float
+
+    @property
+    def ideal_speedup(self) -> float:
+        return 1.0 if self.ideal_seconds == 0 else self.total / self.ideal_seconds
+
+    @property
+    def scheduled_speedup(self) -> float:
+        return 1.0 if self.scheduled_seconds == 0 else self.total / self.scheduled_seconds
+
+
+@dataclass
+class PipelineProfile:
+    targets: Dict[str, TargetProfile]
+    critical_path: List[str]
+    critical_seconds: float
+    headroom: List[Headroom]
+    # wall time of the last recorded make, if any
+    achieved_seconds: Optional[float] = None
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(t.seconds for t in self.targets.values())
+
+    @property
+    def max_parallelism(self) -> float:
+        if self.critical_seconds == 0:
+            return 1.0
+        return self.total_seconds / self.critical_seconds
+
+    @property
+    def achieved_speedup(self) -> Optional[float]:
+        if not self.achieved_seconds:
+            return None
+        return self.total_seconds / self.achieved_seconds
+
+    def slowest(self, top: int) -> List[TargetProfile]:
+        return sorted(self.targets.values(), key=lambda t: -t.seconds)[:top]
+
+    def largest(self, top: int) -> List[TargetProfile]:
+        sized = [t for t in self.targets.values() if t.bytes is not None]
+        return sorted(sized, key=lambda t: -(t.bytes or 0))[:top]
+
+    def to_dict(self, top: int) -> Dict[str, Any]:
+        return {
+            'targets': len(self.targets),
+            'total_seconds': self.total_seconds,
+            'critical_path': {
+                'seconds': self.critical_seconds,
+                'targets': [asdict(self.targets[name]) for name in self.critical_path]
+            },
+            'max_parallelism': self.max_parallelism,
+            'slowest': [asdict(t) for t in self.slowest(top)],
+            'largest': [asdict(t) for t in self.largest(top)],
+            'headroom': [
+                {'workers': h.workers, 'ideal_seconds': h.ideal_seconds,
+                'ideal_speedup': h.ideal_speedup,
+                'scheduled_seconds': h.scheduled_seconds,
+                'scheduled_speedup': h.scheduled_speedup}
+                for h in self.headroom
+            ],
+            'achieved_seconds': self.achieved_seconds,
+            'achieved_speedup': self.achieved_speedup
+        }
+
+
+def pipeline_graph(name: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Dependencies of every target of the project's pipelines, from R. With
+    `name`, only the targets of that pipeline and their upstream targets.
+    """
+    selected = 'tar_names'
+    if name is not None:
+        selected = (f"get_targets(prepare_targets(pipelines, name = '{name}'), "
+            'names = TRUE)')
+    cmd = f"""
+    library(fluke)
+    pipelines <- get_pipelines()
+    tars <- get_targets(prepare_targets(pipelines))
+    tar_names <- sapply(tars, function(x) x$settings$name)
+    selected <- {selected}
+    for (x in tars) {{
+        deps <- intersect(x$command$deps, tar_names)
+        cat(paste("{_OUTPUT_MARKER}", x$settings$name, paste(deps, collapse = ","),
+            x$settings$name %in% selected, sep = "\\t"), "\\n", sep = "")
+    }}
+    """
+    output = run_r(cmd, ['-e'], quiet=True, pooled=True)
+    graph: Dict[str, List[str]] = {}
+    selection = []
+    for line in output.splitlines():
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == _OUTPUT_MARKER and len(fields) > 1:
+            deps = fields[2] if len(fields) > 2 else ''
+            graph[fields[1]] = [dep for dep in deps.split(',') if dep]
+            if len(fields) < 4 or fields[3] == 'TRUE':
+                selection.append(fields[1])
+    return upstream_closure(graph, selection)
+
+
+def upstream_closure(graph: Dict[str, List[str]],
+names: Sequence[str]) -> Dict[str, List[str]]:
+    """The part of `graph` made of `names` and every target they depend on."""
+    keep = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name in keep or name not in graph:
+            continue
+        keep.add(name)
+        stack.extend(graph[name])
+    return {name: deps for name, deps in graph.items() if name in keep}
+
+
+def downstream_closure(graph: Dict[str, List[str]], names: Sequence[str]) -> Set[str]:
+    """`names` and every target of `graph` that depends on them."""
+    successors: Dict[str, List[str]] = {name: [] for name in graph}
+    for name, deps in graph.items():
+        for dep in deps:
+            successors.setdefault(dep, []).append(name)
+    keep: Set[str] = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name in keep:
+            continue
+        keep.add(name)
+        stack.extend(successors.get(name, []))
+    return keep
+
+
+def _cost(entry: Optional[TargetMeta],
+meta: Dict[str, TargetMeta]) -> Tuple[float, Optional[int]]:
+    """Seconds and bytes of a target, summed over its branches if it has any."""
+    if entry is None:
+        return 0.0, None
+    if entry.type == 'pattern' and entry.children:
+        branches = [meta[child] for child in entry.children if child in meta]
+        sizes = [b.bytes for b in branches if b.bytes is not None]
+        return (sum(b.seconds or 0.0 for b in branches),
+            sum(sizes) if sizes else None)
+    return entry.seconds or 0.0, entry.bytes
+
+
+def _successors(targets: Dict[str, TargetProfile]) -> Dict[str, List[str]]:
+    successors: Dict[str, List[str]] = {name: [] for name in targets}
+    for target in targets.values():
+        for dep in target.deps:
+            successors[dep].append(target.name)
+    return successors
+
+
+def _topological_order(targets: Dict[str, TargetProfile]) -> List[str]:
+    successors = _successors(targets)
+    pending = {name: len(t.deps) for name, t in targets.items()}
+    ready = [name for name, count in pending.items() if count == 0]
+    order = []
+    while ready:
+        name = ready.pop()
+        order.append(name)
+        for succ in successors[name]:
+            pending[succ] -= 1
+            if pending[succ] == 0:
+                ready.append(succ)
+    if len(order) != len(targets):
+        raise Exception('the pipelines dependency graph has a cycle.')
+    return order
+
+
+def _bottom_levels(targets: Dict[str, TargetProfile]) -> Dict[str, float]:
+    """Longest path in seconds from each target to the end of the graph."""
+    successors = _successors(targets)
+    levels: Dict[str, float] = {}
+    for name in reversed(_topological_order(targets)):
+        levels[name] = targets[name].seconds + max(
+            (levels[succ] for succ in successors[name]), default=0.0)
+    return levels
+
+
+def critical_path(targets: Dict[str, TargetProfile]) -> Tuple[float, List[str]]:
+    """Seconds and targets of the longest chain of dependent targets."""
+    if not targets:
+        return 0.0, []
+    levels = _bottom_levels(targets)
+    successors = _successors(targets)
+    name = max((n for n, t in targets.items() if not t.deps), key=lambda n: levels[n])
+    path = [name]
+    while successors[name]:
+        name = max(successors[name], key=lambda n: levels[n])
+        path.append(name)
+    return levels[path[0]], path
+
+
+def _list_schedule(targets: Dict[str, TargetProfile],
+workers: int) -> Tuple[float, Dict[str, int]]:
+    """
+    Greedy schedule of `targets` on `workers` workers, starting the ready
+    target with the longest remaining path first. Returns the makespan and
+    the worker (0-based) each target ran on.
+    """
+    levels = _bottom_levels(targets)
+    successors = _successors(targets)
+    pending = {name: len(t.deps) for name, t in targets.items()}
+    ready = [(-levels[name], name) for name, count in pending.items() if count == 0]
+    heapq.heapify(ready)
+    idle = list(range(workers))
+    running: List[Tuple[float, int, str]] = []
+    assignment: Dict[str, int] = {}
+    now = 0.0
+    while ready or running:
+        while ready and idle:
+            _, name = heapq.heappop(ready)
+            worker = heapq.heappop(idle)
+            assignment[name] = worker
+            heapq.heappush(running, (now + targets[name].seconds, worker, name))
+        now, worker, name = heapq.heappop(running)
+        heapq.heappush(idle, worker)
+        for succ in successors[name]:
+            pending[succ] -= 1
+            if pending[succ] == 0:
+                heapq.heappush(ready, (-levels[succ], succ))
+    return now, assignment
+
+
+def scheduled_makespan(targets: Dict[str, TargetProfile], workers: int) -> float:
+    """
+    Seconds to make `targets` with `workers` workers, starting the ready
+    target with the longest remaining path first, ignoring overheads.
+    """
+    return _list_schedule(targets, workers)[0]
+
+
+def partition_targets(targets: Dict[str, TargetProfile], n: int) -> List[List[str]]:
+    """
+    Split `targets` into `n` shards, each in dependency order, following
+    the schedule of `scheduled_makespan` so that shards are balanced and
+    wait on each other as little as possible.
+    """
+    _, assignment = _list_schedule(targets, n)
+    order = _topological_order(targets)
+    return [[name for name in order if assignment[name] == i] for i in range(n)]
+
+
+def profile_pipeline(meta: Dict[str, TargetMeta], graph: Dict[str, List[str]],
+workers: Sequence[int] = (1, 2, 4, 8),
+achieved_seconds: Optional[float] = None) -> PipelineProfile:
+    """
+    Profile the targets of `graph` (name -> dependencies) with the seconds
+    and bytes recorded in `meta`. Targets never built count as 0 seconds.
+    """
+    targets = {}
+    for name, deps in graph.items():
+        seconds, size = _cost(meta.get(name), meta)
+        targets[name] = TargetProfile(
+            name, seconds, size, [dep for dep in deps if dep in graph])
+    critical_seconds, path = critical_path(targets)
+    total = sum(t.seconds for t in targets.values())
+    headroom = [
+        Headroom(
+            workers=w,
+            total=total,
+            ideal_seconds=max(critical_seconds, total / w),
+            scheduled_seconds=scheduled_makespan(targets, w)
+        )
+        for w in workers
+    ]
+    return PipelineProfile(targets, path, critical_seconds, headroom, achieved_seconds)
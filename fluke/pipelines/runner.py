@@ -0,0 +1,176 @@
+"""Concurrent `targets` makes of independent pipelines, one R process each."""
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import click
+from fluke.config.pipelines import PipelineResources
+from fluke.jobs import JobResult
+from fluke.ledger import ledger_run
+from fluke.logger import init_logger
+from fluke.rpool import RSCRIPT
+
+logger = init_logger()
+
+MEMINFO_PATH = Path('/proc/meminfo')
+
+
+def available_memory(path: Path = MEMINFO_PATH) -> Optional[int]:
+    """`MemAvailable` in bytes, None where `/proc/meminfo` is not available."""
+    try:
+        with path.open('r', encoding='utf-8') as file:
+            for line in file:
+                key, _, value = line.partition(':')
+                if key == 'MemAvailable':
+                    # values are given in kB
+                    return int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+def pipeline_make_cmd(name: str, store: Path, workers: int = 1) -> str:
+    """R source making the targets of pipeline `name` into `store`."""
+    make_func = 'targets::tar_make'
+    extra_args = ''
+    if workers > 1:
+        make_func = 'targets::tar_make_future'
+        extra_args = f',\n        workers = {workers}'
+    return f"""
+    library(fluke)
+    pipelines <- get_pipelines()
+    {make_func}(
+        get_targets(prepare_targets(pipelines, name = '{name}'), names = TRUE),
+        store = '{store}'{extra_args}
+    )
+    """
+
+
+@dataclass
+class PipelineRun:
+    name: str
+    store: Path
+    resources: PipelineResources
+
+    def cmd(self, max_workers: int) -> str:
+        return pipeline_make_cmd(
+            self.name, self.store, min(self.resources.workers, max_workers))
+
+
+class PipelineScheduler:
+    """
+    Start pipeline runs as separate Rscript processes while they fit.
+
+    A run is admitted when its `targets` workers fit in the `max_workers`
+    not used by running pipelines and its memory fits in the available
+    memory, less the memory declared by running pipelines. A run that does
+    not fit is passed over so smaller ones can start, and a run is always
+    admitted when nothing else is running. Output lines of each process are
+    echoed prefixed with the pipeline name.
+    """
+    def __init__(self, runs: List[PipelineRun], max_workers: int = 1,
+    keep_going: bool = False, rscript: str = RSCRIPT,
+    meminfo: Callable[[], Optional[int]] = available_memory,
+    poll_interval: float = 1.0) -> None:
+        if max_workers < 1:
+            raise ValueError('`max_workers` must be at least 1.')
+        self.runs = runs
+        self.max_workers = max_workers
+        self.keep_going = keep_going
+        self.rscript = rscript
+        self.meminfo = meminfo
+        self.poll_interval = poll_interval
+        self.results = {run.name: JobResult(run.name) for run in runs}
+        self._cond = threading.Condition()
+        self._echo_lock = threading.Lock()
+        self._running: Dict[str, PipelineRun] = {}
+        self._failed = False
+
+    def _workers(self, run: PipelineRun) -> int:
+        return min(run.resources.workers, self.max_workers)
+
+    def _fits(self, run: PipelineRun) -> bool:
+        if not self._running:
+            return True
+        used = sum(self._workers(other) for other in self._running.values())
+        if used + self._workers(run) > self.max_workers:
+            return False
+        if run.resources.memory is not None:
+            available = self.meminfo()
+            reserved = sum(
+                other.resources.memory or 0 for other in self._running.values())
+            if available is not None and reserved + run.resources.memory > available:
+                return False
+        return True
+
+    def _echo(self, name: str, line: str) -> None:
+        with self._echo_lock:
+            click.echo(f'[{name}] {line.rstrip()}')
+
+    def _make(self, run: PipelineRun) -> None:
+        proc = subprocess.Popen(
+            [self.rscript, '-e', run.cmd(self.max_workers)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            self._echo(run.name, line)
+        returncode = proc.wait()
+        if returncode != 0:
+            raise Exception(
+                f'pipeline `{run.name}` failed with exit code {returncode}.')
+
+    def _run(self, run: PipelineRun) -> None:
+        result = self.results[run.name]
+        start = time.perf_counter()
+        try:
+            with ledger_run('pipeline', run.name):
+                self._make(run)
+            result.status = 'ok'
+        except Exception as error:
+            result.status = 'failed'
+            result.error = error
+            self._echo(run.name, f'Failed: {error}')
+        finally:
+            result.seconds = time.perf_counter() - start
+            with self._cond:
+                del self._running[run.name]
+                self._failed = self._failed or result.status == 'failed'
+                self._cond.notify_all()
+
+    def run(self) -> List[JobResult]:
+        """Make every pipeline, returns one `JobResult` per run in order."""
+        pending = list(self.runs)
+        threads = []
+        with self._cond:
+            while pending or self._running:
+                if self._failed and not self.keep_going:
+                    for run in pending:
+                        self.results[run.name].status = 'cancelled'
+                    pending = []
+                for run in list(pending):
+                    if self._fits(run):
+                        pending.remove(run)
+                        self._running[run.name] = run
+                        self.results[run.name].status = 'running'
+                        thread = threading.Thread(
+                            target=self._run, args=(run,), name=run.name, daemon=True)
+                        thread.start()
+                        threads.append(thread)
+                if pending or self._running:
+                    # memory may free up without any run finishing
+                    self._cond.wait(self.poll_interval)
+        for thread in threads:
+            thread.join()
+        return [self.results[run.name] for run in self.runs]
+
+
+def run_pipelines(runs: List[PipelineRun], max_workers: int = 1,
+keep_going: bool = False, **kwargs) -> List[JobResult]:
+    """See `PipelineScheduler`."""
+    return PipelineScheduler(runs, max_workers, keep_going, **kwargs).run()
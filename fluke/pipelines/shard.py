@@ -0,0 +1,328 @@
+"""
+Making the targets of a pipeline in shards, one process (or host) each,
+against a shared store.
+
+The coordinator splits the targets into dependency-respecting shards and
+writes the plan next to the store. Each shard makes its targets into a
+private store with `shortcut = TRUE`, importing the targets it depends on
+from the shared store and exporting the ones it made, under a file lock,
+so that no two `targets` processes ever write to the same store.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from fluke.datasets.manifest import atomic_write_text
+from fluke.pipelines.meta import (
+    META_PATH,
+    TargetMeta,
+    append_meta_lines,
+    meta_lines,
+    read_meta
+)
+from fluke.pipelines.profile import TargetProfile, _cost, partition_targets
+from fluke.pipelines.store import hardlink
+from fluke.utils import run_r
+
+PLAN_FILE = 'plan.json'
+LOCK_FILE = 'lock'
+HEARTBEAT_INTERVAL = 10.0
+# a peer whose heartbeat is older than this is taken as dead
+HEARTBEAT_STALE = 60.0
+
+# cost of a target never built, so that plans of new pipelines are balanced by count
+_DEFAULT_SECONDS = 1.0
+
+
+@dataclass
+class ShardPlan:
+    run_id: str
+    # targets of each shard, in dependency order
+    shards: List[List[str]]
+    # dependencies of every target of the plan
+    deps: Dict[str, List[str]]
+    name: Optional[str] = None
+    created_at: str = field(
+        default_factory=lambda: datetime.now().isoformat(timespec='seconds'))
+
+    @property
+    def n(self) -> int:
+        return len(self.shards)
+
+
+def shards_dir(store: Path) -> Path:
+    """Plans and per-shard state of the runs against `store`."""
+    return Path(store.parent, f'.{store.name}.shards')
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Exclusive `flock` on `path`, held by one process (of any host) at a time."""
+    import fcntl
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('a') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def plan_shards(graph: Dict[str, List[str]], meta: Dict[str, TargetMeta], n: int,
+name: Optional[str] = None) -> ShardPlan:
+    """
+    Split the targets of `graph` (name -> dependencies) into `n` shards,
+    balanced by the seconds recorded in `meta`.
+    """
+    if n < 1:
+        raise ValueError('the number of shards must be at least 1.')
+    targets = {}
+    for target, deps in graph.items():
+        seconds, _ = _cost(meta.get(target), meta)
+        targets[target] = TargetProfile(
+            target, seconds or _DEFAULT_SECONDS, None, [d for d in deps if d in graph])
+    return ShardPlan(
+        run_id=uuid.uuid4().hex[:12],
+        shards=partition_targets(targets, n),
+        deps={target: t.deps for target, t in targets.items()},
+        name=name
+    )
+
+
+def write_plan(store: Path, plan: ShardPlan) -> None:
+    """Make `plan` the current plan of `store`, dropping the state of older runs."""
+    root = shards_dir(store)
+    with file_lock(Path(root, LOCK_FILE)):
+        if root.is_dir():
+            for path in root.iterdir():
+                if path.is_dir() and path.name != plan.run_id:
+                    shutil.rmtree(path, ignore_errors=True)
+        atomic_write_text(Path(root, PLAN_FILE), json.dumps(asdict(plan), indent=2))
+
+
+def read_plan(store: Path) -> ShardPlan:
+    """The current plan of `store`. Raises FileNotFoundError if there is none."""
+    with Path(shards_dir(store), PLAN_FILE).open('r', encoding='utf-8') as file:
+        return ShardPlan(**json.load(file))
+
+
+def shard_make_cmd(names: List[str], store: Path) -> str:
+    """R source making `names` into `store`, trusting the store for their dependencies."""
+    quoted = ', '.join(f'"{name}"' for name in names)
+    return f"""
+    library(fluke)
+    pipelines <- get_pipelines()
+    targets::tar_make(
+        names = c({quoted}),
+        shortcut = TRUE,
+        store = '{store}'
+    )
+    """
+
+
+def _link_object(src: Path, dst: Path) -> None:
+    if dst.exists() and os.path.samefile(src, dst):
+        return
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f'.{dst.name}.shard')
+    if tmp.exists():
+        tmp.unlink()
+    if not hardlink(src, tmp):
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _with_branches(names: Iterable[str], meta: Dict[str, TargetMeta]) -> Set[str]:
+    selected = set(names)
+    for name in list(selected):
+        if name in meta:
+            selected.update(meta[name].children)
+    return selected
+
+
+def transfer_targets(src: Path, dst: Path, names: Iterable[str],
+globals_: bool = False) -> List[str]:
+    """
+    Copy the entries of `names` (with their branches, and with `globals_`
+    the recorded functions and objects) from store `src` into store `dst`.
+    Objects are hard linked and replaced atomically, meta entries that
+    differ are appended. Returns the names whose entries were appended.
+    """
+    meta = read_meta(src) if Path(src, META_PATH).exists() else {}
+    selected = _with_branches(names, meta)
+    if globals_:
+        selected.update(name for name, entry in meta.items() if not entry.is_target)
+    header, src_lines = meta_lines(src)
+    dst_header, dst_lines = meta_lines(dst)
+    if header is None:
+        return []
+    for name in sorted(selected):
+        obj = Path(src, 'objects', name)
+        if obj.is_file():
+            _link_object(obj, Path(dst, 'objects', name))
+    appended = [
+        name for name in sorted(selected)
+        if name in src_lines and src_lines[name] != dst_lines.get(name)
+    ]
+    append_meta_lines(dst, dst_header or header, [src_lines[name] for name in appended])
+    return appended
+
+
+class ShardFailed(Exception):
+    """Another shard of the run failed, the targets waiting on it cannot be made."""
+
+
+class ShardRunner:
+    """
+    Make shard `index` (0-based) of the current plan of `store`.
+
+    Targets are made in batches: a batch holds the pending targets whose
+    dependencies were made by any shard, or are in the batch themselves.
+    Before a batch, the targets it uses are imported from the shared store;
+    after it, the targets it made are exported and marked done so that the
+    other shards can go on. A failure is recorded for the other shards to
+    stop waiting. A shard run again after a failure resumes where it was.
+
+    A shard that dies without recording its failure is detected through
+    heartbeats: each shard touches its heartbeat file every
+    `heartbeat_interval` seconds while it runs, and a shard waiting on a
+    peer whose heartbeat is older than `stale_after` fails. Heartbeats
+    compare file times, so hosts need roughly synchronized clocks. With
+    `timeout`, a shard also fails after waiting that many seconds without
+    any shard making progress.
+    """
+    def __init__(self, store: Path, index: int, n: int, poll_interval: float = 1.0,
+    timeout: Optional[float] = None, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+    stale_after: float = HEARTBEAT_STALE) -> None:
+        self.store = store
+        self.plan = read_plan(store)
+        if self.plan.n != n:
+            raise Exception(
+                (f'{n} shards do not match the {self.plan.n} of the current plan. '
+                'Plan again with `fluke pipeline run --shards`.'))
+        if not 0 <= index < n:
+            raise Exception(f'shard {index + 1} is not between 1 and {n}.')
+        self.index = index
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.owners = {
+            name: i for i, names in enumerate(self.plan.shards) for name in names}
+        run_dir = Path(shards_dir(store), self.plan.run_id)
+        self.lock = Path(shards_dir(store), LOCK_FILE)
+        self.private = Path(run_dir, 'stores', str(index))
+        self.done_dir = Path(run_dir, 'done')
+        self.failed_dir = Path(run_dir, 'failed')
+        self.heartbeat_dir = Path(run_dir, 'heartbeat')
+
+    def _heartbeat(self, stop: threading.Event) -> None:
+        path = Path(self.heartbeat_dir, str(self.index))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            path.touch()
+            if stop.wait(self.heartbeat_interval):
+                return
+
+    def _check_peers(self, pending: List[str], done: Set[str]) -> None:
+        """Fail if a shard making a target waited on stopped sending heartbeats."""
+        peers = {
+            self.owners[dep] for name in pending for dep in self.plan.deps[name]
+            if dep not in done and self.owners.get(dep, self.index) != self.index
+        }
+        for peer in sorted(peers):
+            path = Path(self.heartbeat_dir, str(peer))
+            try:
+                age = time.time() - path.stat().st_mtime
+            except FileNotFoundError:
+                # not started yet, only `timeout` applies
+                continue
+            if age > self.stale_after:
+                raise Exception(
+                    (f'shard {peer + 1} sent no heartbeat for {age:.0f}s, '
+                    'it may have been killed. Run it again to resume.'))
+
+    def _done(self) -> Set[str]:
+        if not self.done_dir.is_dir():
+            return set()
+        return {path.name for path in self.done_dir.iterdir()}
+
+    def _check_failed(self) -> None:
+        if not self.failed_dir.is_dir():
+            return
+        for path in sorted(self.failed_dir.iterdir()):
+            raise ShardFailed(
+                f'shard {int(path.name) + 1} failed: {path.read_text().strip()}')
+
+    def _next_batch(self, pending: List[str], done: Set[str]) -> List[str]:
+        batch: List[str] = []
+        for name in pending:
+            if all(dep in done or dep in batch for dep in self.plan.deps[name]):
+                batch.append(name)
+        return batch
+
+    def _make(self, batch: List[str]) -> None:
+        upstream = {dep for name in batch for dep in self.plan.deps[name]}
+        with file_lock(self.lock):
+            # targets of the batch built by earlier runs may be up to date
+            transfer_targets(self.store, self.private, upstream | set(batch))
+        run_r(shard_make_cmd(batch, self.private), ['-e'])
+        with file_lock(self.lock):
+            transfer_targets(self.private, self.store, batch, globals_=True)
+            self.done_dir.mkdir(parents=True, exist_ok=True)
+            for name in batch:
+                Path(self.done_dir, name).touch()
+
+    def run(self) -> List[str]:
+        """Make the shard's targets, returns them in the order they were made."""
+        Path(self.failed_dir, str(self.index)).unlink(missing_ok=True)
+        done = self._done()
+        pending = [n for n in self.plan.shards[self.index] if n not in done]
+        made: List[str] = []
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop,), daemon=True)
+        heartbeat.start()
+        waiting_since, seen = time.monotonic(), len(done)
+        try:
+            while pending:
+                done = self._done()
+                if len(done) != seen:
+                    waiting_since, seen = time.monotonic(), len(done)
+                batch = self._next_batch(pending, done)
+                if not batch:
+                    self._check_failed()
+                    self._check_peers(pending, done)
+                    waited = time.monotonic() - waiting_since
+                    if self.timeout is not None and waited > self.timeout:
+                        raise Exception(
+                            (f'timed out after {waited:.0f}s waiting on other shards '
+                            f'for `{pending[0]}`.'))
+                    time.sleep(self.poll_interval)
+                    continue
+                self._make(batch)
+                made += batch
+                pending = [name for name in pending if name not in batch]
+        except ShardFailed:
+            raise
+        except BaseException as error:
+            self.failed_dir.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(
+                Path(self.failed_dir, str(self.index)),
+                (str(error).splitlines() or [type(error).__name__])[0])
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+        return made
+
+
+def run_shard(store: Path, index: int, n: int, **kwargs) -> List[str]:
+    """See `ShardRunner`."""
+    return ShardRunner(store, index, n, **kwargs).run()
@@ -0,0 +1,89 @@
+"""Cloning `targets` stores without copying their objects."""
+import errno
+import os
+import shutil
+from collections import Counter
+from pathlib import Path
+from typing import Dict
+
+# `FICLONE` ioctl request, shares the extents of a file on Btrfs, XFS, ...
+_FICLONE = 0x40049409
+_NO_REFLINK_ERRNOS = {
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF, errno.ENOSYS
+}
+
+
+def reflink(src: Path, dst: Path) -> bool:
+    """Copy-on-write clone of `src` to `dst`. False if the filesystem cannot."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with src.open('rb') as src_file, dst.open('wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError as error:
+            if error.errno in _NO_REFLINK_ERRNOS:
+                dst_file.close()
+                dst.unlink()
+                return False
+            raise
+    shutil.copystat(src, dst)
+    return True
+
+
+def hardlink(src: Path, dst: Path) -> bool:
+    """Hard link `dst` to `src`. False if they are on different filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError as error:
+        if error.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            return False
+        raise
+    return True
+
+
+def is_store_object(path: Path) -> bool:
+    # `targets` writes objects to a scratch file and moves it in place,
+    # other store files (e.g. `meta/meta`) are appended to
+    return path.parent.name == 'objects'
+
+
+def clone_store(src: Path, dst: Path) -> Dict[str, int]:
+    """
+    Clone the store (or directory of stores) `src` into `dst`, which must not
+    exist. Files are reflinked where the filesystem supports it. Otherwise
+    objects are hard linked, as `targets` replaces rather than rewrites them,
+    and the files it appends to are copied. The clone is built next to
+    `dst` and renamed into place, so an interrupted clone leaves no store.
+    Returns the number of files per method.
+    """
+    if dst.exists():
+        raise FileExistsError(f'`{dst}` already exists.')
+    tmp = Path(dst.parent, f'.{dst.name}.cloning')
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    methods: Counter = Counter()
+    can_reflink = True
+    try:
+        for dirpath, _, filenames in os.walk(src):
+            src_dir = Path(dirpath)
+            tmp_dir = Path(tmp, src_dir.relative_to(src))
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            for filename in filenames:
+                src_file, tmp_file = Path(src_dir, filename), Path(tmp_dir, filename)
+                if can_reflink:
+                    can_reflink = reflink(src_file, tmp_file)
+                    if can_reflink:
+                        methods['reflink'] += 1
+                        continue
+                if is_store_object(src_file) and hardlink(src_file, tmp_file):
+                    methods['hardlink'] += 1
+                    continue
+                shutil.copy2(src_file, tmp_file)
+                methods['copy'] += 1
+        os.replace(tmp, dst)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return dict(methods)
@@ -0,0 +1,335 @@
+"""Pool of long-lived R sessions that `run_r` can dispatch commands to.
+
+Each session is a single `Rscript` process running a small read-eval loop
+over its stdin/stdout pipes, so R startup, package loading and
+authentication (e.g. `bigrquery`) are paid once per session instead of once
+per command.
+"""
+import atexit
+import os
+import queue
+import subprocess
+import threading
+import uuid
+from typing import List, Optional, Sequence
+
+from fluke.logger import init_logger
+from fluke.trace import span
+
+logger = init_logger()
+
+RSCRIPT_ENVVAR = 'FLUKE_RSCRIPT'
+RSCRIPT = os.environ.get(RSCRIPT_ENVVAR, '/usr/bin/Rscript')
+POOL_SIZE_ENVVAR = 'FLUKE_R_WORKERS'
+# seconds a ping may take, including loading the preloaded packages at startup,
+# whatever the timeout of the commands run by the session
+HEALTH_TIMEOUT = 60.0
+
+# read-eval loop run by every worker. Commands are framed as:
+# <number of lines>\n<working directory>\n<source lines...>
+# and every reply ends with a `<token> OK|ERR` sentinel line.
+_WORKER_LOOP = """
+local({
+  args <- commandArgs(trailingOnly = TRUE)
+  token <- args[1]
+  for (pkg in args[-1]) requireNamespace(pkg, quietly = TRUE)
+  con <- file("stdin", open = "r")
+  repeat {
+    header <- readLines(con, n = 1L)
+    if (length(header) == 0L) break
+    wd <- readLines(con, n = 1L)
+    src <- paste(readLines(con, n = as.integer(header)), collapse = "\\n")
+    ok <- tryCatch({
+      setwd(wd)
+      env <- new.env(parent = globalenv())
+      for (expr in parse(text = src)) {
+        res <- withVisible(eval(expr, envir = env))
+        if (res$visible) print(res$value)
+      }
+      TRUE
+    }, error = function(e) {
+      message(conditionMessage(e))
+      FALSE
+    })
+    cat(sprintf("\\n%s %s\\n", token, if (ok) "OK" else "ERR"))
+    flush(stdout())
+  }
+})
+"""
+
+
+def _source_lines(src: str) -> List[str]:
+    """
+    Lines of `src` as `readLines` reads them: split on LF, CRLF and CR only.
+    `str.splitlines` also splits on e.g. form feeds and `\\u2028`, which would
+    frame a line count the worker does not read.
+    """
+    lines = src.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+class RSessionError(Exception):
+    """Raised when a command fails inside an R session."""
+
+
+class RSessionUnavailable(RSessionError):
+    """Raised when an R session cannot be started or stops responding."""
+
+
+class RSession:
+    """A single long-lived R process driven over pipes."""
+    def __init__(self, preload: Sequence[str] = (),
+    rscript: str = RSCRIPT, timeout: float = 60.0) -> None:
+        self.preload = list(preload)
+        self.rscript = rscript
+        self.timeout = timeout
+        self._token = f'<<fluke:{uuid.uuid4().hex}>>'
+        self._proc: Optional[subprocess.Popen] = None
+        self._lines: 'queue.Queue[Optional[str]]' = queue.Queue()
+
+    def start(self) -> None:
+        """Spawn the R process and wait until it answers a ping."""
+        with span('R session start', cat='r', preload=self.preload):
+            self._start()
+
+    def _start(self) -> None:
+        args = [self.rscript, '-e', _WORKER_LOOP, self._token] + self.preload
+        try:
+            self._proc = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1
+            )
+        except OSError as err:
+            raise RSessionUnavailable(
+                f'Could not start R session using `{self.rscript}`.'
+            ) from err
+
+        self._lines = queue.Queue()
+        reader = threading.Thread(
+            target=self._read_stdout, args=(self._proc, self._lines),
+            daemon=True)
+        reader.start()
+
+        if not self.is_healthy():
+            self.close()
+            raise RSessionUnavailable('R session did not respond after startup.')
+
+    @staticmethod
+    def _read_stdout(proc: subprocess.Popen,
+    lines: 'queue.Queue[Optional[str]]') -> None:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            lines.put(line)
+        # signal EOF to the consumer
+        lines.put(None)
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def is_healthy(self) -> bool:
+        """Ping the session, returns False if it is dead or unresponsive."""
+        try:
+            self.run('invisible(TRUE)', timeout=HEALTH_TIMEOUT)
+        except RSessionError:
+            return False
+        return True
+
+    def run(self, src: str, timeout: Optional[float] = None) -> str:
+        """Evaluate `src` in the session and return its printed output."""
+        if not self.alive:
+            raise RSessionUnavailable('R session is not running.')
+        assert self._proc is not None and self._proc.stdin is not None
+
+        src_lines = _source_lines(src)
+        payload = '\n'.join(
+            [str(len(src_lines)), os.getcwd()] + src_lines) + '\n'
+        try:
+            self._proc.stdin.write(payload)
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError) as err:
+            raise RSessionUnavailable('R session closed its input.') from err
+
+        output: List[str] = []
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout or self.timeout)
+            except queue.Empty as err:
+                raise RSessionUnavailable('R session timed out.') from err
+            if line is None:
+                raise RSessionUnavailable('R session exited unexpectedly.')
+            if line.startswith(self._token):
+                status = line[len(self._token):].strip()
+                break
+            output.append(line)
+
+        # drop the newline emitted in front of the sentinel
+        if output and output[-1] == '\n':
+            output.pop()
+        elif output:
+            output[-1] = output[-1].rstrip('\n')
+
+        if status != 'OK':
+            raise RSessionError(
+                'There seems to be a problem with the R script/command.')
+        return ''.join(output)
+
+    def close(self) -> None:
+        if self._proc is None:
+            return
+        if self._proc.stdin is not None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+
+
+class RSessionPool:
+    """Thread-safe, bounded pool of `RSession`s.
+
+    Sessions are spawned lazily up to `size`. A session that raises an
+    error is discarded and replaced by a fresh one on the next request,
+    so a failed command never leaks state into later ones.
+    """
+    def __init__(self, size: int, preload: Sequence[str] = ('bigrquery',),
+    rscript: str = RSCRIPT, timeout: float = 3600.0) -> None:
+        if size < 1:
+            raise ValueError('`size` of an R session pool must be at least 1.')
+        self.size = size
+        self.preload = list(preload)
+        self.rscript = rscript
+        self.timeout = timeout
+        self._idle: 'queue.Queue[RSession]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+        self._closed = False
+
+    def _acquire(self) -> RSession:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_spawn = self._spawned < self.size
+                if can_spawn:
+                    self._spawned += 1
+            if can_spawn:
+                break
+            # wait for a release, re-checking in case a session was discarded
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+        session = RSession(self.preload, self.rscript, self.timeout)
+        try:
+            session.start()
+        except RSessionUnavailable:
+            with self._lock:
+                self._spawned -= 1
+            raise
+        return session
+
+    def _release(self, session: RSession) -> None:
+        self._idle.put(session)
+
+    def _discard(self, session: RSession) -> None:
+        session.close()
+        with self._lock:
+            self._spawned -= 1
+
+    def run(self, src: str) -> str:
+        """Run `src` on an idle session and return its printed output.
+
+        Raises `RSessionUnavailable` only if no session could be started, i.e.
+        when it is safe for the caller to retry the command elsewhere. Any
+        failure once the command was sent is raised as `RSessionError`.
+        """
+        if self._closed:
+            raise RSessionUnavailable('R session pool is closed.')
+        session = self._acquire()
+        if not session.alive:
+            self._discard(session)
+            session = self._acquire()
+        try:
+            output = session.run(src)
+        except RSessionError as err:
+            logger.info('Restarting R session after an error.')
+            self._discard(session)
+            raise RSessionError(str(err)) from err
+        self._release(session)
+        return output
+
+    def health_check(self) -> int:
+        """Ping idle sessions, replacing unhealthy ones. Returns the number healthy."""
+        healthy = 0
+        checked: List[RSession] = []
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if session.is_healthy():
+                healthy += 1
+                checked.append(session)
+            else:
+                self._discard(session)
+        for session in checked:
+            self._release(session)
+        return healthy
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(session)
+
+
+_pool: Optional[RSessionPool] = None
+_pool_configured = False
+_pool_lock = threading.Lock()
+
+
+def configure_pool(size: int, **kwargs) -> Optional[RSessionPool]:
+    """Replace the process-wide pool. A `size` of 0 disables pooling."""
+    global _pool, _pool_configured
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = RSessionPool(size, **kwargs) if size > 0 else None
+        _pool_configured = True
+        return _pool
+
+
+def get_pool() -> Optional[RSessionPool]:
+    """Return the process-wide pool, configured from `FLUKE_R_WORKERS` on first use."""
+    global _pool, _pool_configured
+    with _pool_lock:
+        if not _pool_configured:
+            size = int(os.environ.get(POOL_SIZE_ENVVAR, '0') or 0)
+            if size > 0:
+                _pool = RSessionPool(size)
+            _pool_configured = True
+        return _pool
+
+
+def shutdown_pool() -> None:
+    configure_pool(0)
+
+
+atexit.register(shutdown_pool)
@@ -0,0 +1,190 @@
+"""
+Timing spans written as Chrome trace-event JSON.
+
+Tracing is off unless `start_trace` is called, e.g. with `fluke --trace
+FILE`. The file can be opened in `chrome://tracing` or https://ui.perfetto.dev.
+"""
+import atexit
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from fluke.logger import job_prefix
+
+_R_NAMESPACE = re.compile(r'\b([A-Za-z][A-Za-z0-9.]*)::')
+
+
+def _now_us() -> float:
+    return time.time() * 1e6
+
+
+class Tracer:
+    """Collects complete (`ph: X`) events, safe to use from several threads."""
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start_us: float, end_us: float, cat: str = 'fluke',
+    **args: Any) -> None:
+        tid = threading.get_native_id()
+        event = {
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+            'ts': start_us, 'dur': max(end_us - start_us, 0.0), 'args': args
+        }
+        with self._lock:
+            self._events.append(event)
+            # name threads after the job running on them, if any
+            prefix = job_prefix.get()
+            if prefix or tid not in self._threads:
+                self._threads[tid] = prefix or threading.current_thread().name
+
+    def write(self) -> None:
+        with self._lock:
+            meta = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                'args': {'name': name}}
+                for tid, name in self._threads.items()
+            ]
+            content = {'traceEvents': meta + self._events, 'displayTimeUnit': 'ms'}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(content), encoding='utf-8')
+
+
+_tracer: Optional[Tracer] = None
+
+
+def start_trace(path: Path) -> Tracer:
+    """Record spans from now on and write them to `path` at exit."""
+    global _tracer
+    stop_trace()
+    _tracer = Tracer(Path(path))
+    return _tracer
+
+
+def stop_trace() -> None:
+    """Write the recorded spans, if tracing, and stop tracing."""
+    global _tracer
+    if _tracer is not None:
+        _tracer.write()
+        _tracer = None
+
+
+atexit.register(stop_trace)
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+@contextmanager
+def span(name: str, cat: str = 'fluke', **args: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time the block as a span named `name`. Yields the span's args, which
+    the block may update. Does nothing when tracing is off.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    start = _now_us()
+    try:
+        yield args
+    finally:
+        tracer.add(name, start, _now_us(), cat, **args)
+
+
+def _r_packages(src: str) -> List[str]:
+    """Packages referenced as `pkg::` in R source, in order of appearance."""
+    return list(dict.fromkeys(
+        pkg for pkg in _R_NAMESPACE.findall(src) if pkg not in ('base', 'utils')))
+
+
+def _instrumented_src(src: str, marks_path: str) -> str:
+    """
+    Wrap R source so that it records when R started, when the packages it
+    uses were loaded and when the script finished into `marks_path`.
+    """
+    packages = ', '.join(f'"{pkg}"' for pkg in _r_packages(src))
+    return f"""
+    .fluke_marks <- as.numeric(Sys.time())
+    invisible(lapply(c({packages}), requireNamespace, quietly = TRUE))
+    .fluke_marks <- c(.fluke_marks, as.numeric(Sys.time()))
+    writeLines(format(.fluke_marks, digits = 17), "{marks_path}")
+    {src}
+    writeLines(format(c(.fluke_marks, as.numeric(Sys.time())), digits = 17), "{marks_path}")
+    """
+
+
+def _peak_rss_kb(rusage: Any) -> int:
+    # `ru_maxrss` is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return int(rusage.ru_maxrss // 1024)
+    return int(rusage.ru_maxrss)
+
+
+def _exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_traced(args: Sequence[str], capture_output: bool) -> Tuple[int, bytes, bytes]:
+    """
+    `subprocess.run` for a traced Rscript call. `args` must end with the
+    `-e` source. Records spans for process spawn, package load, script
+    execution and exit, with the child's peak RSS. Returns the exit code,
+    stdout and stderr.
+    """
+    tracer = _tracer
+    assert tracer is not None
+    packages = _r_packages(args[-1])
+    fd, marks_path = tempfile.mkstemp(prefix='fluke-trace-', suffix='.txt')
+    os.close(fd)
+    args = list(args[:-1]) + [_instrumented_src(args[-1], marks_path)]
+    pipe = subprocess.PIPE if capture_output else None
+
+    start = _now_us()
+    proc = subprocess.Popen(args, stdout=pipe, stderr=pipe)
+    outputs: Dict[str, bytes] = {}
+    readers = []
+    for key, stream in (('stdout', proc.stdout), ('stderr', proc.stderr)):
+        if stream is not None:
+            reader = threading.Thread(
+                target=lambda _key=key, _stream=stream: outputs.update(
+                    {_key: _stream.read()}),
+                daemon=True)
+            reader.start()
+            readers.append(reader)
+    # wait with `wait4` to get the resource usage of this child only
+    _, status, rusage = os.wait4(proc.pid, 0)
+    end = _now_us()
+    proc.returncode = _exit_code(status)
+    for reader in readers:
+        reader.join()
+
+    try:
+        marks = [float(mark) * 1e6 for mark in Path(marks_path).read_text().split()]
+    except (OSError, ValueError):
+        marks = []
+    finally:
+        os.unlink(marks_path)
+
+    points = [start] + marks[:3] + [end]
+    stages = ['R spawn', 'R package load', 'R script', 'R exit']
+    if len(marks) < 3:
+        # the script failed or quit before finishing
+        stages = stages[:len(marks)] + ['R script']
+    for stage, (stage_start, stage_end) in zip(stages, zip(points, points[1:])):
+        tracer.add(stage, stage_start, stage_end, cat='r')
+    tracer.add('run_r', start, end, cat='r', peak_rss_kb=_peak_rss_kb(rusage),
+        exit_code=proc.returncode, packages=packages)
+    return proc.returncode, outputs.get('stdout', b''), outputs.get('stderr', b'')
@@ -1,17 +1,14 @@
 from datetime import datetime
-from distutils.dir_util import copy_tree
 import json
 from pathlib import Path
 import tempfile
-from typing import Any, List, Dict, Optional, OrderedDict
+from typing import Any, List, Dict, Optional, OrderedDict, Sequence
 from copy import copy
 import os
 import re
 import shutil
-import yaml
 import subprocess
 import click
-from cookiecutter.main  import cookiecutter
 from contextlib import contextmanager
 
 @contextmanager
@@ -38,30 +35,61 @@ def get_cookiecutter_cfg(dir: Path) -> Path:
     return Path(dir, 'cookiecutter.json')
 
 
+PROJECT_ROOT_ENVVAR = 'FLUKE_PROJECT_ROOT'
+
+# project roots found so far, keyed by the working directory they were
+# searched from. Keying on cwd means `os.chdir` (e.g. in `cwd`) never
+# returns a root found from another directory.
+_root_proj_cache: Dict[str, Path] = {}
+
+
+def _rproj_file(path: Path) -> Path:
+    return Path(path, f'{path.name}.Rproj')
+
+
 def find_root_proj() -> Path:
     """
-    Find the root project path starting from current directory
+    Find the root project path starting from current directory.
+
+    `FLUKE_PROJECT_ROOT`, if set, is used as the root without searching.
+    Otherwise the result is cached per working directory.
     """
-    curr_path = Path.cwd()
-    immediate = curr_path.parent
-    rproj_file = f'{str(curr_path.relative_to(immediate))}.Rproj'
+    env_root = os.environ.get(PROJECT_ROOT_ENVVAR)
+    if env_root:
+        root = Path(env_root).expanduser().resolve()
+        if not root.is_dir():
+            raise click.UsageError(
+                f'`{PROJECT_ROOT_ENVVAR}` is set to `{env_root}`, which is not a directory.'
+            )
+        return root
+
+    curr_dir = os.getcwd()
+    cached = _root_proj_cache.get(curr_dir)
+    # a single stat guards against the project being moved or deleted
+    if cached is not None and _rproj_file(cached).is_file():
+        return cached
 
-    while rproj_file not in os.listdir(curr_path):
-        prev_path = copy(curr_path)
+    curr_path = Path(curr_dir)
+    while not _rproj_file(curr_path).is_file():
+        prev_path = curr_path
         curr_path = prev_path.parent
         if curr_path == prev_path:
             raise click.UsageError((
                 'Cannot find a .Rproj file in the immediate directory. '
                 'you must be inside a fluke project dir.')
             )
-        immediate = curr_path.parent
-        rproj_file = f'{str(curr_path.relative_to(immediate))}.Rproj'
 
+    root = curr_path.resolve()
+    _root_proj_cache[curr_dir] = root
+    return root
 
-    return curr_path.resolve()
+
+def clear_root_proj_cache() -> None:
+    _root_proj_cache.clear()
 
 
 def get_project_config() -> Dict[str, str]:
+    import yaml
     path_to_config = Path(find_root_proj(), 'config', 'project.yaml')
     with path_to_config.open() as _file:
         conf: Dict[str, str] = yaml.safe_load(_file)
@@ -76,14 +104,51 @@ def _is_rscript(file: Path) -> bool:
 
 
 def run_r(src: str, flags: List[str] = [],
-post_flags: List[str] = [], quiet: bool = False) -> str:
+post_flags: List[str] = [], quiet: bool = False,
+pooled: bool = False) -> str:
     """runs an Rscript command
     Args:
     src: Script path or command (commands need to be double quoted)
+    pooled: Send `-e` commands to a long-lived R session from
+        `fluke.rpool` when a pool is configured. Falls back to a one-shot
+        Rscript process if no pool is configured or it cannot start.
     """
-    args = ['/usr/bin/Rscript'] + flags + [src] + post_flags
+    from fluke.trace import get_tracer, run_traced, span
+    if pooled and flags == ['-e'] and not post_flags:
+        from fluke.rpool import RSessionError, RSessionUnavailable, get_pool
+        pool = get_pool()
+        if pool is not None:
+            try:
+                with span('R script', cat='r', pooled=True):
+                    output = pool.run(src)
+            except RSessionUnavailable:
+                pool = None
+            except RSessionError as err:
+                raise Exception(
+                    ('There seems to be a problem '
+                    'with the R script/command.'
+                    )
+                ) from err
+        if pool is not None:
+            if quiet:
+                return output
+            click.echo(output)
+            return ''
+
+    from fluke.rpool import RSCRIPT
+    args = [RSCRIPT] + flags + [src] + post_flags
+    if get_tracer() is not None and flags == ['-e'] and not post_flags:
+        returncode, stdout, _ = run_traced(args, capture_output=quiet)
+        if returncode != 0:
+            raise Exception(
+                ('There seems to be a problem '
+                'with the R script/command.'
+                )
+            )
+        return stdout.decode('utf-8') if quiet else ''
     try:
-        results = subprocess.run(args, check=True, capture_output=quiet)
+        with span('run_r', cat='r'):
+            results = subprocess.run(args, check=True, capture_output=quiet)
         if quiet:
             return results.stdout.decode('utf-8')
         else:
@@ -97,6 +162,27 @@ post_flags: List[str] = [], quiet: bool = False) -> str:
 
 
 
+def format_table(rows: Sequence[Sequence[str]]) -> str:
+    """Render rows (the first being the header) as a plain-text table."""
+    if not rows:
+        return ''
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append('  '.join(cells + [row[-1]]).rstrip())
+    return '\n'.join(lines)
+
+
+def format_bytes(num_bytes: float) -> str:
+    """Human-readable size, e.g. `1.5 GB`."""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(num_bytes) < 1024 or unit == 'TB':
+            break
+        num_bytes /= 1024
+    return f'{num_bytes:.0f} {unit}' if unit == 'B' else f'{num_bytes:.1f} {unit}'
+
+
 def sym_wrap(string: str, sym: str = '\'') -> str:
     """wraps a string with symbols."""
     return f'{sym}{string}{sym}'
@@ -149,6 +235,10 @@ def _create_dir_using_cookiecutter(
     directory to transform it using cookiecutter from
     `cookiecutter.json` config.
     """
+    # imported here since loading cookiecutter is slow
+    from distutils.dir_util import copy_tree
+    from cookiecutter.main import cookiecutter
+
     temp_dir = Path(tempfile.mkdtemp(prefix='sherpa'))
     copy_tree(
         str(template_dir),
@@ -242,6 +332,15 @@ class Cadence:
         }
         return frmt[self.kw]
 
+    def period(self, when: datetime) -> str:
+        """Key of the day, ISO week or month `when` falls in."""
+        frmt = {
+            'day': '%Y%m%d',
+            'week': '%G-W%V',
+            'month': '%Y%m'
+        }
+        return when.strftime(frmt[self.kw])
+
 
 def dict_insert(_dict: Dict, index: int, obj: Any) -> Dict:
     _tmp = list(copy(_dict).items())
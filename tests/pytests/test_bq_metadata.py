@@ -0,0 +1,66 @@
+import time
+from pathlib import Path
+import pytest
+from fluke.config.datasets import Datasets
+from fluke.datasets.manifest import JsonManifest
+from fluke.datasets.query_dataset import BigQueryMetadata
+from fluke.datasets.query_dataset.metadata import (
+    _OUTPUT_MARKER,
+    _metadata_cmd,
+    _parse_output
+)
+from fluke.utils import cwd
+from .utils import add_datasets_yaml_payload
+from tests.pytests.fixtures.datasets import PROJECT_ID, DATASET
+
+R_OUTPUT = f"""Waiting for job...
+{_OUTPUT_MARKER}
+"project_id","dataset","table","last_modified","num_rows","num_bytes"
+"{PROJECT_ID}","{DATASET}","austin_stations_temp","1640649600000","100","2048"
+"""
+
+
+def test_parse_metadata_output():
+    meta, = _parse_output(R_OUTPUT)
+    assert meta.table == 'austin_stations_temp'
+    assert meta.last_modified == 1640649600
+    assert (meta.num_rows, meta.num_bytes) == (100, 2048)
+
+
+def test_metadata_cmd_runs_no_query():
+    cmd = _metadata_cmd([(PROJECT_ID, DATASET)])
+    assert 'bigrquery::bq_dataset_tables' in cmd and 'bigrquery::bq_table_meta' in cmd
+    assert 'bq_project_query' not in cmd and '__TABLES__' not in cmd
+
+
+def test_metadata_batched_and_cached(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+    calls = []
+
+    def _run_r(src, *args, **kwargs):
+        calls.append(src)
+        return R_OUTPUT
+    monkeypatch.setattr('fluke.datasets.query_dataset.metadata.run_r', _run_r)
+
+    cache_path = Path(tmp_path, 'bq_metadata.json')
+    with cwd(project_directory):
+        datasets = Datasets()
+        metadata = BigQueryMetadata(cache_path=cache_path)
+        metadata.fetch_for(datasets)
+
+        # both datasets share a BigQuery dataset, listed in one call
+        assert len(calls) == 1
+        assert metadata.exists(datasets['stations'])
+        assert not metadata.exists(datasets['address'])
+
+        # fresh cache entries are reused by other instances
+        BigQueryMetadata(cache_path=cache_path).fetch_for(datasets)
+        assert len(calls) == 1
+
+        # expired entries are fetched again
+        entry = JsonManifest(cache_path).get(f'{PROJECT_ID}.{DATASET}')
+        entry['fetched_at'] = time.time() - 3600
+        JsonManifest(cache_path).set(f'{PROJECT_ID}.{DATASET}', entry)
+        BigQueryMetadata(cache_path=cache_path).fetch_for(datasets)
+        assert len(calls) == 2
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import List
+import pytest
+import fluke
+
+HEAVY_MODULES = ['cookiecutter', 'jinja2', 'distutils', 'yaml']
+
+
+def _loaded_modules(code: str, modules: List[str]) -> List[str]:
+    check = f"""
+import sys
+{code}
+print('LOADED:' + ','.join(m for m in {modules!r} if m in sys.modules))
+"""
+    # run in a fresh interpreter, able to import fluke from any cwd
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [str(Path(fluke.__file__).parents[1]), env.get('PYTHONPATH')]))
+    result = subprocess.run(
+        [sys.executable, '-c', check], check=True, capture_output=True,
+        text=True, env=env)
+    loaded = result.stdout.rsplit('LOADED:', 1)[-1].strip()
+    return [m for m in loaded.split(',') if m]
+
+
+@pytest.mark.parametrize('args', [['--help'], ['dataset', '--help']])
+def test_cli_help_is_lazy(args: List[str]):
+    code = f"""
+from fluke.cli.cli import cli
+try:
+    cli({args!r})
+except SystemExit:
+    pass
+"""
+    modules = HEAVY_MODULES + ['fluke.cli.project_create', 'fluke.cli.pipeline']
+    assert _loaded_modules(code, modules) == []
+
+
+def test_datasets_module_is_lazy():
+    assert _loaded_modules('import fluke.config.datasets', HEAVY_MODULES) == []
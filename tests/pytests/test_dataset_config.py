@@ -1,7 +1,13 @@
+import os
 import pytest
+import yaml
 from pathlib import Path
+from fluke.config.cache import load_yaml_cached
 from fluke.config.datasets import Datasets
 from fluke.datasets.query_dataset import BigQueryDataset
+from fluke.datasets.query_dataset import TableMetadata
+from fluke.datasets.query_dataset.bigquery import row_ranges
+from fluke.ledger import RunLedger
 from fluke.utils import cwd
 from .utils import add_datasets_yaml_payload
 from tests.pytests.fixtures.datasets import PROJECT_ID, DATASET
@@ -87,16 +93,340 @@ def test_bq_migrate(project_directory: Path):
             query_dataset.params.version).exists()
 
 
+def test_query_fingerprint_changes(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
 
+    with cwd(project_directory):
+        query_dataset = Datasets()['stations']
+        assert isinstance(query_dataset, BigQueryDataset)
+        assert query_dataset.query_changed()
 
+        query_dataset._record_query()
+        assert not Datasets()['stations'].query_changed()
+        # other datasets are not affected
+        assert Datasets()['address'].query_changed()
 
+        add_datasets_yaml_payload(
+            dataset_config_path, yaml_payload.replace('version: temp', 'version: temp2'))
+        assert Datasets()['stations'].query_changed()
 
 
+def test_query_migrate_page_size(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str):
+    payload = yaml.safe_load(yaml_payload)
+    payload['datasets']['stations']['params']['migrate_page_size'] = 1000
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
 
+    with cwd(project_directory):
+        datasets = Datasets()
 
+    assert datasets['stations'].params.read_fun == 'fluke::read_chunks'
+    assert datasets['stations'].params.read_fun_args == {'fun': 'readRDS'}
+    assert datasets['address'].params.read_fun == 'readRDS'
+
+    payload['datasets']['stations']['params']['migrate_page_size'] = 0
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+    with cwd(project_directory), pytest.raises(Exception, match='migrate_page_size'):
+        Datasets()['stations']
+
+
+def test_query_incremental_migrate(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    payload = yaml.safe_load(yaml_payload)
+    payload['datasets']['stations']['params']['incremental'] = {'column': 'modified_date'}
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+    cmds = []
+
+    def _run_r(src, *args, **kwargs):
+        # stages one chunk the way the R command does
+        cmds.append(src)
+        file_path = stations.params.file_path
+        if 'watermark <- NULL' in src:
+            stage, chunk = Path(f'{file_path}.partial'), 'chunk-000001.rds'
+        else:
+            stage, chunk = file_path, f'.chunk-{len(list(file_path.iterdir())) + 1:06d}.rds'
+        stage.mkdir(parents=True, exist_ok=True)
+        Path(stage, chunk).touch()
+        return 'Waiting...\n<<fluke-incremental>>\t10\t2021-12-28 10:00:00\n'
+    monkeypatch.setattr('fluke.datasets.query_dataset.bigquery.run_r', _run_r)
 
+    with cwd(project_directory):
+        stations = Datasets()['stations']
+        p = stations.params
+        assert p.read_fun == 'fluke::read_chunks' and p.file_path.suffix == ''
+
+        meta = TableMetadata(PROJECT_ID, DATASET, p.ver_tbl, 1640649600, 10, 2048)
+        stations.migrate(table_meta=meta)
+        assert 'watermark <- NULL' in cmds[-1]
+        assert sorted(f.name for f in p.file_path.iterdir()) == ['chunk-000001.rds']
+        stations.migrate(table_meta=meta)
+        assert 'watermark <- "2021-12-28 10:00:00"' in cmds[-1]
+        assert stations._incremental_state.get('stations')['rows'] == 20
+        assert sorted(f.name for f in p.file_path.iterdir()) == [
+            'chunk-000001.rds', 'chunk-000002.rds']
+
+        # chunks staged by a migration stopped after saving its watermark are
+        # published, chunks staged without a saved watermark are dropped
+        state = stations._incremental_state
+        state.set('stations', dict(state.get('stations'), staged='delta'))
+        Path(p.file_path, '.chunk-000003.rds').touch()
+        stations.migrate(table_meta=meta)
+        assert state.get('stations')['rows'] == 30
+        Path(p.file_path, '.chunk-000009.rds').touch()
+        stations.migrate(table_meta=meta)
+        assert sorted(f.name for f in p.file_path.iterdir()) == [
+            f'chunk-00000{i}.rds' for i in range(1, 6)]
+        assert 'staged' not in state.get('stations')
+
+        # a full refresh keeps the existing chunks until it completed
+        def _fail(src, *args, **kwargs):
+            cmds.append(src)
+            Path(f'{p.file_path}.partial').mkdir()
+            raise Exception('download failed')
+        monkeypatch.setattr('fluke.datasets.query_dataset.bigquery.run_r', _fail)
+        with pytest.raises(Exception, match='download failed'):
+            stations.migrate(full_refresh=True, table_meta=meta)
+        assert 'watermark <- NULL' in cmds[-1]
+        assert len(list(p.file_path.iterdir())) == 5
+        monkeypatch.setattr('fluke.datasets.query_dataset.bigquery.run_r', _run_r)
+        stations.migrate(full_refresh=True, table_meta=meta)
+        assert sorted(f.name for f in p.file_path.iterdir()) == ['chunk-000001.rds']
+        assert not Path(f'{p.file_path}.partial').exists()
+
+    payload['datasets']['stations']['params']['incremental'] = {'col': 'modified_date'}
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+    with cwd(project_directory), pytest.raises(Exception, match='incremental'):
+        Datasets()['stations']
+
+
+def test_row_ranges():
+    assert row_ranges(10, 3) == [(0, 4), (4, 3), (7, 3)]
+    assert row_ranges(2, 4) == [(0, 1), (1, 1)]
+    assert row_ranges(0, 4) == []
+
+
+def test_query_parallel_migrate(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+    cmds = []
+
+    def _run_r(src, *args, **kwargs):
+        cmds.append(src)
+        if 'fluke::read_chunks' in src:
+            address._partial_file.write_bytes(b'downloaded')
+        return ''
+    monkeypatch.setattr('fluke.datasets.query_dataset.bigquery.run_r', _run_r)
 
+    with cwd(project_directory):
+        address = Datasets()['address']
+        meta = TableMetadata(PROJECT_ID, DATASET, address.params.ver_tbl, 1640649600, 10, 2048)
+        address.migrate(download_workers=3, table_meta=meta)
 
+    downloads = sorted(cmd for cmd in cmds if 'start_index' in cmd)
+    assert len(downloads) == 3
+    assert 'c(1, 0, 4)' in ''.join(downloads) and 'c(3, 7, 3)' in ''.join(downloads)
+    # the ranges are bound in row order into the dataset file
+    assert 'fluke::read_chunks' in cmds[-1] and str(address.params.file_path) in cmds[-1]
+    assert not Path(f'{address.params.file_path}.partial').exists()
 
 
+def test_query_migration_current(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+
+    def _run_r(src, *args, **kwargs):
+        address._partial_file.write_bytes(b'downloaded')
+        return ''
+    monkeypatch.setattr('fluke.datasets.query_dataset.bigquery.run_r', _run_r)
+
+    with cwd(project_directory):
+        address = Datasets()['address']
+        p = address.params
+        meta = TableMetadata(PROJECT_ID, DATASET, p.ver_tbl, 1640649600, 10, 2048)
+        address._migration_manifest_path.unlink(missing_ok=True)
+        assert not address.migration_current(meta)
+
+        p.location.mkdir(parents=True, exist_ok=True)
+        address.migrate(table_meta=meta)
+        assert address.migration_current(meta)
+        assert not address.migration_current(
+            TableMetadata(PROJECT_ID, DATASET, p.ver_tbl, 1640736000, 12, 2048))
+
+        # same size and content but touched: verified by checksum
+        p.file_path.write_bytes(b'downloaded')
+        assert address.migration_current(meta)
+        p.file_path.write_bytes(b'corrupted!')
+        assert not address.migration_current(meta)
+
+        # a version hard linked to the file is left as it was
+        linked = p.file_path.with_name('linked.rds')
+        linked.unlink(missing_ok=True)
+        os.link(p.file_path, linked)
+        address.migrate(table_meta=meta)
+        assert linked.read_bytes() == b'corrupted!'
+        assert p.file_path.read_bytes() == b'downloaded'
+        assert not address._partial_file.exists()
+        linked.unlink()
+
+
+def test_query_migrate_without_metadata(project_directory: Path,
+dataset_config_path: Path, yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+
+    def _run_r(src, *args, **kwargs):
+        address._partial_file.write_bytes(b'downloaded')
+        return 'Waiting...\n<<fluke-rows>>\t7\n'
+
+    def _fetch_table_meta():
+        raise Exception('table metadata fetched')
+    monkeypatch.setattr('fluke.datasets.query_dataset.bigquery.run_r', _run_r)
+
+    with cwd(project_directory):
+        address = Datasets()['address']
+        monkeypatch.setattr(address, '_fetch_table_meta', _fetch_table_meta)
+        address.params.location.mkdir(parents=True, exist_ok=True)
+        address.migrate()
+        run = RunLedger().runs(kind='migrate', name='address')[-1]
+        meta = TableMetadata(
+            PROJECT_ID, DATASET, address.params.ver_tbl, 1640649600, 7, 2048)
+        # the remote table is unknown, so the next migration is not skipped
+        assert not address.migration_current(meta)
+
+    assert (run.status, run.rows, run.bytes) == ('ok', 7, len(b'downloaded'))
+
+
+@pytest.mark.parametrize(
+    'fmt, read_fun, suffix',
+    [('rds', 'readRDS', ''),
+    ('parquet', 'arrow::read_parquet', '.parquet'),
+    ('feather', 'arrow::read_feather', '.feather'),
+    ('qs', 'qs::qread', '.qs'),
+    ('fst', 'fst::read_fst', '.fst')]
+)
+def test_query_storage_format(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, fmt: str, read_fun: str, suffix: str):
+    payload = yaml.safe_load(yaml_payload)
+    payload['datasets']['address']['params']['format'] = fmt
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+
+    with cwd(project_directory):
+        query_dataset = Datasets()['address']
+
+    p = query_dataset.params
+    assert p.read_fun == read_fun
+    assert p.file_path.name == f'{p.version}{suffix}'
+    assert f'{read_fun}("{p.file_path}"' in query_dataset.tar_cmd()
 
+
+def test_query_storage_format_invalid(project_directory: Path,
+dataset_config_path: Path, yaml_payload: str):
+    payload = yaml.safe_load(yaml_payload)
+    payload['datasets']['address']['params']['format'] = 'xlsx'
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+
+    with cwd(project_directory), pytest.raises(Exception, match='not supported'):
+        Datasets()['address']
+
+
+def test_dataset_registry_lookups(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+
+    with cwd(project_directory):
+        datasets = Datasets()
+        # datasets are only built on first access
+        assert datasets._objects == {}
+        assert datasets.query_dataset_exists()
+        assert 'stations' in datasets and len(datasets) == 2
+
+        stations = datasets['stations']
+        assert datasets['stations'] is stations
+        assert list(datasets._objects) == ['stations']
+
+        address = datasets['address']
+        assert datasets.get_dataset_by_loc(address.params.file_path) is address
+        assert datasets.get_dataset_by_loc(str(stations.params.file_path)) is stations
+
+        with pytest.raises(KeyError, match='does not exist'):
+            datasets['missing']
+        with pytest.raises(Exception, match='No dataset found'):
+            datasets.get_dataset_by_loc('datasets/missing')
+
+
+def test_datasets_yaml_cache(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+
+    with cwd(project_directory):
+        assert len(Datasets()) == 2
+        assert Path('datasets', '.fluke', 'datasets.yaml.cache').exists()
+
+        # warm loads do not parse the YAML again
+        def _fail_parse(stream):
+            raise AssertionError('datasets.yaml was parsed again')
+        monkeypatch.setattr('fluke.config.cache.yaml_safe_load', _fail_parse)
+        assert len(Datasets()) == 2
+
+        monkeypatch.undo()
+        payload = yaml.safe_load(yaml_payload)
+        del payload['datasets']['address']
+        add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+        assert len(Datasets()) == 1
+
+
+def test_yaml_cache_racy_mtime(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    path, cache_path = Path(tmp_path, 'config.yaml'), Path(tmp_path, 'config.cache')
+    path.write_text('a: 1\n')
+    stat = path.stat()
+    assert load_yaml_cached(path, cache_path) == {'a': 1}
+
+    # written again with the same size in the same mtime tick as the cache
+    path.write_text('a: 2\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_yaml_cached(path, cache_path) == {'a': 2}
+
+    # mtimes well before the cache was written are trusted without hashing
+    old = stat.st_mtime_ns - 3600 * 10**9
+    os.utime(path, ns=(old, old))
+    assert load_yaml_cached(path, cache_path) == {'a': 2}
+    monkeypatch.setattr('fluke.config.cache.hashlib.sha256', None)
+    assert load_yaml_cached(path, cache_path) == {'a': 2}
+
+
+def test_dataset_targets_skip_unchanged(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+    cmds = []
+
+    def _run_r(src, *args, **kwargs):
+        cmds.append(src)
+        Path('datasets', '_tar_datasets_store').mkdir(exist_ok=True)
+        return ''
+    monkeypatch.setattr('fluke.config.datasets.run_r', _run_r)
+
+    with cwd(project_directory):
+        script = Path('datasets', 'tar_script_datasets.R')
+        Path('datasets', '.fluke', 'targets.json').unlink(missing_ok=True)
+        assert Datasets().run_targets_cmd()
+        assert 'tar_make()' in cmds[-1]
+        assert 'stations' in script.read_text() and 'address' in script.read_text()
+        mtime = script.stat().st_mtime_ns
+
+        assert not Datasets().run_targets_cmd()
+        assert len(cmds) == 1 and script.stat().st_mtime_ns == mtime
+        assert Datasets().run_targets_cmd(force=True)
+        assert len(cmds) == 2
+
+        # a dataset file changing triggers a make, the script is left alone
+        address = Datasets()['address']
+        address.params.location.mkdir(parents=True, exist_ok=True)
+        address.params.file_path.write_bytes(b'migrated')
+        assert Datasets().run_targets_cmd()
+        assert len(cmds) == 3 and script.stat().st_mtime_ns == mtime
+
+        payload = yaml.safe_load(yaml_payload)
+        del payload['datasets']['address']
+        add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+        assert Datasets().run_targets_cmd()
+        assert 'address' not in script.read_text()
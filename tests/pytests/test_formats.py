@@ -0,0 +1,67 @@
+from pathlib import Path
+import pytest
+import yaml
+from fluke.config.datasets import Datasets
+from fluke.datasets.benchmark import _OUTPUT_MARKER, benchmark_formats
+from fluke.datasets.formats import get_storage_format
+from fluke.utils import cwd
+from .utils import add_datasets_yaml_payload
+
+
+def test_storage_format_options():
+    qs = get_storage_format('qs')
+    assert qs.write_cmd('df', 'path') == (
+        'qs::qsave(df, path, preset = "custom", algorithm = "zstd", compress_level = 4)')
+    assert qs.write_cmd('df', 'path', level=9, threads=4).endswith(
+        'compress_level = 9, nthreads = 4)')
+    assert qs.read_cmd('path', threads=4) == 'qs::qread(path, nthreads = 4)'
+
+    fst = get_storage_format('fst')
+    assert fst.write_cmd('df', 'path', threads=2) == (
+        'invisible(fst::threads_fst(2)); fst::write_fst(df, path, compress = 50)')
+
+    with pytest.raises(Exception, match='compression level'):
+        get_storage_format('rds').check_options(level=3)
+    with pytest.raises(Exception, match='between 0 and 100'):
+        fst.check_options(level=101)
+
+
+def test_query_format_options(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str):
+    payload = yaml.safe_load(yaml_payload)
+    params = payload['datasets']['address']['params']
+    params.update({'format': 'qs', 'compression_level': 9, 'threads': 4})
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+
+    with cwd(project_directory):
+        p = Datasets()['address'].params
+    assert p.read_fun == 'qs::qread' and p.read_fun_args == {'nthreads': 4}
+    assert 'compress_level = 9, nthreads = 4' in p.write_cmd('df', 'path')
+
+    params.update({'format': 'feather'})
+    add_datasets_yaml_payload(dataset_config_path, yaml.safe_dump(payload))
+    with cwd(project_directory), pytest.raises(Exception, match='does not support'):
+        Datasets()['address']
+
+
+def test_benchmark_formats(project_directory: Path, dataset_config_path: Path,
+yaml_payload: str, monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+    cmds = []
+
+    def _run_r(src, *args, **kwargs):
+        cmds.append(src)
+        return '\n'.join([
+            'Downloading...',
+            f'{_OUTPUT_MARKER}\tqs:9\t1000\t0.012\t0.004\t20480',
+            f'{_OUTPUT_MARKER}\tfst',
+        ])
+    monkeypatch.setattr('fluke.datasets.benchmark.run_r', _run_r)
+
+    with cwd(project_directory):
+        address = Datasets()['address']
+        qs, fst = benchmark_formats(address, ['qs:9', 'fst'], rows=1000)
+
+    assert 'compress_level = 9' in cmds[0] and 'n_max = 1000' in cmds[0]
+    assert (qs.rows, qs.num_bytes, qs.read_seconds) == (1000, 20480, 0.004)
+    assert not fst.available
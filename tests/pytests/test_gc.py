@@ -0,0 +1,129 @@
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+import pytest
+import yaml
+from click.testing import CliRunner
+from fluke.cli.gc import gc
+from fluke.datasets.query_dataset.metadata import _OUTPUT_MARKER
+from fluke.gc import GcItem, RetentionPolicy, collect, dedup, delete_items
+from fluke.ledger import RunRecord, record_run
+from fluke.utils import Cadence
+from .utils import add_datasets_yaml_payload
+from tests.pytests.fixtures.datasets import PROJECT_ID, DATASET
+
+DAY = 86400
+
+
+def _item(version: str, days_ago: float) -> GcItem:
+    return GcItem('local', 'ds', version, time.time() - days_ago * DAY, 1)
+
+
+def test_retention_keep_last():
+    items = [_item(f'v{i}', i) for i in range(5)]
+    RetentionPolicy(keep_last=2).apply(items, {'v4'})
+    assert [i.keep_reason for i in items] == ['last 2', 'last 2', None, None, 'current']
+    # the current version does not take one of the `keep_last` places
+    items = [_item(f'v{i}', i) for i in range(5)]
+    RetentionPolicy(keep_last=2).apply(items, {'v0'})
+    assert [i.keep_reason for i in items] == ['current', 'last 2', 'last 2', None, None]
+
+
+def test_retention_cadence():
+    now = datetime.now().timestamp()
+    items = [GcItem('local', 'ds', f'v{i}', now - i * 40 * DAY, 1) for i in range(4)]
+    items.append(GcItem('local', 'ds', 'v0b', now - 1, 1))
+    RetentionPolicy(keep_last=0, cadence=Cadence('month'), keep_periods=2).apply(items, set())
+    kept = {i.version for i in items if i.keep}
+    # the newest version of each of the two latest months
+    assert kept == {'v0', 'v1'}
+
+
+def _write(path: Path, content: bytes, days_ago: float) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # do not write through hard links made by an earlier dedup
+    path.unlink(missing_ok=True)
+    path.write_bytes(content)
+    stamp = time.time() - days_ago * DAY
+    os.utime(path, (stamp, stamp))
+
+
+@pytest.fixture
+def gc_project(project_directory: Path, dataset_config_path: Path, yaml_payload: str,
+monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+    Path(project_directory, 'config', 'pipelines.yaml').write_text(
+        yaml.safe_dump({'pipelines': {'version': 'v3'}}))
+    location = Path(project_directory, 'datasets', f'{PROJECT_ID}.{DATASET}.address')
+    location.mkdir(parents=True, exist_ok=True)
+    for days_ago, version in enumerate(['20211228', '20211201', '20211101', '20211001']):
+        _write(Path(location, version), b'same content', days_ago)
+        _write(Path(location, f'{version}.fluke.json'), b'{}', days_ago)
+    stores = Path(project_directory, 'pipelines', 'store')
+    for days_ago, version in enumerate(['v3', 'v2', 'v1']):
+        _write(Path(stores, version, 'objects', 'data1'), b'object', days_ago)
+        _write(Path(stores, version, 'meta', 'meta'), b'name|type\n', days_ago)
+
+    # tables created by fluke are recorded in the ledger, `address_summary` was not
+    for name, version in [('address', '20211201'), ('address', '20211101'),
+    ('stations', 'old')]:
+        record_run(RunRecord('query', name, 'ok', 1.0, version=version))
+    tables = ['address_20211228', 'address_20211201', 'address_20211101',
+        'address_summary', 'austin_stations_temp', 'austin_stations_old']
+    rows = '\n'.join(
+        f'"{PROJECT_ID}","{DATASET}","{t}","{int((time.time() - i * DAY) * 1000)}","1","1024"'
+        for i, t in enumerate(tables))
+    output = (f'{_OUTPUT_MARKER}\n'
+        f'"project_id","dataset","table","last_modified","num_rows","num_bytes"\n{rows}\n')
+    monkeypatch.setattr('fluke.datasets.query_dataset.metadata.run_r',
+        lambda *args, **kwargs: output)
+    deleted = []
+    monkeypatch.setattr('fluke.gc.run_r', lambda src, *args, **kwargs: deleted.append(src))
+    yield location, stores, deleted
+
+
+def test_gc_collect_and_delete(gc_project):
+    location, stores, deleted = gc_project
+    items = collect(RetentionPolicy(keep_last=0))
+    actions = {(i.kind, i.version): i.keep_reason for i in items}
+    assert actions[('local', '20211228')] == 'current'
+    assert actions[('local', '20211201')] is None
+    assert actions[('bigquery', 'temp')] == 'current'
+    assert actions[('bigquery', 'old')] is None
+    assert actions[('store', 'v3')] == 'current' and actions[('store', 'v1')] is None
+    assert ('local', '20211228.fluke.json') not in actions
+    # tables only sharing the name prefix are not versions
+    assert ('bigquery', 'summary') not in actions
+
+    results = delete_items(items, jobs=2)
+    assert all(res.ok for res in results)
+    assert len(deleted) == 3 and any('"address_20211101"' in cmd for cmd in deleted)
+    assert not any('address_summary' in cmd for cmd in deleted)
+    assert sorted(p.name for p in location.iterdir()) == ['20211228', '20211228.fluke.json']
+    assert sorted(p.name for p in stores.iterdir()) == ['v3']
+
+
+def test_gc_dedup(gc_project):
+    location, stores, _ = gc_project
+    items = collect(RetentionPolicy(keep_last=2), bigquery=False)
+    assert dedup(items, dry_run=True).linked == 4
+    result = dedup(items)
+    # two local versions and two stores are linked to the first of each
+    assert result.linked == 4 and result.saved_bytes == 2 * 12 + 2 * 6
+    assert Path(location, '20211201').stat().st_ino == Path(location, '20211228').stat().st_ino
+    assert Path(stores, 'v1', 'objects', 'data1').stat().st_nlink == 3
+    assert dedup(items).linked == 0
+
+
+def test_gc_cli_dry_run(gc_project):
+    location, stores, deleted = gc_project
+    result = CliRunner().invoke(gc, ['--dry-run', '--keep-last', '0'])
+    assert result.exit_code == 0, result.output
+    assert 'keep (current)' in result.output and 'delete' in result.output
+    assert 'of BigQuery storage' in result.output
+    assert not deleted and len(list(stores.iterdir())) == 3
+
+    result = CliRunner().invoke(gc, ['--keep-last', '0', '--no-bigquery', '-y'])
+    assert result.exit_code == 0, result.output
+    assert not deleted and sorted(p.name for p in stores.iterdir()) == ['v3']
@@ -0,0 +1,42 @@
+import threading
+import time
+import pytest
+from fluke.jobs import format_summary, run_jobs
+
+
+def _fail():
+    raise RuntimeError('query failed')
+
+
+def test_run_jobs_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    jobs = {name: barrier.wait for name in ['a', 'b', 'c']}
+
+    results = run_jobs(jobs, max_workers=3)
+
+    assert [res.name for res in results] == ['a', 'b', 'c']
+    assert all(res.ok for res in results)
+
+
+def test_run_jobs_keep_going():
+    jobs = {'bad': _fail, 'good': lambda: None}
+
+    results = run_jobs(jobs, max_workers=1, keep_going=True)
+
+    assert [res.status for res in results] == ['failed', 'ok']
+    assert 'query failed' in format_summary(results)
+
+
+def test_run_jobs_fail_fast():
+    jobs = {'bad': _fail, 'slow': lambda: time.sleep(0.1), 'never': lambda: None}
+
+    results = run_jobs(jobs, max_workers=1, keep_going=False)
+
+    statuses = {res.name: res.status for res in results}
+    assert statuses['bad'] == 'failed'
+    assert statuses['never'] == 'cancelled'
+
+
+def test_run_jobs_invalid_workers():
+    with pytest.raises(ValueError):
+        run_jobs({}, max_workers=0)
@@ -0,0 +1,53 @@
+from pathlib import Path
+from click.testing import CliRunner
+import pytest
+from fluke.cli.stats import stats
+from fluke.ledger import (
+    LEDGER_FILE,
+    RunLedger,
+    RunRecord,
+    ledger_run,
+    percentile,
+    record_run
+)
+from fluke.datasets.manifest import fluke_state_dir
+from fluke.utils import cwd
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 90) == pytest.approx(3.7)
+    assert percentile([5], 99) == 5
+
+
+def test_ledger_run_records_status(project_directory: Path):
+    with cwd(project_directory):
+        with ledger_run('migrate', 'stations', 'temp') as measures:
+            measures.update(rows=10, bytes=2048)
+        with pytest.raises(ValueError), ledger_run('migrate', 'stations', 'temp'):
+            raise ValueError('download failed\ndetails')
+
+        runs = RunLedger().runs(kind='migrate', name='stations')
+        assert Path(fluke_state_dir(), LEDGER_FILE).exists()
+
+    ok, failed = runs[-2:]
+    assert (ok.status, ok.rows, ok.bytes, ok.version) == ('ok', 10, 2048, 'temp')
+    assert ok.host
+    assert (failed.status, failed.error) == ('failed', 'download failed')
+
+
+def test_stats_command(project_directory: Path):
+    with cwd(project_directory):
+        Path(fluke_state_dir(), LEDGER_FILE).unlink(missing_ok=True)
+        for seconds in [10, 11, 9, 10, 30]:
+            record_run(RunRecord('migrate', 'address', 'ok', seconds, bytes=1024))
+        for seconds in [1, 1, 1]:
+            record_run(RunRecord('query', 'stations', 'ok', seconds))
+        result = CliRunner().invoke(stats, ['--window', '3'])
+
+    assert result.exit_code == 0, result.output
+    regressions = result.output.split('Regressions')[1].split('Slowest datasets')[0]
+    assert 'address' in regressions and '3.00x' in regressions
+    assert 'stations' not in regressions
+    slowest = result.output.split('Slowest datasets')[1].strip().splitlines()
+    assert slowest[1].split()[:2] == ['migrate', 'address']
@@ -0,0 +1,86 @@
+import os
+import time
+from pathlib import Path
+from click.testing import CliRunner
+from fluke.cli.pipeline import pipeline
+from fluke.pipelines.meta import (
+    meta_lines,
+    parse_size,
+    parse_time,
+    read_meta,
+    read_targets
+)
+from .utils import write_targets_meta
+
+
+def _days(timestamp: float) -> str:
+    return f't{timestamp / 86400!r}s'
+
+
+def test_parse_fields():
+    assert parse_time('t19208.5s') == 19208.5 * 86400
+    assert parse_size('s55b') == 55
+    assert parse_time('') is None and parse_size('NA') is None
+
+
+def test_read_meta(tmp_path: Path):
+    built = time.time() - 60
+    data_file = Path(tmp_path, 'out.csv')
+    data_file.write_text('a,b\n')
+    os.utime(data_file, (built, built))
+    write_targets_meta(Path(tmp_path, 'store'), [
+        'get_pipelines|function|abc||||||||||||||||',
+        f'data1|stem|h1|c1|d1|1||{_days(built)}|s10b|10|rds|local|vector|||0.5||',
+        f'data1|stem|h2|c1|d1|1||{_days(built)}|s12b|12|rds|local|vector|||0.25||',
+        (f'out|stem|h3|c2|d2|2|{data_file}|{_days(built)}|s4b|4|file|local|vector|||'
+        '1.5||'),
+        'broken|stem||c3|d3|3|||||rds|local|vector|||0.1||object not found|in x',
+    ])
+
+    meta = read_meta(Path(tmp_path, 'store'))
+    assert list(meta) == ['get_pipelines', 'data1', 'out', 'broken']
+    # the last entry of a target wins
+    assert meta['data1'].data == 'h2' and meta['data1'].bytes == 12
+    assert meta['data1'].seconds == 0.25
+    assert meta['broken'].errored and meta['broken'].error == 'object not found|in x'
+    assert abs(meta['out'].time - built) < 1e-3
+
+    targets = read_targets(Path(tmp_path, 'store'))
+    assert [t.name for t in targets] == ['data1', 'out', 'broken']
+    assert meta['out'].stale_files() == []
+    data_file.write_text('a,b,c\n')
+    assert meta['out'].stale_files() == [str(data_file)]
+
+
+def test_read_meta_quoted_fields(tmp_path: Path):
+    # `fwrite` quotes fields holding the delimiter, quotes or line breaks
+    quoted = ('warned|stem|h1|c1|d1|1||||||||||0.5|"a|b ""c""\nd"|'
+        '"Error in f(x) | more"')
+    write_targets_meta(Path(tmp_path, 'store'), [
+        quoted, 'data1|stem|h2|c1|d1|1||||||||||0.25||'])
+
+    meta = read_meta(Path(tmp_path, 'store'))
+    assert list(meta) == ['warned', 'data1']
+    assert meta['warned'].warnings == 'a|b "c"\nd'
+    assert meta['warned'].error == 'Error in f(x) | more'
+    assert meta['warned'].seconds == 0.5
+    # raw records are kept whole, to be copied between stores
+    _, lines = meta_lines(Path(tmp_path, 'store'))
+    assert lines['warned'] == quoted
+
+
+def test_pipeline_status(project_directory: Path):
+    built = time.time()
+    store = Path(project_directory, '_targets')
+    write_targets_meta(store, [
+        f'data1|stem|h1|c1|d1|1||{_days(built)}|s10b|2048|rds|local|vector|||0.5||',
+        'broken|stem||c3|d3|3|||||rds|local|vector|||0.1||object not found',
+    ])
+
+    result = CliRunner().invoke(pipeline, ['status'])
+    assert result.exit_code == 0, result.output
+    assert 'pipelines' in result.output and '2 targets, 1 errored' in result.output
+    assert 'h1' in result.output and 'broken: object not found' in result.output
+
+    result = CliRunner().invoke(pipeline, ['status', '--errored'])
+    assert 'data1' not in result.output
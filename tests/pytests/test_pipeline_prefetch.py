@@ -0,0 +1,64 @@
+import threading
+from click.testing import CliRunner
+from fluke.cli.pipeline import pipeline
+from fluke.pipelines.prefetch import Prefetcher, dataset_path_targets
+from fluke.pipelines.profile import downstream_closure
+
+# `stations` and `address` as created by `use_dataset`, `summary` needs neither
+GRAPH = {
+    'stations_path': [], 'stations_data': ['stations_path'],
+    'address_path': [], 'joined': ['stations_data', 'address_path'],
+    'summary': [], 'report': ['summary', 'joined']
+}
+
+
+def test_dataset_path_targets():
+    assert dataset_path_targets(GRAPH, ['stations', 'address', 'other']) == {
+        'stations': 'stations_path', 'address': 'address_path'}
+    assert downstream_closure(GRAPH, ['address_path']) == {
+        'address_path', 'joined', 'report'}
+
+
+def test_prefetch_makes_unblocked_targets_first():
+    release = threading.Event()
+    rounds = []
+
+    def make(names):
+        rounds.append(sorted(names))
+        # the slow dataset is only fetched once the first round started
+        release.set()
+
+    fetches = {
+        'stations': lambda: None,
+        'address': lambda: (release.wait(5), None)[1]
+    }
+    prefetcher = Prefetcher(
+        GRAPH, fetches, dataset_path_targets(GRAPH, fetches), make, jobs=2)
+    results = prefetcher.run()
+
+    assert [res.status for res in results] == ['ok', 'ok']
+    assert 'summary' in rounds[0]
+    assert not {'address_path', 'joined', 'report'} & set(rounds[0])
+    assert sorted(sum(rounds, [])) == sorted(GRAPH)
+    assert not prefetcher.blocked
+
+
+def test_prefetch_failed_dataset_blocks_downstream():
+    def fail():
+        raise Exception('download failed')
+
+    rounds = []
+    prefetcher = Prefetcher(
+        GRAPH, {'stations': lambda: None, 'address': fail},
+        {'stations': 'stations_path', 'address': 'address_path'},
+        rounds.append, jobs=1, keep_going=True)
+    results = prefetcher.run()
+
+    assert [res.status for res in results] == ['ok', 'failed']
+    assert prefetcher.blocked == {'address_path', 'joined', 'report'}
+    assert set(sum(rounds, [])) == {'stations_path', 'stations_data', 'summary'}
+
+
+def test_run_prefetch_usage(project_directory):
+    result = CliRunner().invoke(pipeline, ['run', '--prefetch', '--target', 'x'])
+    assert result.exit_code != 0 and '`--prefetch`' in result.output
@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+import pytest
+from click.testing import CliRunner
+from fluke.cli.pipeline import pipeline
+from fluke.pipelines.profile import (
+    TargetProfile,
+    critical_path,
+    profile_pipeline,
+    scheduled_makespan
+)
+from fluke.pipelines.meta import read_meta
+from .utils import write_targets_meta
+
+# a -> b -> d, a -> c -> d, e on its own
+GRAPH = {'a': [], 'b': ['a'], 'c': ['a'], 'd': ['b', 'c'], 'e': []}
+SECONDS = {'a': 1.0, 'b': 4.0, 'c': 2.0, 'd': 1.0, 'e': 3.0}
+
+
+def _targets():
+    return {
+        name: TargetProfile(name, SECONDS[name], deps=deps)
+        for name, deps in GRAPH.items()
+    }
+
+
+def _meta_rows():
+    rows = [
+        f'{name}|stem|h{name}|c|d|1|||s1b|{int(SECONDS[name] * 100)}|rds|local|vector|||'
+        f'{SECONDS[name]}||'
+        for name in ('a', 'b', 'd', 'e')
+    ]
+    # `c` is a pattern with two branches
+    rows.append('c|pattern|hc|c|d|1|||||rds|local|vector||c_1*c_2|||')
+    rows.append('c_1|branch|h1|c|d|1|||s1b|50|rds|local|vector|c||1.5||')
+    rows.append('c_2|branch|h2|c|d|1|||s1b|70|rds|local|vector|c||0.5||')
+    return rows
+
+
+def test_critical_path():
+    seconds, path = critical_path(_targets())
+    assert seconds == 6.0 and path == ['a', 'b', 'd']
+    assert critical_path({}) == (0.0, [])
+
+
+def test_scheduled_makespan():
+    targets = _targets()
+    assert scheduled_makespan(targets, 1) == sum(SECONDS.values())
+    # the critical path bounds any number of workers
+    assert scheduled_makespan(targets, 2) == 6.0
+    assert scheduled_makespan(targets, 8) == 6.0
+
+
+def test_profile_pipeline(tmp_path: Path):
+    write_targets_meta(tmp_path, _meta_rows())
+    result = profile_pipeline(read_meta(tmp_path), GRAPH, workers=(1, 2),
+        achieved_seconds=8.0)
+
+    # pattern seconds and bytes are summed over branches
+    assert result.targets['c'].seconds == 2.0 and result.targets['c'].bytes == 120
+    assert result.total_seconds == 11.0 and result.critical_path == ['a', 'b', 'd']
+    assert [t.name for t in result.slowest(2)] == ['b', 'e']
+    assert [t.name for t in result.largest(1)] == ['b']
+    one, two = result.headroom
+    assert one.ideal_seconds == 11.0 and one.scheduled_speedup == 1.0
+    assert two.ideal_seconds == 6.0 and two.scheduled_seconds == 6.0
+    assert result.achieved_speedup == pytest.approx(11.0 / 8.0)
+
+
+def test_pipeline_profile_cli(project_directory: Path, monkeypatch: pytest.MonkeyPatch):
+    write_targets_meta(Path(project_directory, '_targets'), _meta_rows())
+    monkeypatch.setattr('fluke.cli.pipeline.pipeline_graph', lambda: dict(GRAPH))
+
+    result = CliRunner().invoke(pipeline, ['profile', '-w', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'critical path 6.0s' in result.output
+    assert 'Parallelism headroom' in result.output
+
+    result = CliRunner().invoke(pipeline, ['profile', '--json', '--top', '1'])
+    content = json.loads(result.output)
+    assert [t['name'] for t in content['critical_path']['targets']] == ['a', 'b', 'd']
+    assert [t['name'] for t in content['slowest']] == ['b']
+    assert [h['workers'] for h in content['headroom']] == [1, 2, 4, 8]
@@ -0,0 +1,121 @@
+import sys
+import time
+from pathlib import Path
+import pytest
+from fluke.config.pipelines import PipelineResources, PipelinesConfig, parse_memory
+from fluke.pipelines import PipelineRun, available_memory, run_pipelines
+from fluke.pipelines.runner import pipeline_make_cmd
+
+# stands in for Rscript: logs start and end times of the pipeline named in the source
+FAKE_RSCRIPT = f"""#!{sys.executable}
+import re, sys, time
+name = re.findall(r"name = '(.+?)'", sys.argv[-1])[0]
+log = open(sys.argv[0] + '.log', 'a')
+log.write(f'start {{name}} {{time.time()!r}}\\n'); log.flush()
+print(f'making {{name}}', flush=True)
+time.sleep(0.2)
+log.write(f'end {{name}} {{time.time()!r}}\\n')
+sys.exit(1 if name.startswith('bad') else 0)
+"""
+
+
+@pytest.fixture
+def rscript(tmp_path: Path) -> Path:
+    path = Path(tmp_path, 'Rscript')
+    path.write_text(FAKE_RSCRIPT)
+    path.chmod(0o755)
+    return path
+
+
+def _intervals(rscript: Path):
+    times = {}
+    for line in Path(f'{rscript}.log').read_text().splitlines():
+        event, name, stamp = line.split()
+        times.setdefault(name, {})[event] = float(stamp)
+    return times
+
+
+def _overlap(a, b) -> bool:
+    return a['start'] < b['end'] and b['start'] < a['end']
+
+
+def _run(name: str, workers: int = 1, memory=None) -> PipelineRun:
+    return PipelineRun(name, Path('store', name), PipelineResources(workers, memory))
+
+
+def test_parse_memory():
+    assert parse_memory(512) == 512 << 20
+    assert parse_memory('4G') == 4 << 30
+    assert parse_memory('1.5GiB') == int(1.5 * (1 << 30))
+    with pytest.raises(Exception, match='memory'):
+        parse_memory('lots')
+
+
+def test_pipelines_config_resources(project_directory: Path):
+    Path(project_directory, 'config', 'pipelines.yaml').write_text(
+        'pipelines:\n  version: v1\n  workers: 2\n'
+        'a:\n  resources:\n    workers: 4\n    memory: 1G\n'
+        'b:\n  alpha: 0.5\n'
+    )
+    config = PipelinesConfig()
+    assert config.pipeline_store('a') == Path(
+        project_directory, 'pipelines', 'store', 'v1', 'pipelines', 'a')
+    assert config.resources('a') == PipelineResources(4, 1 << 30)
+    assert config.resources('b') == PipelineResources(2, None)
+
+
+def test_available_memory(tmp_path: Path):
+    meminfo = Path(tmp_path, 'meminfo')
+    meminfo.write_text('MemTotal: 2048 kB\nMemAvailable:    1024 kB\n')
+    assert available_memory(meminfo) == 1024 * 1024
+    assert available_memory(Path(tmp_path, 'missing')) is None
+
+
+def test_pipeline_make_cmd():
+    cmd = pipeline_make_cmd('a', Path('pipelines/store/v1/pipelines/a'), workers=3)
+    assert "targets::tar_make_future" in cmd and 'workers = 3' in cmd
+    assert "store = 'pipelines/store/v1/pipelines/a'" in cmd
+    assert 'tar_make(' in pipeline_make_cmd('a', Path('store'))
+
+
+def test_run_pipelines_prefixes_output(rscript: Path, capsys: pytest.CaptureFixture):
+    results = run_pipelines([_run('a'), _run('b')], max_workers=2,
+        rscript=str(rscript), poll_interval=0.01)
+    assert [res.status for res in results] == ['ok', 'ok']
+    out = capsys.readouterr().out.splitlines()
+    assert '[a] making a' in out and '[b] making b' in out
+
+    times = _intervals(rscript)
+    assert _overlap(times['a'], times['b'])
+
+
+def test_run_pipelines_admission(rscript: Path):
+    # `big` takes every worker, the small ones can run together
+    runs = [_run('big', workers=4), _run('small1'), _run('small2')]
+    run_pipelines(runs, max_workers=2, rscript=str(rscript), poll_interval=0.01)
+    times = _intervals(rscript)
+    assert not _overlap(times['big'], times['small1'])
+    assert not _overlap(times['big'], times['small2'])
+    assert _overlap(times['small1'], times['small2'])
+
+
+def test_run_pipelines_memory(rscript: Path):
+    runs = [_run('a', memory=3 << 30), _run('b', memory=3 << 30), _run('c')]
+    run_pipelines(runs, max_workers=3, rscript=str(rscript),
+        meminfo=lambda: 4 << 30, poll_interval=0.01)
+    times = _intervals(rscript)
+    assert not _overlap(times['a'], times['b'])
+    # runs without a memory requirement are only limited by workers
+    assert _overlap(times['a'], times['c'])
+
+
+def test_run_pipelines_fail_fast(rscript: Path):
+    runs = [_run('bad'), _run('a'), _run('b')]
+    results = run_pipelines(runs, max_workers=1, rscript=str(rscript),
+        poll_interval=0.01)
+    assert [res.status for res in results] == ['failed', 'cancelled', 'cancelled']
+    assert 'exit code 1' in str(results[0].error)
+
+    results = run_pipelines(runs, max_workers=1, keep_going=True,
+        rscript=str(rscript), poll_interval=0.01)
+    assert [res.status for res in results] == ['failed', 'ok', 'ok']
@@ -0,0 +1,148 @@
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+import pytest
+from click.testing import CliRunner
+import fluke
+from fluke.cli.pipeline import pipeline
+from fluke.config.pipelines import PipelinesConfig
+from fluke.pipelines.meta import TargetMeta, read_meta
+from fluke.pipelines.shard import (
+    ShardPlan,
+    plan_shards,
+    read_plan,
+    run_shard,
+    shards_dir,
+    write_plan
+)
+from .utils import TARGETS_META_HEADER
+
+# a -> b -> d, a -> c -> d, with c slow enough to get its own shard
+GRAPH = {'a': [], 'b': ['a'], 'c': ['a'], 'd': ['b', 'c'], 'e': []}
+
+# stands in for Rscript: prints the graph, or makes the targets named in the
+# source into the store, failing if a dependency is not in the store
+FAKE_RSCRIPT = f"""#!{sys.executable}
+import json, os, re, sys, time
+src = sys.argv[-1]
+graph = json.loads(os.environ['FAKE_GRAPH'])
+if '<<fluke-graph>>' in src:
+    for name, deps in graph.items():
+        print('<<fluke-graph>>', name, ','.join(deps), 'TRUE', sep='\\t')
+    sys.exit(0)
+names = re.findall(r'"(.+?)"', re.search(r'names = c\\((.*?)\\)', src).group(1))
+store = re.search(r"store = '(.+?)'", src).group(1)
+os.makedirs(os.path.join(store, 'objects'), exist_ok=True)
+os.makedirs(os.path.join(store, 'meta'), exist_ok=True)
+meta = os.path.join(store, 'meta', 'meta')
+for name in names:
+    for dep in graph[name]:
+        if not os.path.exists(os.path.join(store, 'objects', dep)):
+            print(f'missing {{dep}} for {{name}}')
+            sys.exit(1)
+    time.sleep(0.05)
+    open(os.path.join(store, 'objects', name), 'w').write(name)
+    new = not os.path.exists(meta)
+    with open(meta, 'a') as file:
+        if new:
+            file.write({TARGETS_META_HEADER!r} + '\\n')
+        file.write(f'{{name}}|stem|h|c|d||||s1b|1|rds|||||0.05||\\n')
+    print(f'made {{name}}', flush=True)
+"""
+
+
+@pytest.fixture
+def rscript(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = Path(tmp_path, 'Rscript')
+    path.write_text(FAKE_RSCRIPT)
+    path.chmod(0o755)
+    monkeypatch.setenv('FAKE_GRAPH', json.dumps(GRAPH))
+    monkeypatch.setenv('FLUKE_RSCRIPT', str(path))
+    monkeypatch.setattr('fluke.rpool.RSCRIPT', str(path))
+    # shards are started as `python -c 'from fluke.cli import main; ...'`
+    monkeypatch.setenv('PYTHONPATH', str(Path(fluke.__file__).parents[1]))
+    return path
+
+
+def test_plan_shards():
+    seconds = {'a': 1.0, 'b': 1.0, 'c': 5.0, 'd': 1.0, 'e': 1.0}
+    meta = {name: TargetMeta(name, 'stem', seconds=s) for name, s in seconds.items()}
+    plan = plan_shards(GRAPH, meta, 2)
+    assert plan.n == 2
+    assert sorted(sum(plan.shards, [])) == sorted(GRAPH)
+    # each shard lists its targets after their dependencies
+    for shard in plan.shards:
+        for name in shard:
+            assert all(shard.index(dep) < shard.index(name)
+                for dep in GRAPH[name] if dep in shard)
+    # the slow target runs alongside the others
+    (slow,) = [shard for shard in plan.shards if 'c' in shard]
+    assert 'b' not in slow and 'e' not in slow
+
+
+def test_run_shard_in_order(project_directory: Path, rscript: Path):
+    store = PipelinesConfig().store
+    plan = plan_shards(GRAPH, {}, 1)
+    write_plan(store, plan)
+    assert read_plan(store).shards == plan.shards
+    assert run_shard(store, 0, 1) == plan.shards[0]
+    assert set(read_meta(store)) == set(GRAPH)
+    # shards run again resume from the targets already made
+    assert run_shard(store, 0, 1) == []
+    with pytest.raises(Exception, match='do not match'):
+        run_shard(store, 0, 2)
+
+
+def test_run_sharded_local_processes(project_directory: Path, rscript: Path):
+    store = PipelinesConfig().store
+    result = CliRunner().invoke(pipeline, ['run', '--shards', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Planned 5 targets in 2 shards' in result.output
+    assert '[shard 1/2]' in result.output and '[shard 2/2]' in result.output
+
+    # every target was made once, by two processes, into the shared store
+    made = re.findall(r'\[shard (\d)/2\] made (\w+)', result.output)
+    assert sorted(name for _, name in made) == sorted(GRAPH)
+    assert {shard for shard, _ in made} == {'1', '2'}
+    assert set(read_meta(store)) == set(GRAPH)
+    for name in GRAPH:
+        assert Path(store, 'objects', name).read_text() == name
+
+
+def test_run_shard_usage(project_directory: Path):
+    result = CliRunner().invoke(pipeline, ['run', '--shard', '3/2'])
+    assert result.exit_code != 0 and 'I/N' in result.output
+
+
+def _waiting_plan(store: Path, run_id: str) -> ShardPlan:
+    # shard 2 waits on `a`, made by shard 1
+    plan = ShardPlan(run_id, [['a'], ['b']], {'a': [], 'b': ['a']})
+    write_plan(store, plan)
+    return plan
+
+
+def test_run_shard_timeout(project_directory: Path):
+    store = PipelinesConfig().store
+    _waiting_plan(store, 'timeout')
+    result = CliRunner().invoke(
+        pipeline, ['run', '--shard', '2/2', '--shard-timeout', '0.2'])
+    assert result.exit_code != 0 and 'timed out' in result.output
+    # the failure is recorded for the other shards
+    assert Path(shards_dir(store), 'timeout', 'failed', '1').exists()
+
+
+def test_run_shard_stale_heartbeat(project_directory: Path):
+    store = PipelinesConfig().store
+    _waiting_plan(store, 'killed')
+    # shard 1 started, then was killed without recording a failure
+    heartbeat = Path(shards_dir(store), 'killed', 'heartbeat', '0')
+    heartbeat.parent.mkdir(parents=True)
+    heartbeat.touch()
+    stamp = time.time() - 120
+    os.utime(heartbeat, (stamp, stamp))
+    with pytest.raises(Exception, match='shard 1 sent no heartbeat'):
+        run_shard(store, 1, 2, poll_interval=0.05, stale_after=60)
+    assert Path(shards_dir(store), 'killed', 'heartbeat', '1').exists()
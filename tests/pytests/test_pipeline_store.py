@@ -0,0 +1,58 @@
+from pathlib import Path
+import pytest
+import yaml
+from click.testing import CliRunner
+from fluke.cli.pipeline import pipeline
+from fluke.pipelines.store import clone_store
+
+
+def _make_store(store: Path) -> None:
+    Path(store, 'objects').mkdir(parents=True)
+    Path(store, 'meta').mkdir()
+    Path(store, 'objects', 'data1').write_bytes(b'object')
+    Path(store, 'meta', 'meta').write_text('name|type\ndata1|stem\n')
+
+
+def test_clone_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    src, dst = Path(tmp_path, 'v1'), Path(tmp_path, 'v2')
+    _make_store(src)
+    # as on filesystems without copy-on-write clones
+    monkeypatch.setattr('fluke.pipelines.store.reflink', lambda src, dst: False)
+
+    assert clone_store(src, dst) == {'hardlink': 1, 'copy': 1}
+    assert Path(dst, 'objects', 'data1').stat().st_ino == Path(
+        src, 'objects', 'data1').stat().st_ino
+    # files that `targets` appends to are not shared
+    with Path(dst, 'meta', 'meta').open('a') as file:
+        file.write('data2|stem\n')
+    assert 'data2' not in Path(src, 'meta', 'meta').read_text()
+    assert not list(tmp_path.glob('.*cloning'))
+
+    with pytest.raises(FileExistsError):
+        clone_store(src, dst)
+
+
+def test_clone_store_reflink(tmp_path: Path):
+    src, dst = Path(tmp_path, 'v1'), Path(tmp_path, 'v2')
+    _make_store(src)
+    methods = clone_store(src, dst)
+    assert sum(methods.values()) == 2 and set(methods) <= {'reflink', 'hardlink', 'copy'}
+    assert Path(dst, 'objects', 'data1').read_bytes() == b'object'
+
+
+def test_pipeline_run_seed_from(project_directory: Path, monkeypatch: pytest.MonkeyPatch):
+    config_path = Path(project_directory, 'config', 'pipelines.yaml')
+    config_path.write_text(yaml.safe_dump({'pipelines': {'version': 'v2'}}))
+    _make_store(Path(project_directory, 'pipelines', 'store', 'v1'))
+    cmds = []
+    monkeypatch.setattr('fluke.cli.pipeline.run_r', lambda src, *args, **kwargs: cmds.append(src))
+
+    result = CliRunner().invoke(pipeline, ['run', '--seed-from', 'v1'])
+    assert result.exit_code == 0, result.output
+    assert 'Seeded store `v2` from `v1`' in result.output and len(cmds) == 1
+    assert Path(project_directory, 'pipelines', 'store', 'v2', 'objects', 'data1').exists()
+
+    result = CliRunner().invoke(pipeline, ['run', '--seed-from', 'v1'])
+    assert result.exit_code != 0 and 'already exists' in result.output
+    result = CliRunner().invoke(pipeline, ['run', '--seed-from', 'v0'])
+    assert result.exit_code != 0 and 'No store found' in result.output
@@ -0,0 +1,91 @@
+import asyncio
+from pathlib import Path
+from typing import List, Optional
+import pytest
+from fluke.config.datasets import Datasets
+from fluke.datasets.query_dataset.jobs import _OUTPUT_MARKER, run_query_jobs
+from fluke.utils import cwd
+from .utils import add_datasets_yaml_payload
+
+
+class FakeBigQuery:
+    """Answers the submit and poll R commands, finishing jobs in `order`."""
+    def __init__(self, order: List[str], errors: Optional[dict] = None,
+    unknown: Optional[dict] = None):
+        self.order = list(order)
+        self.errors = errors or {}
+        # jobs whose status can never be read, with the R error
+        self.unknown = unknown or {}
+        self.polls = 0
+        self.events: List[str] = []
+
+    def run_r(self, src: str, *args, **kwargs) -> str:
+        if 'bq_perform_query' in src:
+            return '\n'.join(
+                f'{_OUTPUT_MARKER}\t{name}\tproject\tjob_{name}\tUS'
+                for name in ('stations', 'address')
+            )
+        self.polls += 1
+        done = self.order.pop(0) if self.order else None
+        self.events.append(f'done:{done}')
+        lines = []
+        for name in ('stations', 'address'):
+            if f'"{name}"' not in src:
+                continue
+            state = 'DONE' if name == done else 'RUNNING'
+            error = self.errors.get(name, '') if name == done else ''
+            if name in self.unknown:
+                state, error = 'UNKNOWN', self.unknown[name]
+            lines.append(f'{_OUTPUT_MARKER}\t{name}\t{state}\t{error}')
+        return 'Waiting...\n' + '\n'.join(lines)
+
+
+@pytest.fixture
+def datasets(project_directory: Path, dataset_config_path: Path, yaml_payload: str,
+monkeypatch: pytest.MonkeyPatch):
+    add_datasets_yaml_payload(dataset_config_path, yaml_payload)
+    with cwd(project_directory):
+        _datasets = Datasets()
+        for ds in _datasets:
+            monkeypatch.setattr(ds, '_prepare_query', lambda: None)
+            monkeypatch.setattr(ds, '_query_done', lambda: None)
+        yield [_datasets['stations'], _datasets['address']]
+
+
+def test_migrate_starts_when_own_job_is_done(datasets, monkeypatch: pytest.MonkeyPatch):
+    fake = FakeBigQuery(order=['stations', 'address'])
+    monkeypatch.setattr('fluke.datasets.query_dataset.jobs.run_r', fake.run_r)
+    for ds in datasets:
+        monkeypatch.setattr(ds, 'migrate',
+            lambda _name=ds.name, **kwargs: fake.events.append(f'migrate:{_name}'))
+
+    results = asyncio.run(run_query_jobs(
+        datasets, migrate=True, max_migrations=2, poll_interval=0))
+
+    assert [res.status for res in results] == ['ok', 'ok']
+    # one poll per round, each covering every pending job
+    assert fake.polls == 2
+    assert fake.events.index('migrate:stations') < fake.events.index('done:address')
+
+
+def test_failed_job_stops_polling(datasets, monkeypatch: pytest.MonkeyPatch):
+    fake = FakeBigQuery(order=['stations', 'address'], errors={'stations': 'Syntax error'})
+    monkeypatch.setattr('fluke.datasets.query_dataset.jobs.run_r', fake.run_r)
+
+    results = asyncio.run(run_query_jobs(datasets, poll_interval=0))
+    assert [res.status for res in results] == ['failed', 'cancelled']
+    assert 'Syntax error' in str(results[0].error)
+    assert fake.polls == 1
+
+
+def test_unreadable_job_status_fails_job(datasets, monkeypatch: pytest.MonkeyPatch):
+    fake = FakeBigQuery(order=['stations'], unknown={'address': 'Not found: Job'})
+    monkeypatch.setattr('fluke.datasets.query_dataset.jobs.run_r', fake.run_r)
+    for ds in datasets:
+        monkeypatch.setattr(ds, 'migrate', lambda **kwargs: None)
+
+    results = asyncio.run(run_query_jobs(
+        datasets, migrate=True, keep_going=True, poll_interval=0, max_unknown_polls=3))
+    assert [res.status for res in results] == ['ok', 'failed']
+    assert 'could not be read in 3 polls: Not found: Job' in str(results[1].error)
+    assert fake.polls == 3
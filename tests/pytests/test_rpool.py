@@ -0,0 +1,65 @@
+import shutil
+import pytest
+from fluke.rpool import (
+    HEALTH_TIMEOUT,
+    RSCRIPT,
+    RSession,
+    RSessionError,
+    RSessionPool,
+    _source_lines,
+    configure_pool
+)
+from fluke.utils import run_r
+
+requires_r = pytest.mark.skipif(shutil.which(RSCRIPT) is None, reason='needs Rscript')
+
+
+@pytest.fixture
+def r_pool():
+    pool = RSessionPool(2, preload=[])
+    yield pool
+    pool.close()
+
+
+@requires_r
+def test_pool_reuses_session(r_pool: RSessionPool):
+    first = r_pool.run('Sys.getpid()')
+    second = r_pool.run('Sys.getpid()')
+    assert first == second
+    assert r_pool.run('1 + 1').strip() == '[1] 2'
+
+
+@requires_r
+def test_pool_restarts_after_error(r_pool: RSessionPool):
+    pid = r_pool.run('Sys.getpid()')
+    with pytest.raises(RSessionError):
+        r_pool.run('stop("boom")')
+    assert r_pool.run('Sys.getpid()') != pid
+    assert r_pool.health_check() == 1
+
+
+@requires_r
+def test_run_r_pooled_fallback():
+    configure_pool(1, preload=[], rscript='/nonexistent/Rscript')
+    try:
+        result = run_r('cat("fallback")', ['-e'], quiet=True, pooled=True)
+    finally:
+        configure_pool(0)
+    assert result == 'fallback'
+
+
+def test_source_lines_match_read_lines():
+    # only line feeds and carriage returns end lines for `readLines`
+    assert _source_lines('a <- "x\fy\u2028z\x1c"\nb\r\nc\rd\n') == [
+        'a <- "x\fy\u2028z\x1c"', 'b', 'c', 'd']
+    assert _source_lines('x\n\n') == ['x', '']
+    assert _source_lines('') == []
+
+
+def test_health_ping_timeout(monkeypatch: pytest.MonkeyPatch):
+    timeouts = []
+    session = RSession(timeout=3600.0)
+    monkeypatch.setattr(session, 'run', lambda src, timeout=None: timeouts.append(timeout))
+    assert session.is_healthy()
+    # a session stuck at startup is not waited on for the commands' timeout
+    assert timeouts == [HEALTH_TIMEOUT]
@@ -0,0 +1,59 @@
+import json
+import re
+import sys
+import time
+from pathlib import Path
+import pytest
+from fluke.trace import get_tracer, run_traced, span, start_trace, stop_trace
+
+# stands in for Rscript: writes the marks the instrumented source asks for
+FAKE_RSCRIPT = f"""#!{sys.executable}
+import re, sys, time
+src = sys.argv[-1]
+marks_path = re.findall(r'writeLines\\(.*"(.+?)"\\)', src)[0]
+marks = [time.time()]
+time.sleep(0.01)
+marks.append(time.time())
+print('hello from R')
+marks.append(time.time())
+open(marks_path, 'w').write(' '.join(repr(m) for m in marks))
+"""
+
+
+@pytest.fixture
+def trace_path(tmp_path: Path):
+    path = Path(tmp_path, 'trace.json')
+    start_trace(path)
+    yield path
+    stop_trace()
+
+
+def test_spans_written_as_chrome_trace(trace_path: Path):
+    with span('migrate', dataset='stations') as args:
+        args['rows'] = 10
+    stop_trace()
+    assert get_tracer() is None
+
+    events = json.loads(trace_path.read_text())['traceEvents']
+    migrate, = [e for e in events if e['ph'] == 'X']
+    assert migrate['name'] == 'migrate' and migrate['dur'] >= 0
+    assert migrate['args'] == {'dataset': 'stations', 'rows': 10}
+    assert any(e['ph'] == 'M' and e['tid'] == migrate['tid'] for e in events)
+
+
+def test_run_traced_splits_r_stages(trace_path: Path, tmp_path: Path):
+    rscript = Path(tmp_path, 'Rscript')
+    rscript.write_text(FAKE_RSCRIPT)
+    rscript.chmod(0o755)
+
+    code, stdout, _ = run_traced(
+        [str(rscript), '-e', 'bigrquery::bq_table_exists(tbl)'], capture_output=True)
+    assert code == 0 and stdout.decode().strip() == 'hello from R'
+    stop_trace()
+
+    events = {e['name']: e for e in json.loads(trace_path.read_text())['traceEvents']
+        if e['ph'] == 'X'}
+    assert set(events) == {'run_r', 'R spawn', 'R package load', 'R script', 'R exit'}
+    assert events['R package load']['dur'] >= 10000
+    assert events['run_r']['args']['packages'] == ['bigrquery']
+    assert events['run_r']['args']['peak_rss_kb'] > 0
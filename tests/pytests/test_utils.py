@@ -0,0 +1,39 @@
+from pathlib import Path
+import click
+import pytest
+from fluke.utils import (
+    PROJECT_ROOT_ENVVAR,
+    _root_proj_cache,
+    cwd,
+    find_root_proj,
+    format_bytes
+)
+
+
+def test_find_root_proj_cached_per_cwd(project_directory: Path, tmp_path: Path):
+    nested = Path(project_directory, 'datasets')
+    with cwd(nested):
+        assert find_root_proj() == project_directory
+        assert _root_proj_cache[str(nested.resolve())] == project_directory
+        assert find_root_proj() == project_directory
+
+    # leaving the project must not reuse the cached root
+    with cwd(tmp_path), pytest.raises(click.UsageError):
+        find_root_proj()
+
+
+def test_find_root_proj_envvar(project_directory: Path, tmp_path: Path,
+monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv(PROJECT_ROOT_ENVVAR, str(project_directory))
+    with cwd(tmp_path):
+        assert find_root_proj() == project_directory
+
+    monkeypatch.setenv(PROJECT_ROOT_ENVVAR, str(Path(tmp_path, 'missing')))
+    with pytest.raises(click.UsageError):
+        find_root_proj()
+
+
+def test_format_bytes():
+    assert format_bytes(512) == '512 B'
+    assert format_bytes(1536) == '1.5 KB'
+    assert format_bytes(3 * 1024 ** 3) == '3.0 GB'
@@ -21,3 +21,14 @@ def add_datasets_yaml_payload(
             yaml.safe_load(yaml_payload),
             config)
     return
+
+
+TARGETS_META_HEADER = ('name|type|data|command|depend|seed|path|time|size|bytes|format|'
+    'repository|iteration|parent|children|seconds|warnings|error')
+
+
+def write_targets_meta(store: Path, rows) -> None:
+    """Write a `targets` meta file with `rows` (pipe-delimited) into `store`."""
+    Path(store, 'meta').mkdir(parents=True, exist_ok=True)
+    Path(store, 'meta', 'meta').write_text(
+        '\n'.join([TARGETS_META_HEADER] + list(rows)) + '\n')